@@ -0,0 +1,70 @@
+'''
+capture.py の backend の速さ比べ
+
+    python benchmarks/bench_capture.py                   # 合成したpcapで
+    python benchmarks/bench_capture.py --pcap capture.pcap
+
+使えるものを全部同じファイルで読んで、セグメント数/秒と MB/秒を出す。
+capture.BACKENDS はこの結果の速い順に並べておく。
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from lmapi.bpf import CaptureFilter  # noqa: E402
+from lmapi.capture import BACKENDS  # noqa: E402
+from lmapi.synth import iter_messages, write_pcap  # noqa: E402
+
+
+def bench(pcap: str, repeat: int) -> dict[str, dict]:
+    size = os.path.getsize(pcap)
+    results = {}
+    for backend in BACKENDS:
+        if not backend.available():
+            print(f"{backend.name:10} not available")
+            continue
+        best = float("inf")
+        n = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            n = sum(1 for _ in backend().read_file(pcap, CaptureFilter()))
+            best = min(best, time.perf_counter() - started)
+        results[backend.name] = {
+            "segments": n,
+            "segments_per_sec": n / best,
+            "bytes_per_sec": size / best,
+        }
+        print(f"{backend.name:10} {n:8} segments "
+              f"{n/best:12,.0f} seg/s {size/best/1024/1024:8.2f} MB/s")
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pcap", help="read this file instead")
+    parser.add_argument("--count", type=int, default=20000,
+                        help="messages in the synthetic pcap")
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pcap = args.pcap
+    if pcap is None:
+        pcap = os.path.join(tempfile.mkdtemp(), "bench_capture.pcap")
+        write_pcap(pcap, iter_messages(), count=args.count, flows=2,
+                   noise=args.noise)
+    results = bench(pcap, args.repeat)
+    if len({r["segments"] for r in results.values()}) > 1:
+        print("WARNING: backends returned different numbers of segments")
+        return 1
+    fastest = max(results, key=lambda k: results[k]["bytes_per_sec"])
+    print(f"fastest: {fastest}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+'''
+decoder のスループット計測
+
+    # 計測して history.jsonl に追記
+    python benchmarks/bench_decoders.py
+    # 名前に ac08 を含むものだけ
+    python benchmarks/bench_decoders.py -k ac08
+    # 本物のpcapから corpus.json を作り直す
+    python benchmarks/bench_decoders.py --record capture.pcap
+
+同じマシン・同じPythonで記録された直近 --baseline 回の中央値より
+--threshold (既定 20%) 以上遅くなったものがあれば終了コード1で終わる。
+遅くなった回は基準に入れないよう、history.jsonl には書かない。
+
+計測対象
+- lmpacket.py の各 decoder (__read_ac08 など) と read_packet
+- hex_funcs.py の関数
+- Framer (read_pcapfile の framing ループ) と read_pcapfile 本体(scapyがあれば)
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from lmapi import lmpacket  # noqa: E402
+from lmapi.framer import Framer  # noqa: E402
+from lmapi.hex_funcs import (  # noqa: E402
+    guid2xy, hexstr2float, hexstr2int, hexstr2str,
+)
+from lmapi.synth import write_pcap_header, write_tcp_record  # noqa: E402
+
+CORPUS = os.path.join(HERE, "corpus.json")
+HISTORY = os.path.join(HERE, "history.jsonl")
+
+# code(の先頭) -> decoder
+DECODERS = {
+    "5e0d": "__read_5e0d",
+    "ac080c": "__read_ac080c",
+    "ac08": "__read_ac08",
+    "f20a": "__read_f20a",
+    "310b00": "__read_310b00",
+    "2b0b12": "__read_2b0b12",
+    "2b0b13": "__read_2b0b13",
+    "060b00": "__read_060b00",
+    "370b00": "__read_370b00",
+    "7f0500": "__read_7f0500",
+    "bb0b00": "__read_bb0b00",
+    "2a0b00": "__read_2a0b00",
+    "232000": "__read_232000",
+}
+
+
+def decoder_for(code: str) -> Callable:
+    for prefix, name in DECODERS.items():
+        if code.startswith(prefix):
+            func = getattr(lmpacket, name)
+            if name == "__read_370b00":
+                return lambda d: func(d, 0)
+            return func
+    raise KeyError(code)
+
+
+def load_corpus(path: str = CORPUS) -> dict[str, list[str]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["messages"]
+
+
+def measure(func: Callable, inputs: list, nmsgs: int, nbytes: int,
+            min_time: float, repeat: int) -> dict:
+    '''
+    inputs を1周ずつ回して、一番速かった回を採用する。
+    1周で nmsgs 件, nbytes バイト処理したものとして数える
+    '''
+    best = 0.0
+    for _ in range(repeat):
+        n = 0
+        started = time.perf_counter()
+        while True:
+            for x in inputs:
+                func(x)
+            n += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = max(best, n / elapsed)
+    return {
+        "msgs_per_sec": best * nmsgs,
+        "bytes_per_sec": best * nbytes,
+    }
+
+
+def split_stream(messages: list[str], seed=0) -> list[str]:
+    '''TCPのセグメントっぽく適当な長さに切る'''
+    rnd = random.Random(seed)
+    stream = "".join(messages)
+    segments = []
+    i = 0
+    while i < len(stream):
+        n = rnd.randint(1, 1400) * 2
+        segments.append(stream[i:i+n])
+        i += n
+    return segments
+
+
+def write_pcap(path: str, segments: list[str]) -> None:
+    '''Ethernet/IPv4/TCP(sport=5991)で包んだだけの.pcap'''
+    with open(path, "wb") as f:
+        write_pcap_header(f)
+        for i, seg in enumerate(segments):
+            write_tcp_record(f, 1650000000 + i/100, bytes([47, 74, 0, 1]),
+                             bytes([10, 0, 0, 2]), 5991, 50000, i,
+                             bytes.fromhex(seg))
+
+
+def run(corpus: dict[str, list[str]], min_time: float, repeat: int,
+        keyword: str = "") -> dict[str, dict]:
+    # (名前, 関数, 入力, 1周あたりのバイト数)
+    cases: list[tuple[str, Callable, list, int]] = []
+    for code, messages in sorted(corpus.items()):
+        nbytes = sum(len(m)//2 for m in messages)
+        cases.append((f"decoder[{code}]", decoder_for(code), messages,
+                      nbytes))
+    all_messages = [m for ms in corpus.values() for m in ms]
+    all_bytes = sum(len(m)//2 for m in all_messages)
+    codes = list(corpus)
+    cases.append(("read_packet[all]",
+                  lambda d: lmpacket.read_packet(d, codes, []),
+                  all_messages, all_bytes))
+
+    ints = [m[i:i+n] for m in all_messages[:50]
+            for i, n in ((0, 4), (18, 8), (10, 16))]
+    names = [m[72:98] for m in corpus.get("bb0b00", [])] or ["00"*13]
+    floats = [m[22:30] for m in all_messages[:50]]
+    guids = ["5a0b3f", "000000", "ff0fff", "12034e"]
+    cases += [
+        ("hex[hexstr2int]", hexstr2int, ints, sum(len(x)//2 for x in ints)),
+        ("hex[hexstr2str]", hexstr2str, names,
+         sum(len(x)//2 for x in names)),
+        ("hex[hexstr2float]", hexstr2float, floats, 4*len(floats)),
+        ("hex[guid2xy]", guid2xy, guids, 3*len(guids)),
+    ]
+
+    random.Random(0).shuffle(all_messages)
+    segments = split_stream(all_messages)
+
+    def framing(_):
+        framer = Framer(codes)
+        for seg in segments:
+            framer.feed(seg)
+
+    def framing_decode(_):
+        framer = Framer(codes)
+        for seg in segments:
+            for _, data in framer.feed(seg):
+                lmpacket.read_packet(data, codes, [])
+
+    cases += [
+        ("framing[Framer]", framing, [None], all_bytes),
+        ("framing[Framer+read_packet]", framing_decode, [None], all_bytes),
+    ]
+    try:
+        from lmapi.pcapReader import read_pcapfile
+        import logging
+        logging.getLogger("lmapi.pcapReader").setLevel(logging.WARNING)
+        pcap = os.path.join(tempfile.mkdtemp(), "bench.pcap")
+        write_pcap(pcap, segments)
+        cases.append((
+            "read_pcapfile",
+            lambda _: read_pcapfile(pcap, codes, [], p=False, delim=0),
+            [None], all_bytes))
+    except ModuleNotFoundError as e:
+        print(f"skip read_pcapfile: {e}")
+
+    results = {}
+    for name, func, inputs, nbytes in cases:
+        if keyword not in name:
+            continue
+        # [None] は1回の呼び出しで corpus 全体を処理するもの
+        nmsgs = len(all_messages) if inputs == [None] else len(inputs)
+        results[name] = measure(func, inputs, nmsgs, nbytes, min_time,
+                                repeat)
+        r = results[name]
+        print(f"{name:32} {r['msgs_per_sec']:14,.0f} msg/s "
+              f"{r['bytes_per_sec']/1024/1024:10.2f} MB/s")
+    return results
+
+
+def load_history(path: str = HISTORY) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_regressions(results: dict, history: list[dict],
+                      threshold: float, baseline: int) -> list[str]:
+    same_env = [
+        h for h in history
+        if h["host"] == platform.node()
+        and h["python"] == platform.python_version()
+    ][-baseline:]
+    failures = []
+    for name, r in results.items():
+        past = [h["results"][name]["msgs_per_sec"]
+                for h in same_env if name in h["results"]]
+        if not past:
+            continue
+        base = statistics.median(past)
+        ratio = r["msgs_per_sec"] / base
+        if ratio < 1 - threshold:
+            failures.append(
+                f"{name}: {r['msgs_per_sec']:,.0f} msg/s is "
+                f"{(1-ratio)*100:.1f}% slower than {base:,.0f} msg/s")
+    return failures
+
+
+def record_corpus(pcapfile: str, per_code: int, path: str = CORPUS) -> None:
+    '''pcapから code ごとに per_code 件ずつ取り出して corpus にする'''
+    from lmapi.index import build_index, read_message
+    from lmapi.pcapfile import read_header
+    index = build_index(pcapfile, save=False)
+    messages: dict[str, list[str]] = {}
+    with open(pcapfile, "rb") as f:
+        header = read_header(f)
+        for entry in index.entries:
+            try:
+                decoder_for(entry.code)
+            except KeyError:
+                continue
+            picked = messages.setdefault(entry.code, [])
+            if len(picked) < per_code:
+                picked.append(read_message(f, header, entry,
+                                           flow=index.flows[entry.flow]))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"comment": f"recorded from {os.path.basename(pcapfile)}",
+                   "messages": messages}, f, indent=1)
+    print(f"recorded {sum(map(len, messages.values()))} messages "
+          f"of {len(messages)} codes")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-k", "--keyword", default="")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--history", default=HISTORY)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--baseline", type=int, default=5)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--record", metavar="PCAP")
+    parser.add_argument("--per-code", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_corpus(args.record, args.per_code, args.corpus)
+        return 0
+
+    results = run(load_corpus(args.corpus), args.min_time, args.repeat,
+                  args.keyword)
+    failures = check_regressions(results, load_history(args.history),
+                                 args.threshold, args.baseline)
+    if not args.no_save and not failures:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "time": time.time(),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "results": results,
+            }) + "\n")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
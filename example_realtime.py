@@ -1,55 +1,51 @@
-from typing import Callable
+import shutil
 import sys
 from scapy.all import sniff
-from lmapi.pcapReader import (
-    get_extracted_packet,
-    read_packet
-)
-from lmapi.hex_funcs import hexstr2int
-
-d = ""
-
-
-def pkt_handler(packet, codes, codestartswith, pfunc: Callable = None):
-    global d
-    _dd = get_extracted_packet(packet)
-    if _dd is None:
-        return
-    dd, timestamp = _dd
-    d += dd
-    while True:
-        if len(d) < 10:
-            break
-        __length = hexstr2int(d[:4])*2
-        if len(d) >= __length:
-            data = d[:__length]
-            d = d[__length:]
-        else:
-            break
-
-        result = None
-        try:
-            result = read_packet(data, codes, codestartswith)
-        except NotImplementedError:
-            pass
-        if result:
-            for r in result:
-                if pfunc is None:
-                    print(r)
-                else:
-                    pfunc(r)
-        else:
-            pass
+from lmapi.bpf import CaptureFilter
+from lmapi.bus import EventBus
+from lmapi.capture import ScapyBackend
+from lmapi.shedding import LoadShedder
+from lmapi.sinks import ConsoleSink
+
+# 受け手ごとに subscribe する。decode は1回だけ、必要な code だけ
+# see lmapi/lmpacket.py
+# 追いつけなくなったら大きなマップなどを捨てて、ギフトを遅らせない
+shedder = LoadShedder()
+bus = EventBus(shedder=shedder)
+# 表示は別スレッドで。端末が遅くてもdecodeは止まらない
+console = ConsoleSink(on_full="drop")
+# code starts with "ac08": show map info
+bus.subscribe(prefixes=["ac08"], sink=console)
+backend = ScapyBackend()
+capture_filter = CaptureFilter()
 
 
 def handler(packet):
-    # code starts with "ac08": show map info
-    # see lmapi/lmpacket.py
-    pkt_handler(packet, [], ["ac08"])
-
-
-sniff(
-    offline=sys.stdin.buffer,
-    prn=handler,
-    store=0
-)
+    segment = backend.segment(packet)
+    if segment is not None and capture_filter.accepts(segment):
+        bus.publish_segment(segment)
+
+
+# 関係ないパケットは Python まで上げない
+if len(sys.argv) > 1 and sys.argv[1] != "-":
+    # python example_realtime.py wlan0: フィルタはカーネルで
+    source = {"iface": sys.argv[1], "filter": capture_filter.bpf()}
+elif shutil.which("tcpdump"):
+    # 標準入力: scapy が tcpdump でフィルタする
+    source = {"offline": sys.stdin.buffer, "filter": capture_filter.bpf()}
+else:
+    source = {"offline": sys.stdin.buffer}
+
+try:
+    sniff(
+        prn=handler,
+        store=0,
+        **source
+    )
+finally:
+    bus.close()
+    console.close()
+    report = shedder.report()
+    if report["shed"]:
+        print(f"max lag {report['max_lag']:.1f}s, shed: {report['shed']}",
+              file=sys.stderr)
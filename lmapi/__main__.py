@@ -0,0 +1,84 @@
+'''
+python -m lmapi captures/ "old/*.pcap" -c 370b00 -p ac08 -o out.jsonl
+
+入力は .pcap, .cap と .lmarc (archive.py)
+
+出力先は -o の拡張子で決まる
+- .jsonl:                   JSONLSink
+- .sqlite3, .sqlite, .db:   SQLiteSink
+- .csv:                     CSVSink (out_Gift.csv, out_MapObject.csv, ...)
+- なし:                      画面に表示
+'''
+import argparse
+import os
+import sys
+from .batch import expand_inputs, run_batch
+from .capture import available_backends
+from .lmpacket import STRICT, VALIDATION_LEVELS
+from .sinks import ConsoleSink, CSVSink, JSONLSink, Sink
+
+
+def open_sink(output: str) -> Sink:
+    if not output:
+        return ConsoleSink()
+    base, ext = os.path.splitext(output)
+    if ext == ".jsonl":
+        return JSONLSink(output)
+    elif ext in (".sqlite3", ".sqlite", ".db"):
+        from .store import SQLiteSink
+        return SQLiteSink(output)
+    elif ext == ".csv":
+        return CSVSink(base)
+    raise ValueError(f"unknown output format: {output}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m lmapi",
+        description="decode many pcap files in parallel")
+    parser.add_argument("inputs", nargs="+",
+                        help="pcap files, directories or glob patterns")
+    parser.add_argument("-c", "--code", action="append", default=[],
+                        help="code to decode (repeatable)")
+    parser.add_argument("-p", "--prefix", action="append", default=[],
+                        help="code prefix to decode, e.g. ac08 (repeatable)")
+    parser.add_argument("--ip", action="append", default=[],
+                        help="server ip address (repeatable)")
+    parser.add_argument("-o", "--output", default="",
+                        help="out.jsonl, out.sqlite3 or out.csv")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--delim", type=int, default=80)
+    parser.add_argument("--validation", choices=VALIDATION_LEVELS,
+                        default=STRICT)
+    parser.add_argument("--backend", choices=available_backends(),
+                        help="capture backend (default: the fastest)")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="spill decoded results to temporary files "
+                        "beyond this size")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.code and not args.prefix:
+        parser.error("at least one --code or --prefix is required")
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error(f"no pcap files in {args.inputs}")
+    sink = open_sink(args.output)
+    try:
+        _, failed = run_batch(
+            paths, sink, args.code, args.prefix, ipaddrs=args.ip,
+            delim=args.delim, validation=args.validation, jobs=args.jobs,
+            progress=not args.quiet, backend=args.backend,
+            memory_budget=(None if args.memory_budget is None
+                           else int(args.memory_budget * 1024 * 1024)))
+    finally:
+        sink.close()
+    if sink.error is not None:
+        print(f"failed to write {args.output}: {sink.error}",
+              file=sys.stderr)
+        return 2
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+'''
+decode 結果をその場で集計する(タンブリング/スライディングウィンドウ)
+
+    agg = Aggregator()                     # DEFAULT_AGGREGATIONS
+    for r in follow_pcapfile(...):
+        agg.add(r)
+        ...
+    agg.window("gifts_per_hour")           # 直近のウィンドウ {key: 値}
+    agg.top("chat_per_guild", 5)
+    agg.save("agg.ckpt")                   # 再起動したら Aggregator.load
+
+ウィンドウは slide(タンブリングなら window)ごとの「ペイン」に分けて持つ。
+- 1件の追加はペイン1つの dict を更新するだけ
+- retention 個分のウィンドウより古いペインは捨てる
+- 捨てた範囲より古いイベントは数えずに late に数える
+- 一番新しいペイン(と今の時刻)より max_ahead 秒以上先のイベントは、
+  壊れた時刻とみて数えずに future に数える
+'''
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional, Union
+from .lmdataclass import Comment, Gift, HuntReport, ResultOpenChests
+from .sinks import Sink
+
+# レコードの型 -> イベント時刻のフィールド
+TIME_FIELDS: dict[type, str] = {
+    Gift: "time",
+    Comment: "time",
+    HuntReport: "time_stamp",
+}
+
+KeySpec = Union[tuple[str, ...], Callable[..., tuple]]
+ValueSpec = Union[str, Callable[..., float], None]
+
+
+@dataclass
+class Aggregation:
+    '''
+    - key:     フィールド名のタプルか、レコードからタプルを返す関数
+    - value:   足し合わせるフィールド名か関数。None なら件数
+    - window:  ウィンドウの長さ(秒)
+    - slide:   スライド幅(秒)。None ならタンブリング。window の約数にする
+    - retention: 残しておくウィンドウの数
+    - explode: リストのフィールド名。指定すると要素ごとに数える
+               (key, value の関数は (レコード, 要素) を受け取る)
+    - max_ahead: これより先の時刻は数えない(秒)
+    '''
+    name: str
+    record_type: type
+    key: KeySpec
+    value: ValueSpec = None
+    window: float = 3600
+    slide: Optional[float] = None
+    retention: int = 24
+    explode: Optional[str] = None
+    max_ahead: float = 86400
+
+    def __post_init__(self):
+        pane = self.slide or self.window
+        if self.window % pane:
+            raise ValueError(f"{self.name}: slide must divide window")
+
+    @property
+    def pane_size(self) -> float:
+        return self.slide or self.window
+
+    @property
+    def panes_per_window(self) -> int:
+        return int(self.window // self.pane_size)
+
+
+DEFAULT_AGGREGATIONS = [
+    Aggregation("gifts_per_hour", Gift, ("player", "gift_rank")),
+    Aggregation(
+        "chest_drops", ResultOpenChests,
+        key=lambda r, i: (r.chest_name, i.item_name),
+        value=lambda r, i: i.number_of_items,
+        explode="items"),
+    Aggregation("chat_per_guild", Comment, ("guild_tag",),
+                window=3600, slide=300, retention=12),
+    Aggregation("hunt_energy", HuntReport, ("monster_id",),
+                value="energy_used"),
+]
+
+
+def _extractor(spec, explode: bool) -> Callable:
+    if callable(spec):
+        return spec
+    if isinstance(spec, str):
+        if explode:
+            return lambda r, i: getattr(i, spec)
+        return lambda r: getattr(r, spec)
+    fields = tuple(spec)
+    if explode:
+        return lambda r, i: tuple(getattr(i, f) for f in fields)
+    return lambda r: tuple(getattr(r, f) for f in fields)
+
+
+class _State:
+    '''1つの Aggregation のペイン'''
+
+    def __init__(self, agg: Aggregation):
+        self.agg = agg
+        self.key = _extractor(agg.key, agg.explode is not None)
+        self.value = (None if agg.value is None
+                      else _extractor(agg.value, agg.explode is not None))
+        # ペイン番号 -> {key: 値}
+        self.panes: dict[int, dict[Any, float]] = {}
+        self.latest = -1
+        self.late = 0
+        self.future = 0
+        self.keep = agg.retention * agg.panes_per_window
+
+    def add(self, record, timestamp: float) -> None:
+        pane = int(timestamp // self.agg.pane_size)
+        if pane <= self.latest - self.keep:
+            self.late += 1
+            return
+        # 1件のおかしな時刻で全部のペインを捨ててしまわないように
+        watermark = max((self.latest + 1) * self.agg.pane_size, time.time())
+        if timestamp > watermark + self.agg.max_ahead:
+            self.future += 1
+            return
+        counts = self.panes.get(pane)
+        if counts is None:
+            counts = self.panes[pane] = {}
+            if pane > self.latest:
+                self.latest = pane
+                self._evict()
+        agg = self.agg
+        if agg.explode is None:
+            items = [(self.key(record),
+                      1 if self.value is None else self.value(record))]
+        else:
+            items = [(self.key(record, i),
+                      1 if self.value is None else self.value(record, i))
+                     for i in getattr(record, agg.explode)]
+        for k, v in items:
+            counts[k] = counts.get(k, 0) + v
+
+    def _evict(self) -> None:
+        cutoff = self.latest - self.keep
+        for pane in [p for p in self.panes if p <= cutoff]:
+            del self.panes[pane]
+
+    def window(self, end_pane: int) -> dict[Any, float]:
+        result: dict[Any, float] = {}
+        for pane in range(end_pane - self.agg.panes_per_window + 1,
+                          end_pane + 1):
+            for k, v in self.panes.get(pane, {}).items():
+                result[k] = result.get(k, 0) + v
+        return result
+
+
+class Aggregator:
+    def __init__(self,
+                 aggregations: Iterable[Aggregation] = DEFAULT_AGGREGATIONS):
+        self.states = {a.name: _State(a) for a in aggregations}
+        self._by_type: dict[type, list[_State]] = {}
+        for state in self.states.values():
+            self._by_type.setdefault(state.agg.record_type, []).append(state)
+        self._lock = threading.Lock()
+
+    def add(self, record, timestamp: Optional[float] = None) -> None:
+        '''
+        timestamp がなければレコードの時刻(TIME_FIELDS)、
+        それもなければキャプチャ時刻、わからなければ今の時刻で数える
+        '''
+        states = self._by_type.get(type(record))
+        if not states:
+            return
+        if timestamp is None:
+            field = TIME_FIELDS.get(type(record))
+            timestamp = (getattr(record, field) if field
+                         else record.captured_at or time.time())
+        with self._lock:
+            for state in states:
+                state.add(record, timestamp)
+
+    def add_many(self, records: Iterable,
+                 timestamp: Optional[float] = None) -> None:
+        for r in records:
+            self.add(r, timestamp)
+
+    def window(self, name: str, end: Optional[float] = None
+               ) -> dict[Any, float]:
+        '''
+        end を含むウィンドウ(省略したら一番新しいもの)の {key: 値}。
+        スライディングなら end を含むペインで終わるウィンドウ
+        '''
+        state = self.states[name]
+        with self._lock:
+            end_pane = (state.latest if end is None
+                        else int(end // state.agg.pane_size))
+            return state.window(end_pane)
+
+    def windows(self, name: str) -> list[tuple[float, float, dict]]:
+        '''残っているウィンドウを古い順に (開始, 終了, {key: 値})'''
+        state = self.states[name]
+        agg = state.agg
+        with self._lock:
+            if not state.panes:
+                return []
+            # 古いペインを捨てた後の、最初の欠けていないウィンドウから
+            first = min(min(state.panes) + agg.panes_per_window - 1,
+                        state.latest)
+            result = []
+            for end_pane in range(first, state.latest + 1):
+                end = (end_pane + 1) * agg.pane_size
+                result.append((end - agg.window, end,
+                               state.window(end_pane)))
+            return result
+
+    def top(self, name: str, n: int = 10, end: Optional[float] = None
+            ) -> list[tuple[Any, float]]:
+        counts = self.window(name, end)
+        return sorted(counts.items(), key=lambda kv: -kv[1])[:n]
+
+    def late(self, name: str) -> int:
+        return self.states[name].late
+
+    def future(self, name: str) -> int:
+        return self.states[name].future
+
+    def get_state(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "latest": s.latest,
+                    "late": s.late,
+                    "future": s.future,
+                    "panes": {
+                        str(p): [[list(k) if isinstance(k, tuple) else k, v]
+                                 for k, v in counts.items()]
+                        for p, counts in s.panes.items()
+                    },
+                }
+                for name, s in self.states.items()
+            }
+
+    def set_state(self, state: dict) -> None:
+        '''同じ名前の Aggregation の分だけ戻す'''
+        with self._lock:
+            for name, saved in state.items():
+                s = self.states.get(name)
+                if s is None:
+                    continue
+                s.latest = saved["latest"]
+                s.late = saved["late"]
+                s.future = saved.get("future", 0)
+                s.panes = {
+                    int(p): {(tuple(k) if isinstance(k, list) else k): v
+                             for k, v in counts}
+                    for p, counts in saved["panes"].items()
+                }
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"saved_at": time.time(),
+                       "aggregations": self.get_state()}, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str,
+             aggregations: Iterable[Aggregation] = DEFAULT_AGGREGATIONS
+             ) -> "Aggregator":
+        aggregator = cls(aggregations)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                aggregator.set_state(json.load(f)["aggregations"])
+        return aggregator
+
+
+class AggregateSink(Sink):
+    '''read_pcapfile(sink=...) などから Aggregator に流し込む'''
+
+    def __init__(self, aggregator: Aggregator, **kwargs):
+        self.aggregator = aggregator
+        super().__init__(**kwargs)
+
+    def _write_batch(self, records: list) -> None:
+        self.aggregator.add_many(records)
@@ -0,0 +1,343 @@
+'''
+framing 済みのメッセージだけを入れた圧縮アーカイブ(.lmarc)
+
+    convert_pcap("test.pcap")                       # test.pcap.lmarc ができる
+    gifts = read_archive("test.pcap.lmarc", ["370b00"], [])
+    maps = read_archive("test.pcap.lmarc", [], ["ac08"],
+                        start=1650000000, end=1650000600)
+    for timestamp, flow, hexstr in ArchiveReader(path).iter_messages():
+        ...
+
+    python -m lmapi.archive test.pcap old/*.pcap [--compression lzma]
+    python -m lmapi archives/*.lmarc -c 370b00 -o out.jsonl
+
+pcap にはリンク層, IP, TCP のヘッダとゲーム以外の通信も入っていて、
+読むたびに取り出しと framing をやりなおすことになる。
+アーカイブにはメッセージ (キャプチャ時刻, 接続, 生データ) だけを入れる。
+
+ファイル形式
+- MAGIC (8 bytes)
+- ブロックが並ぶ。1つのブロックは BLOCK_SIZE バイトくらいのメッセージを
+  列ごとにまとめて zlib か lzma で圧縮したもの
+  - 件数 (4 bytes)
+  - timestamp (double) x 件数, 接続の番号 (4 bytes) x 件数,
+    長さ (4 bytes) x 件数
+  - メッセージを続けたもの
+- フッター(JSON): メタ情報, 接続の一覧, ブロックごとの
+  [位置, 圧縮後の長さ, 件数, 最初の時刻, 最後の時刻, code の一覧]
+- フッターの位置 (8 bytes) + MAGIC
+読むときはフッターで code と時刻を見て、要らないブロックは展開しない。
+'''
+import argparse
+import json
+import logging
+import lzma
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional, Union
+from .bpf import CaptureFilter
+from .capture import Flow, read_segments
+from .framer import FlowFramer
+from .lmpacket import STRICT, read_packet
+from .sinks import Sink
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LMARC\x00\x00\x01"
+TRAILER = struct.Struct("<Q8s")
+# 圧縮前のブロックの大きさの目安
+BLOCK_SIZE = 1 << 20
+# 名前 -> (圧縮, 展開)
+COMPRESSIONS: dict[str, tuple[Callable[[bytes], bytes],
+                              Callable[[bytes], bytes]]] = {
+    "zlib": (lambda b: zlib.compress(b, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def archive_path_for(pcapfile: str) -> str:
+    return pcapfile + ".lmarc"
+
+
+class BlockInfo(NamedTuple):
+    offset: int
+    size: int
+    messages: int
+    start: float
+    end: float
+    codes: tuple[str, ...]
+
+
+class ArchiveWriter:
+    def __init__(self, path: str, compression: str = "zlib",
+                 meta: Optional[dict] = None, block_size: int = BLOCK_SIZE):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression: {compression}")
+        self.path = path
+        self.compression = compression
+        self.meta = dict(meta or {})
+        self.block_size = block_size
+        self.blocks: list[BlockInfo] = []
+        self.flows: dict[Flow, int] = {}
+        self.messages = 0
+        self.raw_bytes = 0
+        self._compress = COMPRESSIONS[compression][0]
+        self._tmp = path + ".tmp"
+        self._f: Optional[BinaryIO] = open(self._tmp, "wb")
+        self._f.write(MAGIC)
+        self._times: list[float] = []
+        self._flow_ids: list[int] = []
+        self._data: list[bytes] = []
+        self._nbytes = 0
+
+    def write(self, timestamp: float, flow: Flow,
+              message: Union[bytes, str]) -> None:
+        '''メッセージ1つ。hex 文字列でも bytes でもよい'''
+        if self._f is None:
+            raise ValueError(f"write to closed archive: {self.path}")
+        if isinstance(message, str):
+            message = bytes.fromhex(message)
+        flow_id = self.flows.get(flow)
+        if flow_id is None:
+            flow_id = self.flows[flow] = len(self.flows)
+        self._times.append(timestamp)
+        self._flow_ids.append(flow_id)
+        self._data.append(message)
+        self._nbytes += len(message)
+        if self._nbytes >= self.block_size:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        n = len(self._data)
+        if not n:
+            return
+        # write() と close() が閉じていないことを確かめてから呼ぶ
+        assert self._f is not None
+        raw = b"".join([
+            struct.pack("<I", n),
+            struct.pack(f"<{n}d", *self._times),
+            struct.pack(f"<{n}I", *self._flow_ids),
+            struct.pack(f"<{n}I", *(len(d) for d in self._data)),
+        ] + self._data)
+        block = self._compress(raw)
+        codes = tuple(sorted({d[2:5].hex() for d in self._data}))
+        self.blocks.append(BlockInfo(self._f.tell(), len(block), n,
+                                     min(self._times), max(self._times),
+                                     codes))
+        self._f.write(block)
+        self.messages += n
+        self.raw_bytes += len(raw)
+        self._times, self._flow_ids, self._data = [], [], []
+        self._nbytes = 0
+
+    def close(self) -> None:
+        if self._f is None:
+            return
+        self._write_block()
+        footer = json.dumps({
+            "meta": self.meta,
+            "compression": self.compression,
+            "flows": [list(flow) for flow in self.flows],
+            "blocks": [list(b) for b in self.blocks],
+        }).encode()
+        offset = self._f.tell()
+        self._f.write(footer)
+        self._f.write(TRAILER.pack(offset, MAGIC))
+        self._f.close()
+        self._f = None
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._f is not None:
+            # 途中で失敗したら書きかけは残さない
+            self._f.close()
+            self._f = None
+            os.remove(self._tmp)
+
+
+class ArchiveReader:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"not a message archive: {path}")
+            f.seek(-TRAILER.size, os.SEEK_END)
+            end = f.tell()
+            offset, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"truncated message archive: {path}")
+            f.seek(offset)
+            footer = json.loads(f.read(end - offset))
+        self.meta: dict = footer["meta"]
+        self.compression: str = footer["compression"]
+        self.flows = [Flow(*flow) for flow in footer["flows"]]
+        self.blocks = [BlockInfo(o, s, n, t0, t1, tuple(codes))
+                       for o, s, n, t0, t1, codes in footer["blocks"]]
+        self._decompress = COMPRESSIONS[self.compression][1]
+
+    def __len__(self) -> int:
+        return sum(b.messages for b in self.blocks)
+
+    def select(self, codes=(), codestartswith=(),
+               start: Optional[float] = None,
+               end: Optional[float] = None) -> list[BlockInfo]:
+        '''codes と時刻の範囲に合うメッセージがあるかもしれないブロック'''
+        prefixes = tuple(codestartswith)
+        selected = []
+        for b in self.blocks:
+            if start is not None and b.end < start:
+                continue
+            if end is not None and b.start >= end:
+                continue
+            if (codes or prefixes) and not any(
+                    c in codes or c.startswith(prefixes) for c in b.codes):
+                continue
+            selected.append(b)
+        return selected
+
+    def iter_messages(self, codes=(), codestartswith=(),
+                      start: Optional[float] = None,
+                      end: Optional[float] = None, ipaddrs=()
+                      ) -> Iterator[tuple[float, Flow, str]]:
+        '''
+        (timestamp, 接続, hex文字列) をファイルの順に。
+        codes も codestartswith も空なら全部。ipaddrs はサーバーのIP
+        '''
+        codes = set(codes)
+        prefixes = tuple(codestartswith)
+        every = not codes and not prefixes
+        selected_ips = set(ipaddrs)
+        flows = self.flows
+        with open(self.path, "rb") as f:
+            for b in self.select(codes, prefixes, start, end):
+                f.seek(b.offset)
+                raw = self._decompress(f.read(b.size))
+                n = struct.unpack_from("<I", raw)[0]
+                pos = 4
+                times = struct.unpack_from(f"<{n}d", raw, pos)
+                pos += 8 * n
+                flow_ids = struct.unpack_from(f"<{n}I", raw, pos)
+                pos += 4 * n
+                lengths = struct.unpack_from(f"<{n}I", raw, pos)
+                pos += 4 * n
+                for t, flow_id, length in zip(times, flow_ids, lengths):
+                    data = raw[pos:pos+length]
+                    pos += length
+                    if start is not None and t < start:
+                        continue
+                    if end is not None and t >= end:
+                        continue
+                    if not every:
+                        code = data[2:5].hex()
+                        if code not in codes and not code.startswith(
+                                prefixes):
+                            continue
+                    flow = flows[flow_id]
+                    if selected_ips and flow.src not in selected_ips:
+                        continue
+                    yield t, flow, data.hex()
+
+
+def convert_pcap(pcapfile: str, archive_path: Optional[str] = None,
+                 ipaddrs=[], resync_codes=(), compression: str = "zlib",
+                 backend: Optional[str] = None,
+                 block_size: int = BLOCK_SIZE) -> ArchiveWriter:
+    '''
+    pcap のメッセージを全部アーカイブにする。
+    resync_codes は Framer の codes (データ長さが0のときに探すcode)
+    '''
+    if archive_path is None:
+        archive_path = archive_path_for(pcapfile)
+    framer = FlowFramer(resync_codes)
+    meta = {
+        "pcapfile": os.path.basename(pcapfile),
+        "size": os.path.getsize(pcapfile),
+        "ipaddrs": list(ipaddrs),
+    }
+    with ArchiveWriter(archive_path, compression, meta,
+                       block_size) as writer:
+        for segment in read_segments(pcapfile, CaptureFilter(ipaddrs=ipaddrs),
+                                     backend):
+            for _, data in framer.feed(segment.flow, segment.payload.hex()):
+                writer.write(segment.timestamp, segment.flow, data)
+    return writer
+
+
+def iter_archive(path: str, codes, codestartwith, ipaddrs=[], delim=80,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 validation: str = STRICT) -> Iterator[tuple[float, list]]:
+    '''iter_pcapfile と同じく、メッセージごとに (timestamp, decode結果)'''
+    for timestamp, _, data in ArchiveReader(path).iter_messages(
+            codes, codestartwith, start, end, ipaddrs):
+        if len(data) < delim:
+            continue
+        result = read_packet(data, codes, codestartwith,
+                             timestamp=timestamp, validation=validation)
+        if result:
+            yield timestamp, result
+
+
+def read_archive(path: str, codes, codestartwith, ipaddrs=[], delim=80,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 sink: Optional[Sink] = None,
+                 validation: str = STRICT) -> list:
+    '''
+    read_pcapfile と同じ結果を、アーカイブから返す。
+    sink を渡すとそちらにも書く(closeは呼び出し側で)
+    '''
+    results = []
+    for _, result in iter_archive(path, codes, codestartwith, ipaddrs, delim,
+                                  start, end, validation):
+        results += result
+        if sink is not None:
+            sink.write_many(result)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m lmapi.archive",
+        description="convert pcap files to message archives (.lmarc)")
+    parser.add_argument("inputs", nargs="+", help="pcap files")
+    parser.add_argument("-o", "--output",
+                        help="archive path (one input only; "
+                        "default: <input>.lmarc)")
+    parser.add_argument("--compression", choices=sorted(COMPRESSIONS),
+                        default="zlib")
+    parser.add_argument("--ip", action="append", default=[],
+                        help="server ip address (repeatable)")
+    parser.add_argument("--backend", help="capture backend")
+    args = parser.parse_args(argv)
+    if args.output and len(args.inputs) > 1:
+        parser.error("--output needs exactly one input")
+
+    failed = 0
+    for path in args.inputs:
+        started = time.time()
+        try:
+            writer = convert_pcap(path, args.output, args.ip,
+                                  compression=args.compression,
+                                  backend=args.backend)
+        except Exception as e:
+            failed += 1
+            print(f"{path}: FAILED {type(e).__name__}: {e}",
+                  file=sys.stderr)
+            continue
+        size = os.path.getsize(writer.path)
+        print(f"{path}: {writer.messages} messages, "
+              f"{os.path.getsize(path)/1024/1024:.2f}MB -> "
+              f"{size/1024/1024:.2f}MB in {time.time()-started:.1f}s",
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+'''
+たくさんの.pcapをプロセスプールでまとめて decode する
+
+    python -m lmapi captures/ -c 370b00 -p ac08 -o out.jsonl -j 8
+
+- ファイルごとにワーカーで decode して、結果を一時ファイルに書く
+- 全部終わったら、キャプチャ時刻の順に1本にまとめて sink に書く
+- 読めなかったファイルはログに出して飛ばす(他のファイルは続ける)
+- .lmarc (archive.py) も読める。framing 済みなのでそのまま decode する
+- memory_budget を渡すと、ワーカーはそれを jobs で割った分を超えたら
+  一時ファイルに書き出して、最後に時刻順にまとめる(spill.SpillList)
+'''
+import glob
+import heapq
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, NamedTuple, Optional, Union
+from .archive import ArchiveReader
+from .bpf import CaptureFilter
+from .capture import read_segments
+from .framer import FlowFramer
+from .lmpacket import STRICT, read_packet
+from .sinks import Sink
+from .spill import SpillList
+
+logger = logging.getLogger(__name__)
+
+PCAP_PATTERNS = ("*.pcap", "*.cap", "*.lmarc")
+
+
+class FileResult(NamedTuple):
+    path: str
+    spill: str       # (timestamp, seq, record) を pickle で並べたファイル
+    records: int
+    messages: int
+    seconds: float
+
+
+class FileError(NamedTuple):
+    path: str
+    error: str
+
+
+def expand_inputs(inputs: list[str]) -> list[str]:
+    '''ディレクトリ, globパターン, ファイルを.pcapのリストにする'''
+    paths: list[str] = []
+    for x in inputs:
+        if os.path.isdir(x):
+            for pattern in PCAP_PATTERNS:
+                paths += glob.glob(os.path.join(x, "**", pattern),
+                                   recursive=True)
+        elif glob.has_magic(x):
+            paths += glob.glob(x, recursive=True)
+        else:
+            paths.append(x)
+    # 同じファイルを2回読まない
+    paths = sorted(set(os.path.abspath(p) for p in paths))
+    # アーカイブがある pcap はアーカイブの方だけ読む
+    archived = {p[:-len(".lmarc")] for p in paths if p.endswith(".lmarc")}
+    return [p for p in paths if p not in archived]
+
+
+def _messages(path: str, codes, codestartwith, ipaddrs=[],
+              backend: Optional[str] = None) -> Iterator[tuple[float, str]]:
+    '''(キャプチャ時刻, framing 済みのメッセージ)'''
+    if path.endswith(".lmarc"):
+        for timestamp, _, data in ArchiveReader(path).iter_messages(
+                codes, codestartwith, ipaddrs=ipaddrs):
+            yield timestamp, data
+        return
+    framer = FlowFramer(codes)
+    for segment in read_segments(path, CaptureFilter(ipaddrs=ipaddrs),
+                                 backend):
+        for _, data in framer.feed(segment.flow, segment.payload.hex()):
+            yield segment.timestamp, data
+
+
+def process_file(path: str, spill: str, codes, codestartwith, ipaddrs=[],
+                 delim=80, validation: str = STRICT,
+                 backend: Optional[str] = None,
+                 memory_budget: Optional[int] = None) -> FileResult:
+    '''ワーカーで1ファイル分を decode して、時刻順に spill へ書く'''
+    started = time.time()
+    results: Union[list, SpillList] = (
+        [] if memory_budget is None
+        else SpillList(memory_budget, key=lambda x: x[:2],
+                       directory=os.path.dirname(spill)))
+    messages = 0
+    try:
+        for timestamp, data in _messages(path, codes, codestartwith,
+                                         ipaddrs, backend):
+            messages += 1
+            if len(data) < delim:
+                continue
+            result = read_packet(data, codes, codestartwith,
+                                 timestamp=timestamp, validation=validation)
+            if result:
+                for r in result:
+                    results.append((timestamp, len(results), r))
+        if isinstance(results, list):
+            results.sort(key=lambda x: x[:2])
+        with open(spill, "wb") as f:
+            for item in results:
+                pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+        n = len(results)
+    finally:
+        # 失敗しても一時ファイルはすぐ消す
+        if isinstance(results, SpillList):
+            results.close()
+    return FileResult(path, spill, n, messages, time.time() - started)
+
+
+def _load_spill(path: str, ifile: int) -> Iterator[tuple]:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                timestamp, seq, record = pickle.load(f)
+            except EOFError:
+                return
+            yield timestamp, ifile, seq, record
+
+
+def run_batch(paths: list[str], sink: Sink, codes, codestartwith,
+              ipaddrs=[], delim=80, validation: str = STRICT,
+              jobs: Optional[int] = None, progress: bool = True,
+              backend: Optional[str] = None,
+              memory_budget: Optional[int] = None
+              ) -> tuple[list[FileResult], list[FileError]]:
+    '''
+    paths を jobs 個のプロセスで decode して、時刻順に sink に書く。
+    sink は閉じない。(成功したファイル, 失敗したファイル) を返す。
+    memory_budget はワーカー全部で使ってよい decode 結果のバイト数
+    '''
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    worker_budget = (None if memory_budget is None
+                     else max(memory_budget // jobs, 1))
+    tmpdir = tempfile.mkdtemp(prefix="lmapi-batch-")
+    done: list[FileResult] = []
+    failed: list[FileError] = []
+    started = time.time()
+    try:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = {
+                pool.submit(process_file, path,
+                            os.path.join(tmpdir, f"{i}.pickle"), codes,
+                            codestartwith, ipaddrs, delim, validation,
+                            backend, worker_budget): path
+                for i, path in enumerate(paths)
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    r = future.result()
+                    done.append(r)
+                    status = (f"{r.records} records from {r.messages} "
+                              f"messages in {r.seconds:.1f}s")
+                except Exception as e:
+                    failed.append(FileError(path, f"{type(e).__name__}: {e}"))
+                    status = f"FAILED {type(e).__name__}: {e}"
+                if progress:
+                    n = len(done) + len(failed)
+                    print(f"[{n}/{len(paths)}] {os.path.basename(path)}: "
+                          f"{status}", file=sys.stderr)
+        # 入力の順番で番号をつけておくと、同じ時刻のものの順番が毎回同じになる
+        order = {p: i for i, p in enumerate(paths)}
+        merged = heapq.merge(*[_load_spill(r.spill, order[r.path])
+                               for r in done])
+        for _, _, _, record in merged:
+            sink.write(record)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    if progress:
+        total = sum(r.records for r in done)
+        print(f"{len(done)} files, {total} records, {len(failed)} failed "
+              f"in {time.time()-started:.1f}s", file=sys.stderr)
+    for failure in failed:
+        logger.error(f"{failure.path}: {failure.error}")
+    return done, failed
@@ -0,0 +1,162 @@
+'''
+何週間も動かし続けても大きくならない「見たことがある」の集合
+
+    seen = RotatingBloomFilter(capacity=1_000_000, error_rate=0.001,
+                               period=86400, generations=2)
+    seen.add(key, timestamp)      # 初めてなら True
+
+    bus = EventBus(dedup=MessageDedup())   # 同じメッセージは decode しない
+
+- BloomFilter: 大きさが決まった Bloom filter。
+  capacity 個入れたときに、入れていないものを「ある」と間違える割合が
+  error_rate になるようにビット数とハッシュの数を決める。
+  「ない」と間違えることはない
+- RotatingBloomFilter: BloomFilter を generations 個まで持つ。
+  period 秒たつか capacity 個入ったら新しいものに切り替え、一番古いものを捨てる。
+  メモリは generations 個分から増えない。
+  period x (generations - 1) 秒より前に見たものは忘れることがある
+- MessageDedup: ギフトの一覧やチャットの履歴など、開きなおすたびに
+  まったく同じ中身で届くメッセージを、code を見た後、decode の前に捨てる
+'''
+import hashlib
+import math
+import threading
+import time
+from typing import Iterable, Optional, Union
+
+# まったく同じメッセージが何度も届くもの
+DEFAULT_DEDUP_PREFIXES = ("370b00", "310b00", "bb0b00", "5e0d")
+
+
+def _hashes(key: Union[bytes, str]) -> tuple[int, int]:
+    if isinstance(key, str):
+        key = key.encode()
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    # 2つ目は奇数にして、同じ位置ばかりにならないようにする
+    return (int.from_bytes(digest[:8], "little"),
+            int.from_bytes(digest[8:], "little") | 1)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError(f"error_rate must be in (0, 1): {error_rate}")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nbits = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.nhashes = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def __len__(self) -> int:
+        '''入れた数(「ある」と間違えたものは数えない)'''
+        return self.count
+
+    def _positions(self, key: Union[bytes, str]) -> list[int]:
+        h1, h2 = _hashes(key)
+        m = self.nbits
+        return [(h1 + i * h2) % m for i in range(self.nhashes)]
+
+    def __contains__(self, key: Union[bytes, str]) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(key))
+
+    def add(self, key: Union[bytes, str]) -> bool:
+        '''入っていなければ入れて True'''
+        bits = self.bits
+        new = False
+        for p in self._positions(key):
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+
+class RotatingBloomFilter:
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 period: float = 86400.0, generations: int = 2):
+        if generations < 1:
+            raise ValueError(f"generations must be >= 1: {generations}")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.period = period
+        self.max_generations = generations
+        # 新しい順 [(始めた時刻, BloomFilter)]
+        self.generations: list[tuple[float, BloomFilter]] = []
+        self.rotations = 0
+        self._lock = threading.Lock()
+
+    def _current(self, timestamp: float) -> BloomFilter:
+        if self.generations:
+            started, bloom = self.generations[0]
+            if (timestamp - started < self.period
+                    and bloom.count < self.capacity):
+                return bloom
+            self.rotations += 1
+        # 全部の世代を見るので、1つあたりの割合を小さくしておく
+        bloom = BloomFilter(self.capacity,
+                            self.error_rate / self.max_generations)
+        self.generations.insert(0, (timestamp, bloom))
+        del self.generations[self.max_generations:]
+        return bloom
+
+    def __contains__(self, key: Union[bytes, str]) -> bool:
+        return any(key in bloom for _, bloom in self.generations)
+
+    def add(self, key: Union[bytes, str],
+            timestamp: Optional[float] = None) -> bool:
+        '''どの世代にもなければ今の世代に入れて True'''
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            current = self._current(timestamp)
+            for _, bloom in self.generations[1:]:
+                if key in bloom:
+                    return False
+            return current.add(key)
+
+    @property
+    def nbytes(self) -> int:
+        '''今の大きさ。最大で generations 個分'''
+        return sum(bloom.nbytes for _, bloom in self.generations)
+
+
+class MessageDedup:
+    '''EventBus(dedup=...) から呼ばれる'''
+
+    def __init__(self, prefixes: Iterable[str] = DEFAULT_DEDUP_PREFIXES,
+                 seen: Optional[RotatingBloomFilter] = None):
+        self.prefixes = tuple(prefixes)
+        self.seen = seen if seen is not None else RotatingBloomFilter()
+        # code -> 捨てた数
+        self.duplicates: dict[str, int] = {}
+        self.admitted = 0
+
+    def admit(self, code: str, hexstr: str,
+              timestamp: Optional[float] = None) -> bool:
+        '''decode してよければ True。前と同じメッセージなら False'''
+        if not code.startswith(self.prefixes):
+            self.admitted += 1
+            return True
+        if self.seen.add(hexstr, timestamp):
+            self.admitted += 1
+            return True
+        self.duplicates[code] = self.duplicates.get(code, 0) + 1
+        return False
+
+    def report(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "duplicates": dict(sorted(self.duplicates.items())),
+            "rotations": self.seen.rotations,
+            "bytes": self.seen.nbytes,
+        }
@@ -0,0 +1,122 @@
+'''
+ローモバの受信パケットだけを通すキャプチャフィルタ
+
+__get_extracted_packet_scapy と同じ条件
+- IPv4 / TCP
+- 送信ポートが 5991
+- 送信IPが ipaddrs のどれか(指定したときだけ)
+- ペイロードが空でない
+を、
+- BPF の文字列 (sniff(filter=...) でカーネルに渡す)
+- .pcap のレコードの生バイト列を見る関数 (scapy で dissect する前に弾く)
+の両方にする。
+
+    flt = CaptureFilter(ipaddrs=["47.74.0.1"])
+    sniff(iface="wlan0", filter=flt.bpf(), prn=handler)
+    match = flt.compile(header.linktype)
+    if match(record.data): ...
+'''
+import socket
+import struct
+from typing import Callable, Iterable
+
+SERVER_PORT = 5991
+
+ETHERTYPE_IPV4 = b"\x08\x00"
+ETHERTYPE_VLAN = b"\x81\x00"
+
+
+def _ethernet(data: bytes) -> int:
+    if data[12:14] == ETHERTYPE_IPV4:
+        return 14
+    if data[12:14] == ETHERTYPE_VLAN and data[16:18] == ETHERTYPE_IPV4:
+        return 18
+    return -1
+
+
+def _raw(data: bytes) -> int:
+    return 0 if data[:1] and data[0] >> 4 == 4 else -1
+
+
+def _null(data: bytes) -> int:
+    # AF_INET はどちらのバイトオーダーでも先頭か末尾が 2
+    return 4 if data[:4] in (b"\x02\x00\x00\x00", b"\x00\x00\x00\x02") \
+        else -1
+
+
+def _sll(data: bytes) -> int:
+    return 16 if data[14:16] == ETHERTYPE_IPV4 else -1
+
+
+def _sll2(data: bytes) -> int:
+    return 20 if data[0:2] == ETHERTYPE_IPV4 else -1
+
+
+# linktype -> IPv4ヘッダの位置を返す関数(IPv4でなければ -1)
+IPV4_OFFSETS: dict[int, Callable[[bytes], int]] = {
+    0: _null,
+    1: _ethernet,
+    101: _raw,     # PCAPdroid
+    113: _sll,
+    228: _raw,
+    276: _sll2,
+}
+
+
+class CaptureFilter:
+    def __init__(self, port: int = SERVER_PORT,
+                 ipaddrs: Iterable[str] = (), min_payload: int = 1):
+        self.port = port
+        self.ipaddrs = list(ipaddrs)
+        self.min_payload = min_payload
+        self._src = {socket.inet_aton(ip) for ip in self.ipaddrs}
+        self._ipset = set(self.ipaddrs)
+
+    def bpf(self) -> str:
+        '''tcpdump の書式'''
+        expr = f"tcp src port {self.port}"
+        if self.ipaddrs:
+            hosts = " or ".join(f"src host {ip}" for ip in self.ipaddrs)
+            expr += f" and ({hosts})"
+        if self.min_payload > 0:
+            # IPの全長 - IPヘッダ長 - TCPヘッダ長 = ペイロード長
+            expr += (" and (ip[2:2] - ((ip[0]&0xf)<<2) - "
+                     f"((tcp[12]&0xf0)>>2)) >= {self.min_payload}")
+        return expr
+
+    def compile(self, linktype: int) -> Callable[[bytes], bool]:
+        '''
+        linktype のレコードの生バイト列を受け取って、通すかどうかを返す関数。
+        知らない linktype なら全部通す(後で scapy が判断する)
+        '''
+        ipv4_offset = IPV4_OFFSETS.get(linktype)
+        if ipv4_offset is None:
+            return lambda data: True
+        port = struct.pack(">H", self.port)
+        src = self._src
+        min_payload = self.min_payload
+
+        def match(data: bytes) -> bool:
+            i = ipv4_offset(data)
+            if i < 0 or len(data) < i + 20 or data[i+9] != 6:
+                return False
+            if src and data[i+12:i+16] not in src:
+                return False
+            ihl = (data[i] & 0x0f) * 4
+            t = i + ihl
+            if data[t:t+2] != port or len(data) < t + 13:
+                return False
+            total = (data[i+2] << 8) | data[i+3]
+            return total - ihl - (data[t+12] >> 4) * 4 >= min_payload
+
+        return match
+
+    def matches(self, data: bytes, linktype: int) -> bool:
+        return self.compile(linktype)(data)
+
+    def accepts(self, segment) -> bool:
+        '''capture.Segment に同じ条件を当てはめる'''
+        flow = segment.flow
+        return (flow.sport == self.port
+                and (not self._ipset or flow.src in self._ipset)
+                and len(segment.payload) >= self.min_payload)
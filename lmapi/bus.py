@@ -0,0 +1,307 @@
+'''
+decode 結果を複数の受け手に配る
+
+    bus = EventBus()
+    gifts = bus.subscribe(types=[Gift])
+    moving = bus.subscribe(types=[MapObjectMoving], maxsize=100)
+    bus.subscribe(prefixes=["ac08"], sink=ConsoleSink(on_full="drop"))
+
+    for segment in read_segments("test.pcap"):   # 別スレッドで
+        bus.publish_segment(segment)
+    bus.close()
+
+    for gift in gifts:                           # close されるまで
+        ...
+
+- 受け手の codes / prefixes / types を合わせたものだけ read_packet する
+  (types は RESULT_CODES で code に直す)
+- 1つのメッセージは1回だけ decode して、合う受け手全員に渡す
+- 受け手ごとに大きさの決まったキューを持つ。
+  on_full="drop" なら一杯のときは捨てて dropped を数える(decodeを止めない)
+- MapObjectMoving などを types に指定すると、
+  中身(obj)がその型の MapObject が届く
+- shedder (shedding.LoadShedder) を渡すと、遅れているときは
+  優先度の低いメッセージを decode せずに捨てる
+- dedup (bloom.MessageDedup) を渡すと、前と同じ中身のメッセージは
+  decode せずに捨てる
+- metrics.enable() していれば、キャプチャ時刻から framed / decoded /
+  delivered までの時間を code ごとに数える (metrics.latency())
+'''
+import logging
+import queue
+import threading
+from typing import Iterable, Iterator, Optional
+from .bloom import MessageDedup
+from . import diagnostics
+from .capture import Segment
+from .framer import FlowFramer
+from .lmdataclass import (
+    Castle, Comment, Gift, GiftPopup, HuntReport, InnerGuildBoard,
+    MapObject, MapObjectCamp, MapObjectCastle, MapObjectFort,
+    MapObjectMonster, MapObjectMoving, MapObjectResourceTile,
+    OuterGuildBoard, Player, ResultOpenChests, SkillActivated,
+)
+from .lmpacket import STRICT, read_packet
+from .metrics import metrics
+from .shedding import LoadShedder
+from .sinks import Sink
+
+logger = logging.getLogger(__name__)
+
+MAP_PREFIXES = ("ac08", "ba08")
+# 型 -> それを返す (codes, prefixes)。lmpacket.__decode と合わせる
+RESULT_CODES: dict[type, tuple[tuple[str, ...], tuple[str, ...]]] = {
+    Gift: (("370b00", "310b00"), ()),
+    GiftPopup: (("2b0b12", "2b0b13", "2b0b14"), ()),
+    Player: (("060b00",), ()),
+    Castle: (("ac080c",), ()),
+    MapObject: ((), MAP_PREFIXES),
+    ResultOpenChests: (("7f0500",), ()),
+    Comment: (("bb0b00",), ()),
+    OuterGuildBoard: (("2a0b00",), ()),
+    InnerGuildBoard: ((), ("f20a",)),
+    SkillActivated: (("232000",), ()),
+    HuntReport: ((), ("5e0d",)),
+}
+# MapObject.obj の型
+MAP_OBJECT_TYPES = (
+    MapObjectMonster, MapObjectCastle, MapObjectResourceTile,
+    MapObjectMoving, MapObjectCamp, MapObjectFort,
+)
+for _t in MAP_OBJECT_TYPES:
+    RESULT_CODES[_t] = RESULT_CODES[MapObject]
+
+_CLOSED = object()
+
+
+class Subscription:
+    def __init__(self, codes: Iterable[str] = (),
+                 prefixes: Iterable[str] = (), types: Iterable[type] = (),
+                 maxsize: int = 10000, on_full: str = "drop",
+                 sink: Optional[Sink] = None):
+        if on_full not in ("block", "drop"):
+            raise ValueError(f"on_full must be 'block' or 'drop': {on_full}")
+        self.codes = set(codes)
+        self.prefixes = tuple(prefixes)
+        self.types = tuple(types)
+        for t in self.types:
+            if t not in RESULT_CODES:
+                raise ValueError(f"no code decodes to {t.__name__}")
+        self.on_full = on_full
+        self.sink = sink
+        self.delivered = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._closed = False
+
+    def decode_filter(self) -> tuple[set[str], set[str]]:
+        '''この受け手のために decode する (codes, prefixes)'''
+        codes = set(self.codes)
+        prefixes = set(self.prefixes)
+        for t in self.types:
+            c, p = RESULT_CODES[t]
+            codes.update(c)
+            prefixes.update(p)
+        return codes, prefixes
+
+    def wants_code(self, code: str) -> bool:
+        '''code のメッセージの結果は全部この受け手に行く'''
+        return code in self.codes or code.startswith(self.prefixes)
+
+    def wants(self, record) -> bool:
+        '''types で指定したもの'''
+        if isinstance(record, self.types):
+            return True
+        return (isinstance(record, MapObject)
+                and isinstance(record.obj, self.types))
+
+    def put(self, record) -> None:
+        if self._closed:
+            return
+        if self.sink is not None:
+            self.sink.write(record)
+            self.delivered += 1
+            return
+        if self.on_full == "block":
+            self._queue.put(record)
+        else:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+        self.delivered += 1
+
+    def get(self, timeout: Optional[float] = None):
+        '''
+        次の1件。timeout 秒たっても来なければ queue.Empty。
+        close された後は StopIteration
+        '''
+        if self._closed:
+            # close の後は残っている分を返して終わる
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                raise StopIteration
+        else:
+            record = self._queue.get(timeout=timeout)
+        if record is _CLOSED:
+            # 他のスレッドの get() にも知らせる
+            try:
+                self._queue.put_nowait(_CLOSED)
+            except queue.Full:
+                pass
+            raise StopIteration
+        return record
+
+    def __iter__(self) -> Iterator:
+        while True:
+            try:
+                yield self.get()
+            except StopIteration:
+                return
+
+    def close(self) -> None:
+        if self.sink is not None:
+            return
+        self._closed = True
+        # get() で待っているスレッドを起こす。一杯なら待っているものはいない
+        try:
+            self._queue.put_nowait(_CLOSED)
+        except queue.Full:
+            pass
+
+
+class EventBus:
+    def __init__(self, validation: str = STRICT,
+                 shedder: Optional[LoadShedder] = None,
+                 dedup: Optional[MessageDedup] = None):
+        self.validation = validation
+        self.shedder = shedder
+        self.dedup = dedup
+        self.subscriptions: list[Subscription] = []
+        self.codes: list[str] = []
+        self.prefixes: tuple[str, ...] = ()
+        self.messages = 0
+        self.decoded = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._framer = FlowFramer()
+        self._lock = threading.Lock()
+        # code -> (結果を全部渡す受け手, types で選ぶ受け手)
+        self._routes: dict[str, tuple[list, list]] = {}
+
+    def subscribe(self, codes: Iterable[str] = (),
+                  prefixes: Iterable[str] = (), types: Iterable[type] = (),
+                  maxsize: int = 10000, on_full: str = "drop",
+                  sink: Optional[Sink] = None) -> Subscription:
+        '''
+        codes, prefixes に合うメッセージの結果全部と、types の型の結果を受け取る。
+        sink を渡すとキューの代わりに sink.write() する(closeは呼び出し側で)
+        '''
+        sub = Subscription(codes, prefixes, types, maxsize, on_full, sink)
+        with self._lock:
+            self.subscriptions.append(sub)
+            self._update()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self.subscriptions.remove(sub)
+            self._update()
+        sub.close()
+
+    def _update(self) -> None:
+        codes: set[str] = set()
+        prefixes: set[str] = set()
+        for sub in self.subscriptions:
+            c, p = sub.decode_filter()
+            codes |= c
+            prefixes |= p
+        self.codes = sorted(codes)
+        self.prefixes = tuple(sorted(prefixes))
+        self._routes = {}
+
+    def _route(self, code: str) -> tuple[list, list]:
+        route = self._routes.get(code)
+        if route is None:
+            route = ([], [])
+            for sub in self.subscriptions:
+                if sub.wants_code(code):
+                    route[0].append(sub)
+                elif sub.types:
+                    route[1].append(sub)
+            self._routes[code] = route
+        return route
+
+    def publish(self, hexstr: str, timestamp: float = 0) -> int:
+        '''
+        framing 済みのメッセージ1つ。配った数を返す。
+        timestamp はキャプチャ時刻(秒)
+        '''
+        self.messages += 1
+        codes, prefixes = self.codes, self.prefixes
+        if not codes and not prefixes:
+            return 0
+        code = hexstr[4:10]
+        # 弾かれるものは read_packet で数える
+        timed = False
+        if code in codes or code.startswith(prefixes):
+            timed = metrics.enabled and timestamp > 0
+            if timed:
+                metrics.stage(code, "framed", timestamp)
+            if self.shedder is not None:
+                if not self.shedder.admit(code, len(hexstr) // 2):
+                    return 0
+            if self.dedup is not None:
+                if not self.dedup.admit(code, hexstr, timestamp or None):
+                    self.duplicates += 1
+                    return 0
+        try:
+            result = read_packet(hexstr, codes, prefixes,
+                                 timestamp=timestamp,
+                                 validation=self.validation)
+        except NotImplementedError:
+            return 0
+        except Exception as e:
+            # 1つのおかしなメッセージで全員を止めない
+            self.errors += 1
+            diagnostics.record(f"bus error {type(e).__name__}", code, hexstr)
+            return 0
+        if not result:
+            return 0
+        self.decoded += 1
+        if timed:
+            metrics.stage(code, "decoded", timestamp)
+        with self._lock:
+            everything, by_type = self._route(code)
+        n = 0
+        for sub in everything:
+            for r in result:
+                sub.put(r)
+            n += len(result)
+        for sub in by_type:
+            for r in result:
+                if sub.wants(r):
+                    sub.put(r)
+                    n += 1
+        if timed and n:
+            metrics.stage(code, "delivered", timestamp)
+        return n
+
+    def publish_segment(self, segment: Segment) -> int:
+        '''TCP のペイロード。接続ごとに framing してから publish する'''
+        if self.shedder is not None:
+            self.shedder.observe(segment.timestamp)
+        n = 0
+        for _, data in self._framer.feed(segment.flow,
+                                         segment.payload.hex()):
+            n += self.publish(data, segment.timestamp)
+        return n
+
+    def close(self) -> None:
+        '''キューの受け手に終わりを知らせる'''
+        with self._lock:
+            subs = list(self.subscriptions)
+        for sub in subs:
+            sub.close()
@@ -0,0 +1,284 @@
+'''
+キャプチャファイルから TCP のセグメントを取り出す部分の切り替え
+
+どの実装も Segment(flow, timestamp, payload) を返す。
+- "builtin": pcapfile.py でレコードを読んで、IPv4/TCPヘッダを自分で見る。
+             依存なし、.pcap のみ(pcapngは未対応)
+- "scapy":   scapy.PcapReader で1つずつ dissect する
+- "pyshark": tshark を使う
+
+BACKENDS は benchmarks/bench_capture.py で速かった順。
+get_backend() は使えるもののうち一番速いものを返す。
+
+    for seg in read_segments("test.pcap", CaptureFilter(ipaddrs=[...])):
+        print(seg.flow, seg.timestamp, seg.payload.hex())
+'''
+import logging
+import socket
+import struct
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional
+from .bpf import IPV4_OFFSETS, CaptureFilter
+from .pcapfile import GLOBAL_HEADER_LEN, PcapHeader, PcapRecord, \
+    iter_records, read_header
+
+logger = logging.getLogger(__name__)
+
+
+class Flow(NamedTuple):
+    src: str
+    sport: int
+    dst: str
+    dport: int
+
+
+class Segment(NamedTuple):
+    flow: Flow
+    timestamp: float
+    payload: bytes
+
+
+class CaptureBackend:
+    '''
+    サブクラスは segment() と read_file() を実装する。
+    segment() はそのライブラリのパケット1つを Segment にする
+    (TCPでない・ペイロードが空なら None)。
+    '''
+    name = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    def segment(self, packet) -> Optional[Segment]:
+        raise NotImplementedError
+
+    def read_file(self, path: str,
+                  capture_filter: Optional[CaptureFilter] = None
+                  ) -> Iterator[Segment]:
+        raise NotImplementedError
+
+
+class BuiltinBackend(CaptureBackend):
+    name = "builtin"
+
+    def __init__(self):
+        self._addrs: dict[bytes, str] = {}
+        self._parsers: dict[int, Callable] = {}
+
+    def _addr(self, raw: bytes) -> str:
+        addr = self._addrs.get(raw)
+        if addr is None:
+            addr = self._addrs[raw] = socket.inet_ntoa(raw)
+        return addr
+
+    def parser(self, linktype: int
+               ) -> Callable[[bytes, float], Optional[Segment]]:
+        '''linktype のレコードの生バイト列を Segment にする関数'''
+        ipv4_offset = IPV4_OFFSETS.get(linktype)
+        if ipv4_offset is None:
+            raise ValueError(f"unsupported linktype: {linktype}")
+        unpack_ports = struct.Struct(">HH").unpack_from
+        addr = self._addr
+
+        def parse(data: bytes, timestamp: float) -> Optional[Segment]:
+            i = ipv4_offset(data)
+            if i < 0 or len(data) < i + 20 or data[i+9] != 6:
+                return None
+            t = i + (data[i] & 0x0f) * 4
+            if len(data) < t + 20:
+                return None
+            end = i + ((data[i+2] << 8) | data[i+3])
+            payload = data[t + (data[t+12] >> 4) * 4:end]
+            if not payload:
+                return None
+            sport, dport = unpack_ports(data, t)
+            flow = Flow(addr(data[i+12:i+16]), sport,
+                        addr(data[i+16:i+20]), dport)
+            return Segment(flow, timestamp, payload)
+
+        return parse
+
+    def segment(self, packet) -> Optional[Segment]:
+        '''packet は (linktype, 生バイト列, timestamp)'''
+        linktype, data, timestamp = packet
+        parse = self._parsers.get(linktype)
+        if parse is None:
+            parse = self._parsers[linktype] = self.parser(linktype)
+        return parse(data, timestamp)
+
+    def read_file(self, path: str,
+                  capture_filter: Optional[CaptureFilter] = None
+                  ) -> Iterator[Segment]:
+        with open(path, "rb") as f:
+            header = read_header(f)
+            records = iter_record_segments(
+                f, header, capture_filter=capture_filter)
+            for _, segment in records:
+                if segment is not None:
+                    yield segment
+
+
+class ScapyBackend(CaptureBackend):
+    name = "scapy"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import scapy.all  # noqa: F401
+        except ModuleNotFoundError:
+            return False
+        return True
+
+    def segment(self, packet) -> Optional[Segment]:
+        if "IP" not in packet or "TCP" not in packet:
+            return None
+        ip = packet["IP"]
+        tcp = packet["TCP"]
+        payload = bytes(tcp.payload)
+        if not payload:
+            return None
+        return Segment(Flow(ip.src, tcp.sport, ip.dst, tcp.dport),
+                       float(packet.time), payload)
+
+    def read_file(self, path: str,
+                  capture_filter: Optional[CaptureFilter] = None
+                  ) -> Iterator[Segment]:
+        from scapy.all import PcapReader
+        with PcapReader(path) as reader:
+            for packet in reader:
+                segment = self.segment(packet)
+                if segment is None:
+                    continue
+                if capture_filter and not capture_filter.accepts(segment):
+                    continue
+                yield segment
+
+
+class PysharkBackend(CaptureBackend):
+    name = "pyshark"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import pyshark  # noqa: F401
+        except ModuleNotFoundError:
+            return False
+        return True
+
+    def segment(self, packet) -> Optional[Segment]:
+        # packet: pyshark.packet.packet.Packet
+        if not hasattr(packet, "ip") or not hasattr(packet, "tcp"):
+            return None
+        if not hasattr(packet, "data"):
+            return None
+        # data.data はもともとhex文字列
+        payload = bytes.fromhex(packet.data.data.replace(":", ""))
+        return Segment(
+            Flow(packet.ip.src, int(packet.tcp.srcport),
+                 packet.ip.dst, int(packet.tcp.dstport)),
+            float(packet.sniff_timestamp), payload)
+
+    def read_file(self, path: str,
+                  capture_filter: Optional[CaptureFilter] = None
+                  ) -> Iterator[Segment]:
+        import pyshark
+        display_filter = None
+        if capture_filter is not None:
+            display_filter = f"tcp.srcport == {capture_filter.port}"
+        cap = pyshark.FileCapture(path, display_filter=display_filter)
+        try:
+            for packet in cap:
+                segment = self.segment(packet)
+                if segment is None:
+                    continue
+                if capture_filter and not capture_filter.accepts(segment):
+                    continue
+                yield segment
+        finally:
+            cap.close()
+
+
+# 速い順
+BACKENDS: list[type[CaptureBackend]] = [
+    BuiltinBackend, ScapyBackend, PysharkBackend,
+]
+
+
+def available_backends() -> list[str]:
+    return [b.name for b in BACKENDS if b.available()]
+
+
+def get_backend(name: Optional[str] = None) -> CaptureBackend:
+    '''name がなければ使えるもののうち一番速いもの'''
+    for backend in BACKENDS:
+        if name is not None and backend.name != name:
+            continue
+        if backend.available():
+            return backend()
+        if name is not None:
+            raise ValueError(f"capture backend {name} is not available")
+    raise ValueError(f"unknown capture backend: {name}")
+
+
+def read_segments(path: str, capture_filter: Optional[CaptureFilter] = None,
+                  backend: Optional[str] = None) -> Iterator[Segment]:
+    '''
+    backend を指定しなければ builtin で読み、
+    builtin で読めないファイル(pcapngなど)は次に速いもので読む
+    '''
+    if backend is None:
+        try:
+            with open(path, "rb") as f:
+                read_header(f)
+        except ValueError as e:
+            logger.info(f"{path}: {e}, fall back to another backend")
+            for b in BACKENDS[1:]:
+                if b.available():
+                    return b().read_file(path, capture_filter)
+            raise
+        return BuiltinBackend().read_file(path, capture_filter)
+    return get_backend(backend).read_file(path, capture_filter)
+
+
+def iter_record_segments(
+        f: BinaryIO, header: PcapHeader, offset: int = GLOBAL_HEADER_LEN,
+        capture_filter: Optional[CaptureFilter] = None
+        ) -> Iterator[tuple[PcapRecord, Optional[Segment]]]:
+    '''
+    pcapfile.iter_records() のレコードごとに (レコード, Segment) を返す。
+    capture_filter に合わないレコードは (レコード, None)
+    '''
+    if capture_filter is None:
+        capture_filter = CaptureFilter()
+    match = capture_filter.compile(header.linktype)
+    try:
+        parse = BuiltinBackend().parser(header.linktype)
+    except ValueError:
+        # 知らない linktype は scapy に任せる
+        parse = _scapy_parser(header.linktype, capture_filter)
+    for record in iter_records(f, header, offset):
+        if match(record.data):
+            yield record, parse(record.data, record.timestamp)
+        else:
+            yield record, None
+
+
+def _scapy_parser(linktype: int, capture_filter: CaptureFilter
+                  ) -> Callable[[bytes, float], Optional[Segment]]:
+    if not ScapyBackend.available():
+        raise ValueError(f"unsupported linktype: {linktype}")
+    from scapy.all import conf
+    layer = conf.l2types.get(linktype)
+    if layer is None:
+        raise ValueError(f"unsupported linktype: {linktype}")
+    backend = ScapyBackend()
+
+    def parse(data: bytes, timestamp: float) -> Optional[Segment]:
+        packet = layer(data)
+        packet.time = timestamp
+        segment = backend.segment(packet)
+        if segment is None or not capture_filter.accepts(segment):
+            return None
+        return segment
+
+    return parse
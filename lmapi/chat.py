@@ -0,0 +1,198 @@
+'''
+チャット(bb0b00)の保存と検索
+
+    archive = ChatArchive("chat.jsonl")   # 既にあれば読み込む
+    archive.add_many(comments)            # 重複は捨てて、新しいものだけ追記
+    archive.gaps("guild")                 # 取りこぼした comment_count の範囲
+    archive.search("ドラゴン", guild_tag="ABC")
+    archive.search(player="foo")
+
+- チャットを開きなおすと履歴が再送されるので、
+  (chat_place, comment_count) で重複を捨てる。
+  comment_count は場所ごとに1ずつ増えるので、受け取った範囲を区間で持つ。
+  ふつうは区間が1つなので、判定は最後の区間を見るだけで済む
+- 本文, player, guild_tag の転置索引を追加のたびに更新する。
+  本文は英数字は単語ごと、それ以外(日本語など)は2文字ずつに分ける
+'''
+import bisect
+import re
+import threading
+from dataclasses import fields
+from typing import Iterable, Optional
+from .lmdataclass import Comment
+from .sinks import JSONLLedger, Sink
+
+_WORD = re.compile(r"[0-9a-z_]+|[^\s0-9a-z_]+")
+_FIELDS = {f.name for f in fields(Comment)}
+
+
+def tokenize(text: str) -> set[str]:
+    '''英数字は単語、それ以外は1文字なら1文字、2文字以上なら2文字ずつ'''
+    tokens = set()
+    for word in _WORD.findall(text.lower()):
+        if word[0].isascii() and (word[0].isalnum() or word[0] == "_"):
+            tokens.add(word)
+        elif len(word) == 1:
+            tokens.add(word)
+        else:
+            tokens.update(word[i:i+2] for i in range(len(word) - 1))
+    return tokens
+
+
+class _Counts:
+    '''受け取った comment_count を重ならない [start, end] の区間で持つ'''
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+
+    def add(self, n: int) -> bool:
+        '''新しければ足して True'''
+        starts, ends = self.starts, self.ends
+        # ふつうは最後の区間のすぐ後ろに来る
+        if ends and ends[-1] + 1 == n:
+            ends[-1] = n
+            return True
+        i = bisect.bisect_right(starts, n) - 1
+        if i >= 0 and n <= ends[i]:
+            return False
+        joins_left = i >= 0 and ends[i] + 1 == n
+        joins_right = i + 1 < len(starts) and starts[i+1] - 1 == n
+        if joins_left and joins_right:
+            ends[i] = ends[i+1]
+            del starts[i+1], ends[i+1]
+        elif joins_left:
+            ends[i] = n
+        elif joins_right:
+            starts[i+1] = n
+        else:
+            starts.insert(i + 1, n)
+            ends.insert(i + 1, n)
+        return True
+
+    def gaps(self) -> list[tuple[int, int]]:
+        return [(e + 1, s - 1) for e, s in zip(self.ends, self.starts[1:])]
+
+
+class ChatArchive:
+    def __init__(self, path: Optional[str] = None):
+        '''path があれば読み込み、以降の新しいコメントはそこに追記する'''
+        self.comments: list[Comment] = []
+        self.duplicates = 0
+        self._counts: dict[str, _Counts] = {}
+        # token -> comments の番号(昇順)
+        self._words: dict[str, list[int]] = {}
+        self._players: dict[str, list[int]] = {}
+        self._guilds: dict[str, list[int]] = {}
+        self._lock = threading.Lock()
+        self.path = path
+        self._ledger: Optional[JSONLLedger] = None
+        if path is not None:
+            self._ledger = JSONLLedger(path)
+            for d in self._ledger.read("Comment"):
+                self._add(Comment(**{k: v for k, v in d.items()
+                                     if k in _FIELDS}))
+
+    def __len__(self) -> int:
+        return len(self.comments)
+
+    def _add(self, c: Comment) -> bool:
+        counts = self._counts.get(c.chat_place)
+        if counts is None:
+            counts = self._counts[c.chat_place] = _Counts()
+        if not counts.add(c.comment_count):
+            self.duplicates += 1
+            return False
+        i = len(self.comments)
+        self.comments.append(c)
+        for token in tokenize(c.comment):
+            self._words.setdefault(token, []).append(i)
+        self._players.setdefault(c.player.lower(), []).append(i)
+        self._guilds.setdefault(c.guild_tag.lower(), []).append(i)
+        return True
+
+    def add(self, comment: Comment) -> bool:
+        '''新しいコメントなら足して True'''
+        with self._lock:
+            if not self._add(comment):
+                return False
+            if self._ledger is not None:
+                self._ledger.append(comment)
+            return True
+
+    def add_many(self, records: Iterable) -> int:
+        '''Comment 以外は無視する。足した数を返す'''
+        n = sum(self.add(r) for r in records if isinstance(r, Comment))
+        self.flush()
+        return n
+
+    def flush(self) -> None:
+        if self._ledger is not None:
+            self._ledger.flush()
+
+    def close(self) -> None:
+        if self._ledger is not None:
+            self._ledger.close()
+
+    def gaps(self, chat_place: str) -> list[tuple[int, int]]:
+        '''取りこぼした comment_count の範囲 [(最初, 最後), ...]'''
+        counts = self._counts.get(chat_place)
+        return counts.gaps() if counts is not None else []
+
+    def search(self, text: str = "", player: Optional[str] = None,
+               guild_tag: Optional[str] = None,
+               chat_place: Optional[str] = None,
+               start: Optional[int] = None, end: Optional[int] = None,
+               limit: Optional[int] = 100) -> list[Comment]:
+        '''
+        条件に全部合うものを後から足した順に。
+        text は本文に含まれる文字列(大文字小文字は区別しない。英数字は単語で)、
+        player, guild_tag は完全一致(大文字小文字は区別しない)
+        '''
+        postings = []
+        if text:
+            # 1文字の日本語などは2文字の索引に入っていないことがある
+            tokens = [t for t in tokenize(text) if len(t) > 1 or t.isascii()]
+            postings += [self._words.get(t, []) for t in tokens]
+        if player is not None:
+            postings.append(self._players.get(player.lower(), []))
+        if guild_tag is not None:
+            postings.append(self._guilds.get(guild_tag.lower(), []))
+        with self._lock:
+            if postings:
+                postings.sort(key=len)
+                hits = set(postings[0])
+                for p in postings[1:]:
+                    hits.intersection_update(p)
+                candidates = sorted(hits, reverse=True)
+            else:
+                candidates = range(len(self.comments) - 1, -1, -1)
+            needle = text.lower()
+            result = []
+            for i in candidates:
+                c = self.comments[i]
+                # 2文字ずつの索引は順番を見ていないので、本文で確かめる
+                if needle and needle not in c.comment.lower():
+                    continue
+                if chat_place is not None and c.chat_place != chat_place:
+                    continue
+                if start is not None and c.time < start:
+                    continue
+                if end is not None and c.time > end:
+                    continue
+                result.append(c)
+                if limit is not None and len(result) >= limit:
+                    break
+            return result
+
+
+class ChatSink(Sink):
+    '''read_pcapfile(sink=...) などから ChatArchive に入れる'''
+
+    def __init__(self, archive: ChatArchive, **kwargs):
+        self.archive = archive
+        super().__init__(**kwargs)
+
+    def _write_batch(self, records: list) -> None:
+        self.archive.add_many(records)
@@ -1,2 +1,15 @@
 class LMCounterException(Exception):
     pass
+
+
+class LMValidationError(Exception):
+    '''
+    decode 中のチェックに引っかかったメッセージ
+    (read_packet の validation="strict" のとき)
+    '''
+
+    def __init__(self, what: str, code: str = "", payload: str = ""):
+        super().__init__(f"{code}: invalid {what}" if code else what)
+        self.what = what
+        self.code = code
+        self.payload = payload
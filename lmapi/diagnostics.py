@@ -0,0 +1,79 @@
+'''
+decode中に見つかった異常を数えるだけのカウンタ
+
+logger.warning を1件ごとに呼ぶと、マップを眺めているだけで
+ログ出力がボトルネックになるので、
+- (kind, code) ごとに件数を数える
+- kind ごとに生データのサンプルを数件だけ残す
+- まとめは interval 秒に1回だけ logger に出す
+'''
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Diagnostics:
+    def __init__(self, interval: float = 60.0, max_samples: int = 5,
+                 enabled: bool = True):
+        self.interval = interval
+        self.max_samples = max_samples
+        self.enabled = enabled
+        self.counts: Counter = Counter()
+        self.samples: dict[str, deque] = {}
+        self._reported: Counter = Counter()
+        self._next_report = time.monotonic() + interval
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, code: str = "",
+               payload: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counts[(kind, code)] += 1
+            if payload is not None:
+                samples = self.samples.get(kind)
+                if samples is None:
+                    samples = deque(maxlen=self.max_samples)
+                    self.samples[kind] = samples
+                samples.append((code, payload))
+        if time.monotonic() >= self._next_report:
+            self.report()
+
+    def report(self) -> None:
+        '''前回のまとめ以降に増えた分だけを1行ずつ出す'''
+        with self._lock:
+            self._next_report = time.monotonic() + self.interval
+            delta = self.counts - self._reported
+            self._reported = self.counts.copy()
+        for (kind, code), n in sorted(delta.items()):
+            total = self.counts[(kind, code)]
+            logger.warning(f"{kind} {code}: +{n} (total {total})")
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        '''{kind: {code: count}}'''
+        with self._lock:
+            result: dict[str, dict[str, int]] = {}
+            for (kind, code), n in self.counts.items():
+                result.setdefault(kind, {})[code] = n
+            return result
+
+    def get_samples(self, kind: str) -> list[tuple[str, str]]:
+        with self._lock:
+            return list(self.samples.get(kind, []))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.samples.clear()
+            self._reported.clear()
+
+
+diagnostics = Diagnostics()
+
+
+def record(kind: str, code: str = "", payload: Optional[str] = None) -> None:
+    diagnostics.record(kind, code, payload)
@@ -0,0 +1,368 @@
+'''
+lmpacket.py の逆。dataclass からローモバのメッセージ(hex文字列)を作る
+
+decode したものを encode すると(わかっていない部分を除いて)元に戻る。
+わかっていない部分は 0 で埋めるので、バイト列まで同じになるとは限らない。
+
+    msg = encode_370b00(gifts)
+    assert read_packet(msg, ["370b00"], []) == gifts
+
+    python -m lmapi.encoders [--count 100] [--seed 0]
+        # synth の RecordFactory で作ったものを code ごとに
+        # encode -> read_packet して、元と同じになるか確かめる
+'''
+import argparse
+import sys
+from dataclasses import asdict
+from typing import Any, Callable, Iterable
+from .hex_funcs import int2hexstr, str2hexstr, float2hexstr_le, xy2guid
+from .lmdataclass import (
+    Castle, Comment, Gift, GiftPopup, HuntReport, InnerGuildBoard,
+    MapObject, MapObjectCamp, MapObjectCastle, MapObjectFort,
+    MapObjectMonster, MapObjectMoving, MapObjectResourceTile,
+    OuterGuildBoard, Player, ResultOpenChests, SkillActivated,
+)
+from .lmpacket import read_packet
+
+i2h = int2hexstr
+s2h = str2hexstr
+
+
+def encode_message(code: str, body: str) -> str:
+    '''length(2 bytes) + code(3 bytes) + body'''
+    assert len(code) == 6 and len(body) % 2 == 0
+    return i2h(5 + len(body)//2, 2) + code + body
+
+
+def __guid(x: int, y: int) -> str:
+    if x < 0 or y < 0:
+        return "000000"
+    return xy2guid(x, y)
+
+
+def encode_gift(g: Gift) -> str:
+    '''[66 chars], __create_gift() の逆'''
+    return (
+        i2h(g.sort_index, 4) + "01" + i2h(g.time, 8)
+        + g.gift_id + g.item_id + i2h(g.number_of_item, 1) + "00"
+        + i2h(g.material_quality, 1) + s2h(g.player, 13)
+    )
+
+
+def encode_370b00(gifts: list[Gift]) -> str:
+    assert len(gifts) < 256
+    body = "0"*18 + i2h(len(gifts), 1) + "".join(map(encode_gift, gifts))
+    return encode_message("370b00", body)
+
+
+def encode_310b00(g: Gift) -> str:
+    return encode_message("310b00", encode_gift(g) + "0"*16)
+
+
+def encode_2b0b12(p: GiftPopup) -> str:
+    return encode_message(
+        "2b0b12", i2h(p.counter, 2) + p.gift_id + s2h(p.player, 13))
+
+
+def encode_2b0b13(p: GiftPopup) -> str:
+    return encode_message(
+        "2b0b13",
+        i2h(p.counter, 5) + i2h(p.unixtime, 8) + p.gift_id + "0"*10
+        + s2h(p.player, 13) + i2h(p.counter2, 4))
+
+
+def encode_060b00(players: list[Player]) -> str:
+    assert len(players) < 256
+    body = "00" + i2h(len(players), 1) + "".join(
+        i2h(p.iggid, 8) + i2h(p.avatar_id, 2) + s2h(p.name, 13)
+        + i2h(p.guild_rank, 1) + i2h(p.might, 8) + i2h(p.kills, 8)
+        + i2h(p.lastseen, 8)
+        for p in players)
+    return encode_message("060b00", body)
+
+
+def encode_map_object(m: MapObject) -> str:
+    '''[98 chars], __create_map_object() の逆。移動中(00)だけ後ろに 6 chars つく'''
+    o = m.obj
+    head = __guid(m.x, m.y) + m.object_type
+    if isinstance(o, MapObjectMonster):
+        body = (i2h(o.lv, 1) + o.monster_id + i2h(o.time_remain, 4)
+                + float2hexstr_le(o.hp_percentage))
+    elif isinstance(o, MapObjectCastle):
+        body = (s2h(o.player, 13) + s2h(o.guild_tag, 3)
+                + i2h(o.kingdom_player, 2) + i2h(o.lv, 1)
+                + i2h(o.status_flag, 1) + i2h(o.title, 2)
+                + i2h(o.kingdom_guild, 2) + o.castle_skin_id
+                + i2h(o.castle_skin_lv, 1))
+    elif isinstance(o, MapObjectResourceTile):
+        if o.player:
+            who = (s2h(o.player, 13) + s2h(o.guild_tag, 3)
+                   + i2h(int(o.kingdom_player), 2))
+        else:
+            who = "0"*36
+        body = (who + i2h(o.lv, 1) + i2h(o.maximum_resource, 4)
+                + float2hexstr_le(o.remaining_percentage)
+                + i2h(o.timestamp, 4))
+    elif isinstance(o, MapObjectCamp):
+        body = (s2h(o.player, 13) + s2h(o.guild_tag, 3)
+                + i2h(o.kingdom_player, 2) + i2h(o.lv, 1)
+                + i2h(o.status_flag, 1) + i2h(o.title, 2)
+                + i2h(o.kingdom_guild, 2))
+    elif isinstance(o, MapObjectFort):
+        body = (o.fort_id + "0"*28 + s2h(o.player_name, 13)
+                + s2h(o.guild_tag, 3) + i2h(o.kingdom_player, 2) + "00"
+                + i2h(o.kingdom_guild, 2) + i2h(o.kingdom_fort, 2))
+    elif isinstance(o, MapObjectMoving):
+        body = (s2h(o.player, 13) + s2h(o.guild_tag, 3)
+                + i2h(o.kingdom, 2) + __guid(o.xfrom, o.yfrom)
+                + __guid(o.xto, o.yto) + i2h(o.time_stamp, 4) + "0"*8
+                + i2h(o.total_sec, 2) + "0"*20)
+        return head + body + o.mode + "0"*6
+    else:
+        raise NotImplementedError(f"unknown obj: {type(o).__name__}")
+    return head + body + "0"*(90-len(body))
+
+
+def encode_ac08(objs: list[MapObject], code="ac0817") -> str:
+    return encode_message(code, "".join(map(encode_map_object, objs)))
+
+
+def encode_ac080c(c: Castle) -> str:
+    return encode_message(
+        "ac080c",
+        i2h(c.tile_id, 8) + i2h(c.unk_2f, 1) + c.guid
+        + s2h(c.long_guild_name, 20) + i2h(c.vip_level, 1)
+        + i2h(c.guild_rank, 1) + i2h(c.unk4, 6) + i2h(c.might, 8)
+        + i2h(c.troops_killed, 8))
+
+
+def encode_5e0d(h: HuntReport, code="5e0d01") -> str:
+    body = (
+        "0"*8 + i2h(h.time_stamp, 4) + "0"*8 + i2h(h.kingdom, 2)
+        + __guid(h.x, h.y) + ("01" if h.killed else "00") + "0"*4
+        + h.monster_id + i2h(h.monster_lv, 1) + i2h(h.hp_start, 4)
+        + i2h(h.hp_remain, 4) + i2h(h.hp_maximum, 4)
+        + i2h(h.player_exp, 4) + "".join(h.hero_ids) + "0"*40
+        + "".join(h.hero_infos) + i2h(h.hunt_in_a_row, 1)
+        + i2h(h.energy_used, 1) + i2h(h.energy_dealt, 1) + "0"*42
+        + "1100000001000000" + i2h(h.num_kinds, 1)
+        + "".join(i.item_id + i2h(i.number_of_item, 2)
+                  + i2h(i.material_quality, 1) for i in h.rewards)
+    )
+    return encode_message(code, body)
+
+
+# CHAT_TYPES in __read_bb0b00
+CHAT_TEXTS = {
+    "6a": "", "6c": "executed", "65": "exit guild", "66": "",
+    "69": "enter guild", "68": "kicked",
+}
+
+
+def encode_bb0b00(c: Comment) -> str:
+    head = (
+        c.chat_place + i2h(c.time, 4) + "0"*8 + i2h(c.iggid, 4) + "0"*8
+        + i2h(c.comment_count, 3) + "0"*10 + "00" + c.chat_type + "0"*4
+        + s2h(c.player, 13) + c.unk1 + s2h(c.guild_tag, 3) + c.color
+        + c.title + c.unk2
+    )
+    if c.chat_type == "00":
+        text = c.comment.encode("utf-8").hex()
+        tail = i2h(len(text)//2, 2) + text
+    elif c.chat_type == "6d":
+        # エモーティコンは d[114:] がそのまま入っていて、
+        # 長さの上位バイトが c.comment の先頭と重なっている
+        n = (len(c.comment)-2)//2 - (int(c.comment[:2], 16) << 8)
+        tail = i2h(n & 0xff, 1) + c.comment
+    elif c.chat_type in ("68", "6c"):
+        by = c.comment[len(CHAT_TEXTS[c.chat_type] + " by "):]
+        text = by.encode("utf-8").hex()
+        tail = i2h(len(text)//2, 2) + text
+    else:
+        tail = "0000"
+    return encode_message("bb0b00", head + tail)
+
+
+def encode_7f0500(r: ResultOpenChests) -> str:
+    return encode_message(
+        "7f0500",
+        r.chest_id + "0"*42 + "".join(
+            i.item_id + i2h(i.number_of_items, 2) + i2h(i.rarity, 1)
+            for i in r.items))
+
+
+def encode_2a0b00(b: OuterGuildBoard) -> str:
+    body = (
+        b.guild_id + s2h(b.guild_leader, 13) + s2h(b.guild_tag, 3)
+        + s2h(b.long_guild_name, 20) + b.board.ljust(2600, "0")
+        + s2h(b.guild_slogan, 20) + b.unknown1 + "0"*6
+        + i2h(b.gift_level, 1) + i2h(b.kingdom, 2) + b.unknown2
+        + i2h(b.guild_fest_rank, 1) + i2h(b.guild_showdown_rank, 1) + "00"
+        + i2h(b.da_cups, 2) + i2h(b.guild_bash_rank, 1) + "01"
+    )
+    return encode_message("2a0b00", body)
+
+
+def encode_f20a(b: InnerGuildBoard, code="f20af0") -> str:
+    body = (
+        b.guild_id + s2h(b.guild_leader, 13) + b.unknown1 + b.unknown2
+        + "0"*6 + s2h(b.guild_tag, 3) + s2h(b.long_guild_name, 20)
+        + s2h(b.guild_slogan, 20) + b.board.ljust(1800, "0")
+        + b.unknown3 + b.unknown4 + b.unknown5 + "0"*12
+        + i2h(b.kingdom, 2) + "0"*16 + b.unknown6 + b.unknown7 + "0"*50
+        + b.unknown8 + b.unknown9 + "0"*10 + i2h(b.guild_fest_rank, 1)
+        + i2h(b.guild_showdown_rank, 2) + i2h(b.da_cups, 2)
+        + i2h(b.guild_bash_rank, 1) + b.unknowna + "0001"
+    )
+    return encode_message(code, body)
+
+
+def encode_232000(s: SkillActivated) -> str:
+    return encode_message(
+        "232000",
+        s.skill_code + i2h(s.time_activated_lasttime, 4) + "0"*16)
+
+
+def __chunks(records: list, n: int) -> list[list]:
+    return [records[i:i+n] for i in range(0, len(records), n)]
+
+
+def encode(code: str, records: list) -> str:
+    '''
+    records (read_packet(code) の結果と同じもの) を code のメッセージにする。
+    ac08, 5e0d, f20a は code の先頭4文字で決まる
+    '''
+    if code == "370b00":
+        return encode_370b00(records)
+    elif code == "060b00":
+        return encode_060b00(records)
+    elif code == "ac080c":
+        return encode_ac080c(records[0])
+    elif code.startswith("ac08") or code.startswith("ba08"):
+        return encode_ac08(records, code)
+    elif code.startswith("5e0d"):
+        return encode_5e0d(records[0], code)
+    elif code.startswith("f20a"):
+        return encode_f20a(records[0], code)
+    single: dict[str, Callable[[Any], str]] = {
+        "310b00": encode_310b00,
+        "2b0b12": encode_2b0b12,
+        "2b0b13": encode_2b0b13,
+        "bb0b00": encode_bb0b00,
+        "7f0500": encode_7f0500,
+        "2a0b00": encode_2a0b00,
+        "232000": encode_232000,
+    }
+    if code not in single:
+        raise NotImplementedError(f"no encoder for {code}")
+    assert len(records) == 1, f"{code} holds only one record"
+    return single[code](records[0])
+
+
+# 型 -> (code, 1メッセージに入れる最大件数)
+DEFAULT_CODES: dict[type, tuple[str, int]] = {
+    Gift: ("370b00", 255),
+    GiftPopup: ("2b0b13", 1),
+    Player: ("060b00", 255),
+    MapObject: ("ac0817", 40),
+    Castle: ("ac080c", 1),
+    HuntReport: ("5e0d01", 1),
+    Comment: ("bb0b00", 1),
+    ResultOpenChests: ("7f0500", 1),
+    OuterGuildBoard: ("2a0b00", 1),
+    InnerGuildBoard: ("f20af0", 1),
+    SkillActivated: ("232000", 1),
+}
+
+
+def encode_records(records: Iterable) -> list[str]:
+    '''型ごとにまとめて、DEFAULT_CODES の code でメッセージにする'''
+    by_type: dict[type, list] = {}
+    for r in records:
+        by_type.setdefault(type(r), []).append(r)
+    messages = []
+    for t, rs in by_type.items():
+        if t not in DEFAULT_CODES:
+            raise NotImplementedError(f"no encoder for {t.__name__}")
+        code, n = DEFAULT_CODES[t]
+        messages += [encode(code, chunk) for chunk in __chunks(rs, n)]
+    return messages
+
+
+# decode しても戻らないもの
+# - time_gift_opened は read_packet(timestamp=) から入る
+# - fort_name は __repr__ で入る
+# - 2b0b12 の unixtime は decode した時刻
+IGNORED_FIELDS = {"time_gift_opened", "fort_name"}
+
+
+def __comparable(r, code: str) -> dict:
+    d = asdict(r)
+    for k in IGNORED_FIELDS:
+        d.pop(k, None)
+    if code == "2b0b12":
+        # 2b0b12 には入っていない
+        d.pop("unixtime")
+        d.pop("counter2")
+    if isinstance(r, MapObject) and r.object_type == "00":
+        # 移動中の x, y は guid から計算していない
+        d.pop("x")
+        d.pop("y")
+    return d
+
+
+def verify_roundtrip(message: str) -> bool:
+    '''
+    message を decode して encode し直し、もう一度 decode して同じになるか。
+    同じでなければ AssertionError
+    '''
+    code = message[4:10]
+    first = read_packet(message, [code], [])
+    assert first is not None, f"not decoded: {code}"
+    second = read_packet(encode(code, first), [code], [])
+    a = [__comparable(r, code) for r in first]
+    b = [__comparable(r, code) for r in second]
+    assert a == b, f"{code}\n{a}\n{b}"
+    return True
+
+
+def verify_records(code: str, records: list) -> bool:
+    '''
+    records を code のメッセージにして decode し、records と同じになるか。
+    同じでなければ AssertionError
+    '''
+    decoded = read_packet(encode(code, records), [code], [])
+    assert decoded is not None, f"not decoded: {code}"
+    a = [__comparable(r, code) for r in records]
+    b = [__comparable(r, code) for r in decoded]
+    assert a == b, f"{code}\n{a}\n{b}"
+    return True
+
+
+def main(argv=None) -> int:
+    # synth は encoders を import するので、ここで import する
+    from .synth import DEFAULT_MIX, RecordFactory
+    parser = argparse.ArgumentParser(
+        prog="python -m lmapi.encoders",
+        description="check that encoded records decode back to themselves")
+    parser.add_argument("--count", type=int, default=100,
+                        help="messages per code")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    factory = RecordFactory(args.seed)
+    failed = 0
+    for code in DEFAULT_MIX:
+        try:
+            for _ in range(args.count):
+                verify_records(code, factory.records_for(code))
+        except AssertionError as e:
+            failed += 1
+            print(f"{code}: FAILED {e}", file=sys.stderr)
+            continue
+        print(f"{code}: round trip ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+'''
+書き込み中の.pcapを tail -f のように追いかけて decode する
+
+    follower = PcapFollower("capture.pcap", ["370b00"], [],
+                            checkpoint="capture.pcap.ckpt")
+    for r in follower.run():
+        print(r)
+
+checkpoint には
+- 次に読むレコードのファイルオフセット
+- 接続ごとの Framer の状態(メッセージの途中まで来ているデータ)
+を保存するので、再起動しても続きから読める。
+レコード1つ分の decode 結果を返し終わるたびに進むので、
+途中で止めた場合はそのレコードの分だけもう一度返すことがある。
+
+ファイルが小さくなった・inodeが変わった(ローテーション)ときは先頭から読み直す。
+'''
+import json
+import logging
+import os
+import time
+from typing import Iterator, Optional
+from .bpf import CaptureFilter
+from .capture import iter_record_segments
+from .framer import FlowFramer
+from .lmpacket import STRICT, read_packet
+from .pcapfile import GLOBAL_HEADER_LEN, read_header
+from . import diagnostics
+
+logger = logging.getLogger(__name__)
+
+
+class PcapFollower:
+    def __init__(self, pcapfile: str, codes, codestartwith,
+                 checkpoint: Optional[str] = None, ipaddrs=[],
+                 delim=80, poll_interval: float = 1.0,
+                 checkpoint_interval: float = 5.0,
+                 validation: str = STRICT):
+        self.pcapfile = pcapfile
+        self.codes = codes
+        self.codestartwith = codestartwith
+        self.checkpoint = checkpoint
+        self.ipaddrs = ipaddrs
+        self.delim = delim
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.validation = validation
+        self.offset = GLOBAL_HEADER_LEN
+        self.inode: Optional[int] = None
+        self.framer = FlowFramer(codes)
+        # レコードの結果を返している途中なら、そのレコードを読む前の
+        # (offset, 接続, その接続の Framer の状態)。checkpoint にはこちらを書く
+        self._before: Optional[tuple[int, tuple, Optional[dict]]] = None
+        self.stopped = False
+        if checkpoint and os.path.exists(checkpoint):
+            self.load_checkpoint()
+
+    def load_checkpoint(self) -> None:
+        if not self.checkpoint:
+            return
+        with open(self.checkpoint, encoding="utf-8") as f:
+            state = json.load(f)
+        self.offset = state["offset"]
+        self.inode = state.get("inode")
+        self.framer = FlowFramer.from_state(state["framer"])
+        logger.info(f"resume {self.pcapfile} from offset {self.offset}")
+
+    def save_checkpoint(self) -> None:
+        if not self.checkpoint:
+            return
+        offset, framer = self.offset, self.framer.get_state()
+        if self._before is not None:
+            offset, flow, before = self._before
+            framer["flows"] = [
+                [f, state] for f, state in framer["flows"]
+                if tuple(f) != tuple(flow)]
+            if before is not None:
+                framer["flows"].append([list(flow), before])
+        state = {
+            "pcapfile": self.pcapfile,
+            "inode": self.inode,
+            "offset": offset,
+            "framer": framer,
+            "saved_at": time.time(),
+        }
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint)
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def _rotated(self, st: os.stat_result) -> bool:
+        if self.inode is not None and st.st_ino != self.inode:
+            return True
+        return st.st_size < self.offset
+
+    def run(self, follow: bool = True) -> Iterator:
+        '''follow=False なら、今ある分を読み終えたら終わる'''
+        last_saved = time.monotonic()
+        try:
+            while not self.stopped:
+                try:
+                    st = os.stat(self.pcapfile)
+                except FileNotFoundError:
+                    st = None
+                if st is not None and self._rotated(st):
+                    logger.info(f"{self.pcapfile} rotated, start over")
+                    self.offset = GLOBAL_HEADER_LEN
+                    self.framer = FlowFramer(self.codes)
+                if st is not None and st.st_size > self.offset:
+                    self.inode = st.st_ino
+                    yield from self._read_new()
+                if time.monotonic() - last_saved > self.checkpoint_interval:
+                    self.save_checkpoint()
+                    last_saved = time.monotonic()
+                if not follow:
+                    break
+                time.sleep(self.poll_interval)
+        finally:
+            self.save_checkpoint()
+            diagnostics.diagnostics.report()
+
+    def _read_new(self) -> Iterator:
+        with open(self.pcapfile, "rb") as f:
+            try:
+                header = read_header(f)
+            except EOFError:
+                return
+            capture_filter = CaptureFilter(ipaddrs=self.ipaddrs)
+            for record, segment in iter_record_segments(
+                    f, header, self.offset, capture_filter):
+                if segment is None:
+                    self.offset = record.next_offset
+                    continue
+                flow = segment.flow
+                timestamp = segment.timestamp
+                framer = self.framer.framers.get(flow)
+                self._before = (self.offset, flow, None if framer is None
+                                else framer.get_state())
+                for _, data in self.framer.feed(flow,
+                                                segment.payload.hex()):
+                    if len(data) < self.delim:
+                        continue
+                    result = read_packet(
+                        data, self.codes, self.codestartwith,
+                        timestamp=timestamp, validation=self.validation)
+                    if result:
+                        yield from result
+                self.offset = record.next_offset
+                self._before = None
+                if self.stopped:
+                    return
+
+
+def follow_pcapfile(pcapfile: str, codes, codestartwith,
+                    checkpoint: Optional[str] = None, ipaddrs=[],
+                    delim=80, poll_interval: float = 1.0) -> Iterator:
+    follower = PcapFollower(pcapfile, codes, codestartwith,
+                            checkpoint=checkpoint, ipaddrs=ipaddrs,
+                            delim=delim, poll_interval=poll_interval)
+    return follower.run()
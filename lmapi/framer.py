@@ -0,0 +1,127 @@
+'''
+TCPのペイロード(hex文字列)を、ローモバのメッセージ単位に切り出す
+
+メッセージは
+- length of data (2 bytes, little endian, length自身を含む)
+- "code" (3 bytes)
+- body
+'''
+import logging
+from typing import Hashable, Iterable
+from . import diagnostics
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Framer:
+    '''
+    read_pcapfile などで使っていたループをまとめたもの。
+    受け取ったhex文字列をためておき、揃ったメッセージから順に返す。
+
+    position は buffer の先頭がストリーム先頭から何文字目か(hex文字数)。
+    '''
+
+    def __init__(self, codes: Iterable[str] = ()):
+        self.codes = list(codes)
+        self.buffer = ""
+        self.position = 0
+        self.resyncs = 0
+        self.high_water = 0
+
+    def feed(self, hexstr: str) -> list[tuple[int, str]]:
+        '''(ストリーム上の位置, メッセージ) のリストを返す'''
+        d = self.buffer + hexstr if self.buffer else hexstr
+        if len(d) > self.high_water:
+            self.high_water = len(d)
+        messages = []
+        resyncs = self.resyncs
+        i = 0
+        n = len(d)
+        while n - i >= 10:
+            # データ長さ
+            length = int(d[i+2:i+4] + d[i:i+2], 16) * 2
+            if length == 0:
+                # データ長さが0だとどうしようもなくなる。
+                # codesが見つかるか試す
+                self.resyncs += 1
+                for code in self.codes:
+                    pos = d.find(code, i+4)
+                    if pos != -1:
+                        i = pos - 4
+                        length = int(d[i+2:i+4] + d[i:i+2], 16) * 2
+                        break
+                if length < 10:
+                    # codesが見つからなかったら関係ないし、丸ごとスキップする
+                    diagnostics.record("framing skip", d[i+4:i+10], d[i:i+64])
+                    i = n
+                    break
+            if n - i < length:
+                # データ長さが足りなかったら次のパケットを待つ
+                break
+            messages.append((self.position + i, d[i:i+length]))
+            i += length
+        self.buffer = d[i:]
+        self.position += i
+        if metrics.enabled:
+            metrics.framing(len(hexstr)//2, len(messages),
+                            self.resyncs - resyncs, n//2)
+        return messages
+
+    def reset(self) -> None:
+        self.position += len(self.buffer)
+        self.buffer = ""
+
+    def get_state(self) -> dict:
+        return {
+            "codes": self.codes,
+            "buffer": self.buffer,
+            "position": self.position,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Framer":
+        framer = cls(state.get("codes", ()))
+        framer.buffer = state.get("buffer", "")
+        framer.position = state.get("position", 0)
+        return framer
+
+
+class FlowFramer:
+    '''
+    接続(flow)ごとに Framer を持つ。
+    同じキャプチャに複数の接続があっても、メッセージが混ざらない。
+    '''
+
+    def __init__(self, codes: Iterable[str] = ()):
+        self.codes = list(codes)
+        self.framers: dict[Hashable, Framer] = {}
+
+    def get(self, flow: Hashable) -> Framer:
+        '''その接続の Framer (なければ作る)'''
+        framer = self.framers.get(flow)
+        if framer is None:
+            framer = self.framers[flow] = Framer(self.codes)
+        return framer
+
+    def feed(self, flow: Hashable, hexstr: str) -> list[tuple[int, str]]:
+        return self.get(flow).feed(hexstr)
+
+    def close(self, flow: Hashable) -> None:
+        '''接続が終わったら、途中までのデータは捨てる'''
+        self.framers.pop(flow, None)
+
+    def get_state(self) -> dict:
+        '''flow は tuple (capture.Flow など) であること'''
+        return {
+            "codes": self.codes,
+            "flows": [[list(flow), framer.get_state()]
+                      for flow, framer in self.framers.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "FlowFramer":
+        flow_framer = cls(state.get("codes", ()))
+        for flow, framer in state.get("flows", []):
+            flow_framer.framers[tuple(flow)] = Framer.from_state(framer)
+        return flow_framer
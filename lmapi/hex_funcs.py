@@ -55,43 +55,44 @@ def guid2xy(hexstring: str) -> tuple[int, int]:
 
 def xy2guid(x: int, y: int) -> str:
     '''
-    TODO
+    guid2xy() の逆
     struct IngameGUIDStruct
     {
-        unsigned int unused1 : 8;
         unsigned int x1 : 4;
         unsigned int y1 : 4;
         unsigned int y2 : 4;
-        unsigned int unused2 : 4;
+        unsigned int unused : 4;
         unsigned int x0 : 4;
         unsigned int y0 : 4;
     };
+    x は y の偶奇と同じでないといけない(guid2xy の (y & 1) の部分)
     '''
-    y4bits = [
-        y >> 0 & 15,
-        y >> 4 & 15,
-        y >> 8 & 15,
-        0
-    ]
-    x4bits = [
-        x >> 1 & 15,
-        x >> 5 & 15,
-        x >> 9 & 15,
-        0
-    ]
+    assert 0 <= x <= 511 and 0 <= y <= 1023
+    assert (x - y) % 2 == 0, f"x and y must have the same parity: {x}, {y}"
+    xh = (x - (y & 1)) >> 1
     guid_bytes = [
-        0,
-        y4bits[1]*2**4+x4bits[1],  # wrong
-        y4bits[2],
-        x4bits[0]
+        (y >> 4 & 15) << 4 | (xh >> 4 & 15),
+        y >> 8 & 15,
+        (y & 15) << 4 | (xh & 15),
     ]
-    print("x4bits", x4bits)
-    print("y4bits", y4bits)
-    print("guid bytes", guid_bytes)
-    guid = ""
-    for b in guid_bytes:
-        guid += '{:02x}'.format(b)
-    return guid
+    return bytes(guid_bytes).hex()
+
+
+def int2hexstr(value: int, nbytes: int) -> str:
+    '''hexstr2int() の逆(little endian)'''
+    return int(value).to_bytes(nbytes, "little").hex()
+
+
+def str2hexstr(s: str, nbytes: int, encoding="utf-8") -> str:
+    '''hexstr2str() の逆。nbytes に足りない分は 00 で埋める'''
+    b = s.encode(encoding)
+    assert len(b) <= nbytes, f"too long: {s}"
+    return (b + b"\x00"*(nbytes-len(b))).hex()
+
+
+def float2hexstr_le(f: float) -> str:
+    '''hexstr2float() の逆'''
+    return struct.pack('<f', f).hex()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+'''
+討伐メール(5e0d)の集計
+
+    table = HuntTable.from_reports(reports)   # もしくは read_hunt_pcapfile()
+    table.summary(("monster_id", "monster_lv"))
+    table.summary(("lineup",))                # ヒーローの組み合わせごと
+    table.reward_counts(("monster_id",))
+
+HuntReport を1回だけなめて列ごとの配列にしておき、集計は列の演算でやる。
+- monster_id, lineup(hero_ids を並べたもの), 報酬の item_id は
+  番号にして、categories に元の値を持つ
+- rewards は (何番目の討伐か, item_id, 個数) の縦長の表にする
+- numpy があれば np.unique / np.bincount で集計する。
+  なければ同じ結果を Python のループで出す
+'''
+import math
+from typing import Any, Iterable, Optional
+from .lmdataclass import HuntReport
+from .lmpacket import STRICT
+from .pcapReader import iter_pcapfile
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None  # type: ignore[assignment]
+
+# そのまま持つ列
+INT_COLUMNS = (
+    "time_stamp", "kingdom", "x", "y", "killed", "monster_lv", "hp_start",
+    "hp_remain", "hp_maximum", "player_exp", "hunt_in_a_row", "energy_used",
+    "energy_dealt",
+)
+# 番号にして持つ列
+CATEGORY_COLUMNS = ("monster_id", "lineup")
+
+# 列。numpy があれば np.ndarray、なければ list
+Column = Any
+
+
+class _Categories:
+    def __init__(self):
+        self.values: list = []
+        self.codes: dict = {}
+
+    def code(self, value) -> int:
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return c
+
+
+def _unique_rows(columns: list) -> tuple[list[tuple], "np.ndarray"]:
+    '''
+    負でない整数の列の組み合わせの np.unique。
+    np.unique(axis=0) は遅いので、1つの int64 にまとめてから数える
+    '''
+    n = len(columns[0])
+    if n == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    radix = [int(c.max()) + 1 for c in columns]
+    if math.prod(radix) >= 2**63:
+        # time_stamp などで int64 に入らないとき
+        uniq, inverse = np.unique(np.stack(columns, axis=1), axis=0,
+                                  return_inverse=True)
+        return [tuple(k) for k in uniq.tolist()], inverse.reshape(-1)
+    packed = np.zeros(n, dtype=np.int64)
+    for c, r in zip(columns, radix):
+        packed = packed * r + c
+    uniq, inverse = np.unique(packed, return_inverse=True)
+    keys = []
+    for r in reversed(radix):
+        keys.append(uniq % r)
+        uniq = uniq // r
+    return (list(zip(*[k.tolist() for k in reversed(keys)])),
+            inverse.reshape(-1))
+
+
+class HuntTable:
+    def __init__(self):
+        self.columns: dict[str, list] = {
+            name: [] for name in INT_COLUMNS + CATEGORY_COLUMNS}
+        self.categories = {name: _Categories() for name in CATEGORY_COLUMNS}
+        self.items = _Categories()
+        # 報酬の縦長の表
+        self.reward_report: list[int] = []
+        self.reward_item: list[int] = []
+        self.reward_number: list[int] = []
+        self._arrays: Optional[dict[str, Column]] = None
+
+    def __len__(self) -> int:
+        return len(self.columns["time_stamp"])
+
+    @classmethod
+    def from_reports(cls, reports: Iterable) -> "HuntTable":
+        table = cls()
+        table.extend(reports)
+        return table
+
+    def extend(self, reports: Iterable) -> None:
+        '''HuntReport 以外は無視する'''
+        cols = self.columns
+        appends = [(cols[name].append, name) for name in INT_COLUMNS]
+        monster = self.categories["monster_id"].code
+        lineup = self.categories["lineup"].code
+        item = self.items.code
+        i = len(self)
+        for r in reports:
+            if not isinstance(r, HuntReport):
+                continue
+            for append, name in appends:
+                append(int(getattr(r, name)))
+            cols["monster_id"].append(monster(r.monster_id))
+            cols["lineup"].append(lineup(",".join(sorted(r.hero_ids))))
+            for reward in r.rewards:
+                self.reward_report.append(i)
+                self.reward_item.append(item(reward.item_id))
+                self.reward_number.append(reward.number_of_item)
+            i += 1
+        self._arrays = None
+
+    def arrays(self) -> dict[str, Column]:
+        '''列を numpy の配列にしたもの(numpy がなければ list のまま)'''
+        if self._arrays is None:
+            arrays: dict[str, Column] = dict(self.columns)
+            arrays["reward_report"] = self.reward_report
+            arrays["reward_item"] = self.reward_item
+            arrays["reward_number"] = self.reward_number
+            if np is not None:
+                arrays = {k: np.asarray(v, dtype=np.int64)
+                          for k, v in arrays.items()}
+            self._arrays = arrays
+        return self._arrays
+
+    def _key_value(self, name: str, code: int):
+        if name in self.categories:
+            return self.categories[name].values[code]
+        return code
+
+    def _groups(self, by: tuple[str, ...]) -> tuple[list[tuple], Column]:
+        '''(グループのキーのリスト, 行ごとのグループ番号)'''
+        cols = self.arrays()
+        if np is not None:
+            uniq, inverse = _unique_rows([cols[name] for name in by])
+            return uniq, inverse
+        columns = [cols[name] for name in by]
+        codes: dict[tuple, int] = {}
+        inverse = [codes.setdefault(k, len(codes)) for k in zip(*columns)]
+        return list(codes), inverse
+
+    def _sums(self, groups: Column, n: int,
+              values: dict[str, Column]) -> dict[str, list]:
+        '''グループごとの合計'''
+        if np is not None:
+            return {k: np.bincount(groups, weights=v, minlength=n).tolist()
+                    for k, v in values.items()}
+        sums = {k: [0] * n for k in values}
+        for k, v in values.items():
+            s = sums[k]
+            for g, x in zip(groups, v):
+                s[g] += x
+        return sums
+
+    def summary(self, by: tuple[str, ...] = ("monster_id", "monster_lv")
+                ) -> list[dict]:
+        '''
+        by の組み合わせごとに、討伐数の多い順
+        - hunts, kills: 回数
+        - energy_used, energy_dealt: 合計。efficiency = dealt / used
+        - damage_ratio: 1回あたりの (hp_start - hp_remain) / hp_maximum の平均
+        - exp_per_energy: player_exp の合計 / energy_used の合計
+        '''
+        if not len(self):
+            return []
+        cols = self.arrays()
+        keys, groups = self._groups(by)
+        if np is not None:
+            hp_max = cols["hp_maximum"]
+            damage = np.divide(cols["hp_start"] - cols["hp_remain"], hp_max,
+                               out=np.zeros(len(hp_max)), where=hp_max > 0)
+            ones = np.ones(len(self))
+        else:
+            damage = [(s - r) / m if m > 0 else 0.0
+                      for s, r, m in zip(cols["hp_start"], cols["hp_remain"],
+                                         cols["hp_maximum"])]
+            ones = [1] * len(self)
+        sums = self._sums(groups, len(keys), {
+            "hunts": ones,
+            "kills": cols["killed"],
+            "energy_used": cols["energy_used"],
+            "energy_dealt": cols["energy_dealt"],
+            "player_exp": cols["player_exp"],
+            "damage": damage,
+        })
+        result = []
+        for g, key in enumerate(keys):
+            hunts = int(sums["hunts"][g])
+            used = int(sums["energy_used"][g])
+            dealt = int(sums["energy_dealt"][g])
+            exp = int(sums["player_exp"][g])
+            row = {name: self._key_value(name, code)
+                   for name, code in zip(by, key)}
+            row.update({
+                "hunts": hunts,
+                "kills": int(sums["kills"][g]),
+                "energy_used": used,
+                "energy_dealt": dealt,
+                "efficiency": dealt / used if used else 0.0,
+                "damage_ratio": sums["damage"][g] / hunts,
+                "player_exp": exp,
+                "exp_per_energy": exp / used if used else 0.0,
+            })
+            result.append(row)
+        result.sort(key=lambda r: -r["hunts"])
+        return result
+
+    def reward_counts(self, by: tuple[str, ...] = ("monster_id",)
+                      ) -> list[dict]:
+        '''
+        by と item_id の組み合わせごとの報酬
+        - number: 個数の合計, drops: 出た回数
+        - per_hunt: そのグループの1回あたりの個数
+        '''
+        if not self.reward_report:
+            return []
+        cols = self.arrays()
+        report_keys, report_groups = self._groups(by)
+        hunts = self._sums(report_groups, len(report_keys),
+                           {"n": [1] * len(self)})["n"]
+        reports = cols["reward_report"]
+        if np is not None:
+            pairs, groups = _unique_rows([report_groups[reports],
+                                          cols["reward_item"]])
+            ones = np.ones(len(reports))
+        else:
+            codes: dict[tuple, int] = {}
+            groups = [codes.setdefault((report_groups[r], i), len(codes))
+                      for r, i in zip(reports, cols["reward_item"])]
+            pairs = list(codes)
+            ones = [1] * len(reports)
+        sums = self._sums(groups, len(pairs), {
+            "number": cols["reward_number"], "drops": ones})
+        result = []
+        for g, (report_group, item) in enumerate(pairs):
+            row = {name: self._key_value(name, code)
+                   for name, code in zip(by, report_keys[report_group])}
+            number = int(sums["number"][g])
+            row.update({
+                "item_id": self.items.values[item],
+                "number": number,
+                "drops": int(sums["drops"][g]),
+                "per_hunt": number / hunts[report_group],
+            })
+            result.append(row)
+        result.sort(key=lambda r: -r["number"])
+        return result
+
+
+def read_hunt_pcapfile(pcapfile: str, table: Optional[HuntTable] = None,
+                       ipaddrs=[], validation: str = STRICT,
+                       backend: Optional[str] = None) -> HuntTable:
+    '''pcap の 5e0d を table に入れる'''
+    if table is None:
+        table = HuntTable()
+    for _, reports in iter_pcapfile(pcapfile, [], ["5e0d"], ipaddrs, 0,
+                                    validation, backend):
+        table.extend(reports)
+    return table
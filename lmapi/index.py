@@ -0,0 +1,245 @@
+'''
+.pcap の横に置くメッセージ索引(.lmidx)
+
+1回だけ全体を接続ごとにframingして、メッセージごとに
+- 先頭が含まれるレコードのファイルオフセット
+- そのレコードのペイロードの何バイト目から始まるか
+- 長さ(バイト), code, timestamp, 接続の番号 (meta の flows の何番目か)
+を記録しておく。2回目以降は必要なメッセージだけ seek して読む。
+
+    index = build_index("test.pcap")             # test.pcap.lmidx ができる
+    gifts = read_indexed("test.pcap", ["370b00"], [])
+    maps = read_indexed("test.pcap", [], ["ac08"],
+                        start=1650000000, end=1650000600)
+
+ファイル形式
+- MAGIC (8 bytes)
+- メタ情報(JSON)の長さ (4 bytes) + JSON
+- ENTRY が件数分
+'''
+import bisect
+import json
+import logging
+import os
+import struct
+from typing import NamedTuple, Optional
+from .bpf import CaptureFilter
+from .capture import Flow, iter_record_segments
+from .framer import FlowFramer
+from .lmpacket import STRICT, read_packet
+from .pcapfile import read_header
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LMIDX\x00\x00\x02"
+# record_offset, skip, length, code, (pad), timestamp, flow
+ENTRY = struct.Struct("<QII3sxdI")
+
+
+class IndexEntry(NamedTuple):
+    record_offset: int
+    skip: int
+    length: int
+    code: str
+    timestamp: float
+    flow: int = 0
+
+
+def index_path_for(pcapfile: str) -> str:
+    return pcapfile + ".lmidx"
+
+
+class MessageIndex:
+    def __init__(self, entries: list[IndexEntry], meta: dict):
+        self.entries = entries
+        self.meta = meta
+        self.times = [e.timestamp for e in entries]
+        self.sorted = all(a <= b for a, b in zip(self.times, self.times[1:]))
+        self.flows = [Flow(*flow) for flow in meta.get("flows", [])]
+        self.by_code: dict[str, list[int]] = {}
+        for i, e in enumerate(entries):
+            self.by_code.setdefault(e.code, []).append(i)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def save(self, path: str) -> None:
+        meta = json.dumps(self.meta).encode()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(meta)))
+            f.write(meta)
+            pack = ENTRY.pack
+            f.write(b"".join(
+                pack(e.record_offset, e.skip, e.length,
+                     bytes.fromhex(e.code), e.timestamp, e.flow)
+                for e in self.entries))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MessageIndex":
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw[:8] != MAGIC:
+            raise ValueError(f"not a message index: {path}")
+        meta_len = struct.unpack("<I", raw[8:12])[0]
+        meta = json.loads(raw[12:12+meta_len])
+        entries = [
+            IndexEntry(o, s, n, c.hex(), t, fl)
+            for o, s, n, c, t, fl in ENTRY.iter_unpack(raw[12+meta_len:])
+        ]
+        return cls(entries, meta)
+
+    def matches(self, pcapfile: str) -> bool:
+        '''pcapが索引を作った後に変わっていないか'''
+        st = os.stat(pcapfile)
+        return (self.meta.get("size") == st.st_size
+                and self.meta.get("mtime") == st.st_mtime)
+
+    def select(self, codes=(), codestartswith=(),
+               start: Optional[float] = None,
+               end: Optional[float] = None) -> list[IndexEntry]:
+        '''
+        codes / codestartswith は read_packet と同じ意味。
+        start <= timestamp < end のものを、ファイル内の順番で返す
+        '''
+        selected = set()
+        for code, idxs in self.by_code.items():
+            if code in codes or any(code.startswith(c)
+                                    for c in codestartswith):
+                selected.update(idxs)
+        if start is not None or end is not None:
+            if self.sorted:
+                lo = 0 if start is None else bisect.bisect_left(
+                    self.times, start)
+                hi = len(self.times) if end is None else bisect.bisect_left(
+                    self.times, end)
+                selected = {i for i in selected if lo <= i < hi}
+            else:
+                selected = {
+                    i for i in selected
+                    if (start is None or self.times[i] >= start)
+                    and (end is None or self.times[i] < end)
+                }
+        return [self.entries[i] for i in sorted(selected)]
+
+
+def build_index(pcapfile: str, index_path: Optional[str] = None,
+                ipaddrs=[], resync_codes=(), save=True) -> MessageIndex:
+    '''resync_codes は Framer の codes (データ長さが0のときに探すcode)'''
+    st = os.stat(pcapfile)
+    entries: list[IndexEntry] = []
+    framers = FlowFramer(resync_codes)
+    flow_ids: dict[Flow, int] = {}
+    # 接続ごとに、ペイロードの先頭のストリーム上の位置とレコードのオフセット。
+    # framer.buffer に残っている分だけ覚えておけばよい
+    recents: dict[Flow, list[tuple[int, int]]] = {}
+    with open(pcapfile, "rb") as f:
+        header = read_header(f)
+        for record, segment in iter_record_segments(
+                f, header, capture_filter=CaptureFilter(ipaddrs=ipaddrs)):
+            if segment is None:
+                continue
+            flow = segment.flow
+            flow_id = flow_ids.setdefault(flow, len(flow_ids))
+            framer = framers.get(flow)
+            recent = recents.setdefault(flow, [])
+            recent.append((framer.position + len(framer.buffer),
+                           record.offset))
+            for pos, data in framer.feed(segment.payload.hex()):
+                k = len(recent) - 1
+                while recent[k][0] > pos:
+                    k -= 1
+                entries.append(IndexEntry(
+                    record_offset=recent[k][1],
+                    skip=(pos - recent[k][0]) // 2,
+                    length=len(data) // 2,
+                    code=data[4:10],
+                    timestamp=segment.timestamp,
+                    flow=flow_id,
+                ))
+            # buffer の先頭より前で終わっているレコードは要らない
+            k = bisect.bisect_right(recent, (framer.position, float("inf")))
+            del recent[:max(k-1, 0)]
+    index = MessageIndex(entries, {
+        "pcapfile": os.path.basename(pcapfile),
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "ipaddrs": list(ipaddrs),
+        "linktype": header.linktype,
+        "flows": [list(flow) for flow in flow_ids],
+    })
+    if save:
+        index.save(index_path or index_path_for(pcapfile))
+    logger.info(f"indexed {len(entries)} messages of {pcapfile}")
+    return index
+
+
+def load_or_build_index(pcapfile: str, ipaddrs=[]) -> MessageIndex:
+    path = index_path_for(pcapfile)
+    if os.path.exists(path):
+        try:
+            index: Optional[MessageIndex] = MessageIndex.load(path)
+        except ValueError as e:
+            # 古い形式の索引など
+            logger.info(f"{path}: {e}")
+            index = None
+        if (index is not None and index.matches(pcapfile)
+                and index.meta["ipaddrs"] == ipaddrs):
+            return index
+        logger.info(f"{path} is stale, rebuilding")
+    return build_index(pcapfile, path, ipaddrs=ipaddrs)
+
+
+def read_message(f, header, entry: IndexEntry, ipaddrs=[],
+                 flow: Optional[Flow] = None) -> str:
+    '''
+    索引の1件分のメッセージをhex文字列で返す。
+    flow (index.flows[entry.flow]) を渡すと、その接続のペイロードだけをつなぐ
+    '''
+    need = (entry.skip + entry.length) * 2
+    chunks = []
+    got = 0
+    for _, segment in iter_record_segments(
+            f, header, entry.record_offset, CaptureFilter(ipaddrs=ipaddrs)):
+        if segment is None:
+            continue
+        if flow is not None and segment.flow != flow:
+            continue
+        dd = segment.payload.hex()
+        chunks.append(dd)
+        got += len(dd)
+        if got >= need:
+            break
+    d = "".join(chunks)
+    return d[entry.skip*2:need]
+
+
+def read_indexed(pcapfile: str, codes, codestartwith,
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 index: Optional[MessageIndex] = None, delim=80,
+                 validation: str = STRICT) -> list:
+    '''
+    read_pcapfile と同じ結果を、索引を使って必要な分だけ読んで返す。
+    索引は codes によらず1つ(resync_codes なしで framing したもの)で、
+    code は引くときに選ぶ。
+    一度検証したファイルなら validation="trusted" で速く読める
+    '''
+    if index is None:
+        index = load_or_build_index(pcapfile)
+    ipaddrs = index.meta.get("ipaddrs", [])
+    results = []
+    with open(pcapfile, "rb") as f:
+        header = read_header(f)
+        for entry in index.select(codes, codestartwith, start, end):
+            if entry.length * 2 < delim:
+                continue
+            data = read_message(f, header, entry, ipaddrs,
+                                index.flows[entry.flow])
+            result = read_packet(data, codes, codestartwith,
+                                 timestamp=entry.timestamp,
+                                 validation=validation)
+            if result:
+                results += result
+    return results
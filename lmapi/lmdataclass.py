@@ -6,10 +6,11 @@ notes
 - might: 16chars
 - kills: 16chars
 - avatar: 8 chars
+- captured_at: read_packet() の timestamp (キャプチャ時刻, 秒, 小数あり)
 '''
 
 import logging
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from typing import Union
 from .constants import ITEMS, MONSTER_IDS, FORT_IDS, CASTLE_SKINS, MODES
@@ -65,6 +66,7 @@ class Gift:
     item_name: str = ""
     item_category: str = ""
     time_gift_opened: int = 0
+    captured_at: float = 0.0
 
     def __post_init__(self):
         if self.gift_id in ITEMS:
@@ -92,6 +94,7 @@ class GiftPopup:
     gift_name: str = ""
     gift_rank: int = -1
     monster: str = ""
+    captured_at: float = 0.0
 
     def __post_init__(self):
         if self.gift_id in ITEMS:
@@ -113,6 +116,7 @@ class Player:
     might: int
     kills: int
     lastseen: int
+    captured_at: float = 0.0
 
     def __repr__(self):
         return f"Player {self.iggid:10d} {self.name:13} {self.might}"
@@ -129,6 +133,7 @@ class Castle:
     unk4: int
     might: int
     troops_killed: int
+    captured_at: float = 0.0
 
 
 @dataclass
@@ -145,6 +150,7 @@ class Comment:
     title: str
     unk2: str
     comment: str
+    captured_at: float = 0.0
 
     def __repr__(self):
         repr = f"Comment: [{self.guild_tag}]{self.player:13}"
@@ -165,10 +171,7 @@ class MapObjectMonster:
     monster_name: str = ""
 
     def __post_init__(self):
-        if self.monster_id in MONSTER_IDS:
-            self.monster_name = MONSTER_IDS[self.monster_id]
-        else:
-            logger.warning(f"unknown monster id: {self.monster_id}")
+        self.monster_name = MONSTER_IDS.get(self.monster_id, "")
 
     def __repr__(self) -> str:
         return f"{self.monster_name} lv{self.lv}"
@@ -189,8 +192,6 @@ class MapObjectCastle:
 
     def __post_init__(self):
         self.castle_skin_name = CASTLE_SKINS.get(self.castle_skin_id, "")
-        if not self.castle_skin_name:
-            logger.warning(f"new skin id! {self.castle_skin_id}")
 
     def __repr__(self) -> str:
         return f"[{self.guild_tag}]{self.player} Lv.{self.lv}"
@@ -275,7 +276,10 @@ class MapObject:
         MapObjectMonster,
         MapObjectCastle,
         MapObjectResourceTile,
-        MapObjectMoving]
+        MapObjectMoving,
+        MapObjectCamp,
+        MapObjectFort]
+    captured_at: float = 0.0
 
     def __repr__(self) -> str:
         if self.object_type != "00":
@@ -318,6 +322,7 @@ class HuntReport:
     # unk3
     num_kinds: int
     rewards: list[LMItem]
+    captured_at: float = 0.0
 
     def __repr__(self) -> str:
         name = self.monster_id
@@ -358,6 +363,7 @@ class ResultOpenChests:
     chest_id: str
     items: list[ChestResult]
     chest_name: str = ""
+    captured_at: float = 0.0
 
     def __post_init__(self):
         if self.chest_id in ITEMS:
@@ -387,6 +393,7 @@ class OuterGuildBoard:
     guild_showdown_rank: int
     da_cups: int
     guild_bash_rank: int
+    captured_at: float = 0.0
 
     def __repr__(self) -> str:
         repr = f"[{self.guild_tag}]{self.long_guild_name} k={self.kingdom}\n"
@@ -422,6 +429,7 @@ class InnerGuildBoard:
     da_cups: int
     guild_bash_rank: int
     unknowna: str  # 2
+    captured_at: float = 0.0
 
     def __repr__(self) -> str:
         repr = f"[{self.guild_tag}]{self.long_guild_name} k={self.kingdom}\n"
@@ -450,4 +458,12 @@ class InnerGuildBoard:
 @dataclass
 class SkillActivated:
     time_activated_lasttime: int
-    skill_code: str
\ No newline at end of file
+    skill_code: str
+    captured_at: float = 0.0
+
+
+def to_dict(record) -> dict:
+    '''asdict() に型名を "type" として足したもの'''
+    d = {"type": type(record).__name__}
+    d.update(asdict(record))
+    return d
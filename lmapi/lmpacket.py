@@ -1,5 +1,6 @@
 import logging
 import time
+from typing import Iterator, Optional
 try:
     from rich.logging import RichHandler
     logging.basicConfig(
@@ -15,7 +16,10 @@ except ModuleNotFoundError:
         datefmt="[%X]",
     )
 from .hex_funcs import hexstr2int, hexstr2str, guid2xy, hexstr2float
-from .constants import OBJECT_TYPES
+from .constants import CASTLE_SKINS, MONSTER_IDS, OBJECT_TYPES
+from . import diagnostics
+from .core import LMValidationError
+from .metrics import metrics
 from .lmdataclass import (
     ChestResult, GiftPopup, Gift, HuntReport, LMItem,
     MapObject, MapObjectCamp, MapObjectCastle,
@@ -27,6 +31,19 @@ from .lmdataclass import (
 logger = logging.getLogger(__name__)
 KINGDOM_MAX = 1200
 
+# read_packet の validation
+STRICT = "strict"      # チェックに引っかかったら LMValidationError
+LENIENT = "lenient"    # diagnostics に記録して続ける
+TRUSTED = "trusted"    # チェックしない(検証済みのデータを読み直すとき)
+VALIDATION_LEVELS = (STRICT, LENIENT, TRUSTED)
+
+
+def __invalid(validation: str, what: str, d: str) -> None:
+    '''チェックに引っかかったメッセージ d の扱い'''
+    if validation == STRICT:
+        raise LMValidationError(what, d[4:10], d)
+    diagnostics.record(f"invalid {what}", d[4:10], d)
+
 
 def is_valid_player_name(name: str) -> bool:
     if len(name) <= 3:
@@ -44,75 +61,123 @@ def read_packet(hexstr: str,
                 codes: list[str],
                 codestartswith: list[str],
                 timestamp=0,
-                mode=None) -> list:
+                mode=None,
+                validation: str = STRICT) -> list:
     '''
     ローモバの受信パケットの塊を読む関数
+
+    validation
+    - "strict":  おかしなメッセージは LMValidationError
+    - "lenient": diagnostics に記録して、読めたところまで返す
+    - "trusted": framing 以外のチェックを飛ばす
+    マップ(ac08)の中身の探索はチェックで区切りを見つけているので、
+    どの場合もチェックする。python -O でも結果は変わらない。
+
+    timestamp はキャプチャ時刻(秒, float)で、結果の captured_at に入る
     '''
+    if validation not in VALIDATION_LEVELS:
+        raise ValueError(f"unknown validation: {validation}")
     __code = hexstr[4:10]
     css_flag = False
     for csw in codestartswith:
         if __code.startswith(csw):
             css_flag = True
     if __code not in codes and not css_flag:
+        if metrics.enabled:
+            metrics.skip(__code, len(hexstr)//2)
         return
+    if not metrics.enabled:
+        result = __decode_logged(__code, hexstr, timestamp, validation)
+    else:
+        started = time.perf_counter()
+        try:
+            result = __decode_logged(__code, hexstr, timestamp, validation)
+        except Exception:
+            metrics.error(__code, len(hexstr)//2,
+                          time.perf_counter()-started)
+            raise
+        metrics.observe(__code, len(hexstr)//2, time.perf_counter()-started)
+    if result:
+        for r in result:
+            r.captured_at = timestamp
+    return result
+
+
+def __decode_logged(__code: str, hexstr: str, timestamp, validation: str):
+    '''
+    strict 以外では、decoder の中で壊れたメッセージにつまずいても
+    diagnostics に記録して [] を返す
+    '''
+    if validation == STRICT:
+        return __decode(__code, hexstr, timestamp, validation)
+    try:
+        return __decode(__code, hexstr, timestamp, validation)
+    except (ValueError, IndexError, KeyError, UnicodeDecodeError,
+            AssertionError) as e:
+        diagnostics.record(f"decode error {type(e).__name__}", __code,
+                           hexstr)
+        return []
+
 
+def __decode(__code: str, hexstr: str, timestamp, validation: str):
+    '''code ごとの decoder に振り分ける'''
     if __code.startswith("5e0d"):
         # hunt monster mail
-        return __read_5e0d(hexstr)
+        return __read_5e0d(hexstr, validation)
     elif __code.startswith("ac08"):
         # map
-        return __read_ac08(hexstr)
+        return __read_ac08(hexstr, validation)
     elif __code.startswith("ba08"):
         # map, Dragon Arena
-        return __read_ac08(hexstr)
+        return __read_ac08(hexstr, validation)
     elif __code.startswith("f20a"):
         # guild inner board
         # f20a96, f20af0
-        return __read_f20a(hexstr)
+        return __read_f20a(hexstr, validation)
     elif __code == "310b00":
         # open gift one by one
-        return __read_310b00(hexstr)
+        return __read_310b00(hexstr, validation)
     elif __code == "2b0b12":
         # gift popup
-        return __read_2b0b12(hexstr)
+        return __read_2b0b12(hexstr, validation)
     elif __code == "2b0b13":
         # gift -> gift tables
-        return __read_2b0b13(hexstr)
+        return __read_2b0b13(hexstr, validation)
     elif __code == "2b0b14":
         # gift -> gift tables
-        return __read_2b0b14(hexstr)
+        return __read_2b0b14(hexstr, validation)
     elif __code == "060b00":
         # might ranking
-        return __read_060b00(hexstr)
+        return __read_060b00(hexstr, validation)
     # elif __code == "080b00":
     #     # might ranking of other guilds
     #     return __read_080b00(hexstr)
     elif __code == "370b00":
         # open gifts at once
-        return __read_370b00(hexstr, timestamp)
+        return __read_370b00(hexstr, int(timestamp), validation)
     elif __code == "ac080c":
         # tap castle
-        return __read_ac080c(hexstr)
+        return __read_ac080c(hexstr, validation)
     elif __code == "7f0500":
         # open chests (not gifts)
-        return __read_7f0500(hexstr)
+        return __read_7f0500(hexstr, validation)
     elif __code == "bb0b00":
         # chat
-        return __read_bb0b00(hexstr)
+        return __read_bb0b00(hexstr, validation)
     elif __code == "2a0b00":
         # outer guild board
-        return __read_2a0b00(hexstr)
+        return __read_2a0b00(hexstr, validation)
     elif __code == "232000":
         # skill
-        return __read_232000(hexstr)
+        return __read_232000(hexstr, validation)
     elif __code.startswith("8305"):
         # skill
-        return __read_8305(hexstr)
+        return __read_8305(hexstr, validation)
     else:
         raise NotImplementedError
 
 
-def __read_232000(d: str):
+def __read_232000(d: str, validation: str = STRICT):
     '''
     packet of skill
     15 00 23 20 00
@@ -122,10 +187,13 @@ def __read_232000(d: str):
     - 00 00 00 00 00 00 00 00
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 42
+    if validation != TRUSTED:
+        if __length != 42:
+            __invalid(validation, "length", d)
+        if d[26:42] != "0"*16:
+            __invalid(validation, "padding", d)
     skill_code = d[10:18]
     time_activated_lasttime = hexstr2int(d[18:18+8])
-    assert d[26:42] == "0"*16
     skills = {
         "1d004700": "Refreshed",
         "26005700": "Seasoned Courier",
@@ -140,27 +208,33 @@ def __read_232000(d: str):
         "36004800": "Ship Ahoy",
         # "": "Gather Round",  => 別コード
     }
-    print(skills.get(skill_code, "### "+skill_code))
-    return SkillActivated(
+    if skill_code not in skills:
+        diagnostics.record("unknown skill code", d[4:10], d)
+    return [SkillActivated(
         time_activated_lasttime=time_activated_lasttime,
         skill_code=skill_code
-    )
+    )]
 
 
-def __read_8305(d: str):
+def __read_8305(d: str, validation: str = STRICT):
     pass
 
 
-def __read_5e0d(d: str):
+def __read_5e0d(d: str, validation: str = STRICT):
     '''
     packet of monster hunt mail
     '''
     __length = hexstr2int(d[:4])*2
+    if validation != TRUSTED:
+        if d[26:34] != "0"*8:
+            __invalid(validation, "padding", d)
+        if d[44:46] not in ["00", "01"]:
+            __invalid(validation, "killed flag", d)
+        if d[276:292] != "1100000001000000":
+            __invalid(validation, "reward header", d)
     time_stamp = hexstr2int(d[18:26])
-    assert d[26:34] == "0"*8
     kingdom = hexstr2int(d[34:38])
     x, y = guid2xy(d[38:44])
-    assert d[44:46] in ["00", "01"]
     killed = d[44:46] == "01"
     # print(killed, d[46:50])    # TODO
     monster_id = d[50:54]
@@ -184,7 +258,6 @@ def __read_5e0d(d: str):
     #     # d[234:276]
     # )  # TODO
 
-    assert d[276:292] == "1100000001000000"
     num_kinds = hexstr2int(d[292:294])
     items: list[LMItem] = []
     j = 294
@@ -217,7 +290,7 @@ def __read_5e0d(d: str):
     return [hr]
 
 
-def __read_bb0b00(d: str) -> list[Comment]:
+def __read_bb0b00(d: str, validation: str = STRICT) -> list[Comment]:
     '''
     packet of chat
     - [4 chars]
@@ -270,39 +343,46 @@ def __read_bb0b00(d: str) -> list[Comment]:
     }
     chat_place = d[10:16]
     if chat_place not in CHAT_PLACES:
-        logger.warning(f"unknown chat place: {chat_place}")
+        diagnostics.record("unknown chat place", d[4:10], d)
     time = hexstr2int(d[16:24])
-    assert d[24:32] == "0"*8
     iggid = hexstr2int(d[32:40])
-    assert d[40:48] == "0"*8
     comment_count = hexstr2int(d[48:54])  # 1づつ増えてる
-    assert d[54:64] == "0"*10
     chat_type = d[66:68]
     player = hexstr2str(d[72:98])
     unk1 = d[98:100]
-    assert unk1 in ["01", "02", "0a", "0b", "0c", "0d", "0e", "0f"], unk1
     guild_tag = hexstr2str(d[100:106])
     color = d[106:108]  # 05: ギルマス, 04: 不明, 03: 不明
     title = d[108:110]
     unk2 = d[110:112]
-    assert color in ["00", "03", "04", "05", "09"], d[106:108]
-    assert title in TITLES, d[108:110]
-    assert unk2 in ["00", "05"], d[110:112]
-
     chat_length = hexstr2int(d[112:116])*2
+    if validation != TRUSTED:
+        if d[24:32] != "0"*8 or d[40:48] != "0"*8 or d[54:64] != "0"*10:
+            __invalid(validation, "padding", d)
+        if unk1 not in ["01", "02", "0a", "0b", "0c", "0d", "0e", "0f"]:
+            __invalid(validation, "unk1", d)
+        if color not in ["00", "03", "04", "05", "09"]:
+            __invalid(validation, "color", d)
+        if title not in TITLES:
+            __invalid(validation, "title", d)
+        if unk2 not in ["00", "05"]:
+            __invalid(validation, "unk2", d)
+        if chat_type not in CHAT_TYPES:
+            __invalid(validation, "chat type", d)
+        if chat_length != len(d[114:]) - 2:
+            __invalid(validation, "chat length", d)
+        if (chat_type not in ["00", "6d", "68", "6c"]
+                and d[114:] != "00"):
+            __invalid(validation, "chat body", d)
+
     if chat_type == "00":
         comment = hexstr2str(d[116:])
     elif chat_type == "6d":
         comment = d[114:]
         # assert comment in EMOTICONS, comment
     else:
-        comment = CHAT_TYPES[chat_type]
-        if chat_type not in ["68", "6c"]:
-            assert d[114:] == "00", f"chat_type={chat_type}\n{d[114:]}"
-        else:
+        comment = CHAT_TYPES.get(chat_type, "")
+        if chat_type in ["68", "6c"]:
             comment += " by " + hexstr2str(d[116:])
-    assert chat_length == len(d[114:]) - 2
-    assert d[66:68] in CHAT_TYPES, d[66:68]
     return [Comment(
         chat_place=chat_place,
         time=time,
@@ -319,7 +399,7 @@ def __read_bb0b00(d: str) -> list[Comment]:
     )]
 
 
-def __read_7f0500(d: str):
+def __read_7f0500(d: str, validation: str = STRICT):
     '''
     packet using items
     - open chests (not gifts)
@@ -404,7 +484,8 @@ def __read_7f0500(d: str):
             rarity=hexstr2int(d[j+8:j+10])
         ))
         j += 10
-    assert __length == j
+    if validation != TRUSTED and __length != j:
+        __invalid(validation, "length", d)
     roc = ResultOpenChests(
         chest_id=chest_id,
         items=items
@@ -413,7 +494,7 @@ def __read_7f0500(d: str):
     return [roc]
 
 
-def __read_ac080c(d: str) -> list[Castle]:
+def __read_ac080c(d: str, validation: str = STRICT) -> list[Castle]:
     '''
     packet when tapped a castle
     - [4 chars]
@@ -424,7 +505,8 @@ def __read_ac080c(d: str) -> list[Castle]:
     - [40 chars]: guild name
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 124
+    if validation != TRUSTED and __length != 124:
+        __invalid(validation, "length", d)
     return [Castle(
         tile_id=hexstr2int(d[10:26]),
         unk_2f=hexstr2int(d[26:28]),
@@ -438,16 +520,17 @@ def __read_ac080c(d: str) -> list[Castle]:
     )]
 
 
-def __read_ac08(d: str):
+def __read_ac08(d: str, validation: str = STRICT):
     '''
     ゴミが入っていても強引にMapObjectを取り出す
+
+    __create_map_object のチェックに通るところを探していくので、
+    validation によらずチェックする
     '''
     __length = hexstr2int(d[:4])*2
     code = d[4:10]
     if code == "ac080c":
-        return __read_ac080c(d)
-    elif code == "ac0801":
-        print(d)
+        return __read_ac080c(d, validation)
     # assert code in [
     #     "ac0801", "ac0802", "ac0803",
     #     "ac0809",
@@ -458,20 +541,9 @@ def __read_ac08(d: str):
     #     # Chalice
     #     "ac0824", "ac0826", "ac0833",
     # ], code
-    j = 10
-    objs = []
-    while j+98 <= __length:
-        while j+98 <= __length:
-            try:
-                objs.append(__create_map_object(d[j:j+98]))
-                break
-            except (AssertionError, NotImplementedError, UnicodeDecodeError):
-                j += 2
-        if d[j+6:j+8] == "00":
-            j += 6
-        j += 98
+    objs = [obj for _, obj in iter_map_records(d)]
     if len(objs) == 0 and __length > 98:
-        logger.warning(f"No map object found: {code}, len={__length}")
+        diagnostics.record("no map object found", code, d)
     # print(f"code={code} len(objs)={len(objs)} len={__length}")
     # ac0801 {0, 1, 2}
     # ac0802 {0, 1}
@@ -488,13 +560,42 @@ def __read_ac08(d: str):
     return objs
 
 
-def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
+def iter_map_records(d: str, known: Optional[dict[str, MapObject]] = None
+                     ) -> Iterator[tuple[str, MapObject]]:
+    '''
+    ac08 のメッセージ d から (98文字の生データ, MapObject) を順に取り出す。
+    __create_map_object に通るところを区切りとして探していく。
+    known にある生データはそのまま区切りとして使い、decode しない
+    '''
+    length = hexstr2int(d[:4])*2
+    j = 10
+    while j+98 <= length:
+        while j+98 <= length:
+            raw = d[j:j+98]
+            obj = known.get(raw) if known is not None else None
+            if obj is None:
+                try:
+                    obj = __create_map_object(raw, code=d[4:10])
+                except (LMValidationError, NotImplementedError,
+                        UnicodeDecodeError):
+                    j += 2
+                    continue
+            yield raw, obj
+            break
+        if d[j+6:j+8] == "00":
+            j += 6
+        j += 98
+
+
+def __create_map_object(d: str, lvs: list[int] = [],
+                        code: str = "ac08") -> MapObject:
     '''
     [98 chars] are consists of
     - [8 chars]
       - [6 chars]: guid
       - [2 chars]: object_type
     - [90 chars]: content
+    code は diagnostics に記録するメッセージの code
 
     [88 chars] are consists of
     - "object_type"== 0a: monster
@@ -527,13 +628,16 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
       - [8 chars]: time_stamp
       - [28 chars]: all zero
 
+    おかしなところがあれば LMValidationError
+    (__read_ac08 はこれで区切りを探している)
     '''
-    assert len(d) == 98
+    if len(d) != 98:
+        raise LMValidationError("length")
     guid = d[:6]
     x, y = guid2xy(guid)
     object_type = d[6:8]
-    if object_type != '00':
-        assert x != -1 and y != -1
+    if object_type != '00' and (x == -1 or y == -1):
+        raise LMValidationError("guid")
 
     if object_type == "0a":
         # monster
@@ -541,12 +645,16 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         monster_id = d[10:14]
         time_remain = hexstr2int(d[14:22])
         hp_percentage = hexstr2float(d[22:30])
-        assert 1 <= monster_lv <= 5
-        assert monster_id[2:] == "00"
-        assert monster_id != "0000"
-        assert d[30:98] == "0"*68
+        if not 1 <= monster_lv <= 5:
+            raise LMValidationError("monster lv")
+        if monster_id[2:] != "00" or monster_id == "0000":
+            raise LMValidationError("monster id")
+        if d[30:98] != "0"*68:
+            raise LMValidationError("padding")
         if lvs and monster_lv not in lvs:
             return
+        if monster_id not in MONSTER_IDS:
+            diagnostics.record("unknown monster id", code, str(monster_id))
 
         return MapObject(
             x=x, y=y, object_type=object_type,
@@ -570,11 +678,16 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         castle_skin_level = hexstr2int(d[60:62])
         # TODO
         # assert d[64:96] == "0"*32, d[64:96] + f"{x},{y}, {repr}"
-        assert is_valid_player_name(player_name)
-        assert 1 <= level <= 25
-        assert kingdom_player < KINGDOM_MAX, f"kingdom: {kingdom_player}\n{d}"
+        if not is_valid_player_name(player_name):
+            raise LMValidationError("player name")
+        if not 1 <= level <= 25:
+            raise LMValidationError("castle lv")
+        if kingdom_player >= KINGDOM_MAX:
+            raise LMValidationError("kingdom")
         if kingdom_guild > KINGDOM_MAX:
-            logger.warning(f"kingdom: {kingdom_guild}\n{d}")
+            diagnostics.record("kingdom_guild out of range", code, d)
+        if castle_skin_id not in CASTLE_SKINS:
+            diagnostics.record("new skin id", code, str(castle_skin_id))
         return MapObject(
             x=x, y=y, object_type=object_type,
             obj=MapObjectCastle(
@@ -602,13 +715,17 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
             player_name = hexstr2str(d[8:34])
             guild_tag = hexstr2str(d[34:40])
             kingdom_player = hexstr2int(d[40:44])
-            assert is_valid_player_name(player_name)
-            assert kingdom_player < KINGDOM_MAX, f"kgdm: {kingdom_player}\n{d}"
+            if not is_valid_player_name(player_name):
+                raise LMValidationError("player name")
+            if kingdom_player >= KINGDOM_MAX:
+                raise LMValidationError("kingdom")
         maximum_resource = hexstr2int(d[46:54])
         remain_percentage = hexstr2float(d[54:62])  # something wrong ?
         time_stamp = hexstr2int(d[62:70])
-        assert 0 < level < 6, f"resoure tile lv: {level}({d[44:46]})\n{d}"
-        assert d[70:98] == "0"*28
+        if not 0 < level < 6:
+            raise LMValidationError("resource tile lv")
+        if d[70:98] != "0"*28:
+            raise LMValidationError("padding")
         # if d[54:62] != "00000000":
         #     print(f"{d[60:62]}{d[58:60]}{d[56:58]}{d[54:56]}")
         return MapObject(
@@ -634,11 +751,14 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         status_flag = hexstr2int(d[46:48])
         title = hexstr2int(d[48:52])
         kingdom_guild = hexstr2int(d[52:56])
-        assert d[66:98] == "0"*32
-        assert is_valid_player_name(player_name)
-        assert kingdom_player < KINGDOM_MAX, f"kingdom: {kingdom_player}\n{d}"
-        assert kingdom_guild < KINGDOM_MAX, f"kingdom: {kingdom_guild}\n{d}"
-        assert 1 <= level <= 25
+        if d[66:98] != "0"*32:
+            raise LMValidationError("padding")
+        if not is_valid_player_name(player_name):
+            raise LMValidationError("player name")
+        if kingdom_player >= KINGDOM_MAX or kingdom_guild >= KINGDOM_MAX:
+            raise LMValidationError("kingdom")
+        if not 1 <= level <= 25:
+            raise LMValidationError("camp lv")
         return MapObject(x=x, y=y, object_type=object_type, obj=MapObjectCamp(
             player=player_name,
             guild_tag=guild_tag,
@@ -664,10 +784,11 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         kingdom_player = hexstr2int(d[72:76])  # 順番わからん
         kingdom_guild = hexstr2int(d[78:82])   # 所有者の所属王国、所有者のギルドの所属王国、要塞のある王国
         kingdom_fort = hexstr2int(d[82:86])
-        assert is_valid_player_name(player_name)
-        assert kingdom_player < KINGDOM_MAX, f"kingdom: {kingdom_player}\n{d}"
-        assert kingdom_guild < KINGDOM_MAX, f"kingdom: {kingdom_guild}\n{d}"
-        assert kingdom_fort < KINGDOM_MAX, f"kingdom: {kingdom_fort}\n{d}"
+        if not is_valid_player_name(player_name):
+            raise LMValidationError("player name")
+        if (kingdom_player >= KINGDOM_MAX or kingdom_guild >= KINGDOM_MAX
+                or kingdom_fort >= KINGDOM_MAX):
+            raise LMValidationError("kingdom")
         # print(fort_id, datetime.fromtimestamp(time_stamp))
         # print(unk1, unk2, unk3, unk4)
         return MapObject(x=x, y=y, object_type=object_type, obj=MapObjectFort(
@@ -700,15 +821,17 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         # unk3 = hexstr2int(d[88:90])  # TODO
         unk03 = d[90:96]
         mode = d[96:98]
-        assert unk01 == "0"*8
-        assert unk02 == "0"*4, unk02
-        assert unk03 == "0"*6, unk03
-        assert unk04 == "0"*6, unk04
-        assert is_valid_player_name(player)
-        assert kingdom < KINGDOM_MAX, f"kingdom: {kingdom}\n{d}"
-        assert xfrom != -1 and yfrom != -1
-        assert xto != -1 and yto != -1
-        assert time_stamp > 1640000000
+        if (unk01 != "0"*8 or unk02 != "0"*4 or unk03 != "0"*6
+                or unk04 != "0"*6):
+            raise LMValidationError("padding")
+        if not is_valid_player_name(player):
+            raise LMValidationError("player name")
+        if kingdom >= KINGDOM_MAX:
+            raise LMValidationError("kingdom")
+        if xfrom == -1 or yfrom == -1 or xto == -1 or yto == -1:
+            raise LMValidationError("guid")
+        if time_stamp <= 1640000000:
+            raise LMValidationError("time stamp")
         # print(f"{mode}, {player:13}, {d[:6]}, {_guid}, {time_stamp}
         # {datetime.fromtimestamp(time_stamp)}, {total_sec}, {unk4}, {unk3},
         # {MODES[mode]}")
@@ -730,7 +853,8 @@ def __create_map_object(d: str, lvs: list[int] = []) -> MapObject:
         raise NotImplementedError(f"unknown obj: {object_type} @{x},{y}\n{d}")
 
 
-def __read_370b00(d: str, timestamp: int) -> list[Gift]:
+def __read_370b00(d: str, timestamp: int,
+                  validation: str = STRICT) -> list[Gift]:
     '''
     packet when opened gifts at once
     - [4 chars]
@@ -747,7 +871,10 @@ def __read_370b00(d: str, timestamp: int) -> list[Gift]:
     __length = hexstr2int(d[:4])*2
     num_gifts = hexstr2int(d[28:30])
     # logger.debug(f"{d[10:28]} {hexstr2int(d[10:18])} {hexstr2int(d[18:28])}")
-    assert __length == 30 + 66*num_gifts
+    if validation != TRUSTED and __length != 30 + 66*num_gifts:
+        __invalid(validation, "length", d)
+    # 壊れたメッセージでも、最後まで入っているものだけ読む
+    num_gifts = min(num_gifts, (len(d) - 30) // 66)
     gifts = []
     j = 30
     for _ in range(num_gifts):
@@ -756,7 +883,7 @@ def __read_370b00(d: str, timestamp: int) -> list[Gift]:
     return gifts
 
 
-def __read_060b00(d: str) -> list[Player]:
+def __read_060b00(d: str, validation: str = STRICT) -> list[Player]:
     '''
     packet of might ranking(your guild)
     - [4 chars]
@@ -778,7 +905,9 @@ def __read_060b00(d: str) -> list[Player]:
     '''
     __length = hexstr2int(d[:4])*2
     num_members = hexstr2int(d[12:14])
-    assert __length == 14 + 96*num_members
+    if validation != TRUSTED and __length != 14 + 96*num_members:
+        __invalid(validation, "length", d)
+    num_members = min(num_members, (len(d) - 14) // 96)
     players = []
     j = 14
     for _ in range(num_members):
@@ -795,7 +924,7 @@ def __read_060b00(d: str) -> list[Player]:
     return players
 
 
-def __read_2b0b14(d: str) -> list[GiftPopup]:
+def __read_2b0b14(d: str, validation: str = STRICT) -> list[GiftPopup]:
     '''
     packet unknown
     - 3000: 固定長
@@ -808,12 +937,12 @@ def __read_2b0b14(d: str) -> list[GiftPopup]:
     - [12 chars]: e30775200000
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 96
-    player = hexstr2str(d[50:76])
-    print(f"2b0b14: {player} {d[10:50]} {d[76:]}")
+    if validation != TRUSTED and __length != 96:
+        __invalid(validation, "length", d)
+    diagnostics.record("unparsed", d[4:10], d)
 
 
-def __read_2b0b13(d: str) -> list[GiftPopup]:
+def __read_2b0b13(d: str, validation: str = STRICT) -> list[GiftPopup]:
     '''
     packet when a gift inserted in gift table
     - [4 chars]
@@ -826,7 +955,10 @@ def __read_2b0b13(d: str) -> list[GiftPopup]:
     - [8 chars]:  counter 2
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 84
+    if validation != TRUSTED and __length != 84:
+        __invalid(validation, "length", d)
+    if len(d) < 84:
+        return []
     counter1 = hexstr2int(d[10:20])
     unixtime = hexstr2int(d[20:36])
     gift_id = d[36:40]
@@ -837,7 +969,7 @@ def __read_2b0b13(d: str) -> list[GiftPopup]:
     # monster = GIFTIDS[gift_id][0] if gift_id in GIFTIDS else ""
     # gift_rank = GIFTIDS[gift_id][1] if gift_id in GIFTIDS else 0
     if unknown0 != 0:
-        logger.warning("__read_2b0b13, unkonw0 != 0")
+        diagnostics.record("2b0b13 unknown0 != 0", d[4:10], d)
     return [GiftPopup(
         counter=counter1,
         gift_id=gift_id,
@@ -847,7 +979,7 @@ def __read_2b0b13(d: str) -> list[GiftPopup]:
     )]
 
 
-def __read_2b0b12(d: str) -> list[GiftPopup]:
+def __read_2b0b12(d: str, validation: str = STRICT) -> list[GiftPopup]:
     '''
     packet when you got a gift
     - [4 chars]
@@ -855,7 +987,10 @@ def __read_2b0b12(d: str) -> list[GiftPopup]:
     - [34 chars]: Gift Popup
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 44
+    if validation != TRUSTED and __length != 44:
+        __invalid(validation, "length", d)
+    if len(d) < 44:
+        return []
     j = 10
     gift_id = d[j+4:j+8]
     # monster = GIFTIDS[gift_id][0] if gift_id in GIFTIDS else ""
@@ -868,7 +1003,7 @@ def __read_2b0b12(d: str) -> list[GiftPopup]:
     )]
 
 
-def __read_310b00(d: str) -> list[Gift]:
+def __read_310b00(d: str, validation: str = STRICT) -> list[Gift]:
     '''
     packet when opened a gift (one by one)
     - [4 chars]
@@ -876,18 +1011,22 @@ def __read_310b00(d: str) -> list[Gift]:
     - [66 chars]: see __create_gift
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 92
+    if validation != TRUSTED and __length != 92:
+        __invalid(validation, "length", d)
+    if len(d) < 92:
+        return []
     d = d[10:]
-    return [__create_gift(d)]
+    return [__create_gift(d, code="310b00")]
 
 
-def __create_gift(d: str, timestamp=0) -> Gift:
+def __create_gift(d: str, timestamp=0, code: str = "370b00") -> Gift:
+    '''code は diagnostics に記録するメッセージの code'''
     unknown1 = hexstr2int(d[8:10])
     unknown0 = hexstr2int(d[36:38])
     if unknown0 != 0:
-        logger.warning("__create_gift, unkonw0 != 0")
+        diagnostics.record("gift unknown0 != 0", code, d)
     if unknown1 != 1:
-        logger.warning("__create_gift, unkonw1 != 1")
+        diagnostics.record("gift unknown1 != 1", code, d)
     return Gift(
         sort_index=hexstr2int(d[:8]),
         time=hexstr2int(d[10:26]),
@@ -900,7 +1039,7 @@ def __create_gift(d: str, timestamp=0) -> Gift:
     )
 
 
-def __read_f20a(d: str) -> list:
+def __read_f20a(d: str, validation: str = STRICT) -> list:
     '''inner guild board
 
     - 20 04: length
@@ -926,19 +1065,22 @@ def __read_f20a(d: str) -> list:
     - 04 0f 00 d6 11 05 05 00 01
     '''
     __length = hexstr2int(d[:4])*2
-    assert __length == 2112
-
-    assert d[54:60] == "0"*6
-    assert d[1956:1960] in ["e207", "e307", "e407"]
-    assert d[1980:1992] == "0"*12
+    if validation != TRUSTED:
+        if __length != 2112:
+            __invalid(validation, "length", d)
+        if d[54:60] != "0"*6 or d[1980:1992] != "0"*12:
+            __invalid(validation, "padding", d)
+        if d[1956:1960] not in ["e207", "e307", "e407"]:
+            __invalid(validation, "year", d)
+        if d[2084:2094] not in ["6200000000", "0"*10]:
+            __invalid(validation, "d[2084:2094]", d)
     if d[1996:2012] != "0"*16:
-        logger.warning(f"d[1996:2012]@f20a: {d[1996:2012]}")
+        diagnostics.record("f20a d[1996:2012]", d[4:10], d)
     if d[2024:2074] != "0"*50:
-        logger.warning(f"d[2024:2074]@f20a: {d[2024:2074]}")
+        diagnostics.record("f20a d[2024:2074]", d[4:10], d)
         # f2747f000600000000000000000000000000000032281e140a
-    assert d[2084:2094] in ["6200000000", "0"*10], d[2084:2094]
     if d[2108:2112] != "0001":
-        logger.warning(f"d[2108:2112]@f20a: {d[2108:2112]}")
+        diagnostics.record("f20a d[2108:2112]", d[4:10], d)
         # 0003
     result = InnerGuildBoard(
         guild_id=d[10:18],   # 6b1400 17
@@ -967,21 +1109,22 @@ def __read_f20a(d: str) -> list:
     return [result]
 
 
-def __read_2a0b00(d: str) -> list:
+def __read_2a0b00(d: str, validation: str = STRICT) -> list:
     '''outer guild board'''
     __length = hexstr2int(d[:4])*2
-    assert __length == 2780
+    if validation != TRUSTED:
+        if __length != 2780:
+            __invalid(validation, "length", d)
+        if d[2752:2758] != "0"*6 or d[2770:2772] != "0"*2:
+            __invalid(validation, "padding", d)
+        if d[2764:2766] not in ["00", "01"] or d[2778:2780] != "01":
+            __invalid(validation, "flags", d)
 
     try:
         long_guild_name = hexstr2str(d[52:92])
     except UnicodeDecodeError:
         long_guild_name = d[52:92]
 
-    assert d[2752:2758] == "0"*6
-    assert d[2764:2766] in ["00", "01"]
-    assert d[2770:2772] == "0"*2
-    assert d[2778:2780] == "01"
-
     result = OuterGuildBoard(
         guild_id=d[10:20],  # f0 6b1400 00
         guild_leader=hexstr2str(d[20:46]),
@@ -0,0 +1,182 @@
+'''
+マップ(ac08)の差分だけを流す
+
+    feed = MapChangeFeed()
+    for change in feed.feed(hexstr, timestamp):   # framing済みのメッセージ1つ
+        print(change.kind, change.x, change.y, change.changes)
+    # pcap からなら
+    for change in read_map_changes("test.pcap"):
+        ...
+
+同じ場所をスクロールすると同じ MapObject が何度も届くので、
+タイル(guid)ごとに最後に見た98文字の生データを覚えておき、
+- 前と同じ生データ: decode もせずに捨てる
+- 初めてのタイル: appeared
+- 生データが違う: changed (changes に {フィールド: (前, 後)})
+  種類が変わったら disappeared と appeared の2つ
+- メッセージに含まれるタイルの範囲にあるのに、そのメッセージになかった
+  タイルは候補にしておき、grace 秒たっても届かなければ disappeared。
+  同じ画面が複数のメッセージに分かれて届くので、すぐには消さない
+移動中の部隊(object_type 00)はタイルではないので流さない。
+'''
+from dataclasses import fields
+from typing import Iterator, NamedTuple, Optional
+from .bpf import CaptureFilter
+from .capture import read_segments
+from .framer import FlowFramer
+from .hex_funcs import xy2guid
+from .lmdataclass import MapObject
+from .lmpacket import iter_map_records
+
+APPEARED = "appeared"
+CHANGED = "changed"
+DISAPPEARED = "disappeared"
+
+# disappeared を探すときに使う区画の大きさ
+BLOCK = 32
+
+
+class MapChange(NamedTuple):
+    kind: str
+    timestamp: float
+    x: int
+    y: int
+    obj: MapObject           # disappeared なら最後に見たもの
+    changes: dict            # changed のときだけ {フィールド: (前, 後)}
+
+
+class _Tile:
+    __slots__ = ("raw", "obj", "seen")
+
+    def __init__(self, raw: str, obj: MapObject, seen: float):
+        self.raw = raw
+        self.obj = obj
+        self.seen = seen
+
+
+def diff_objects(old: MapObject, new: MapObject) -> dict:
+    '''同じ種類の MapObject の違うフィールド {名前: (前, 後)}'''
+    changes = {}
+    for f in fields(new.obj):
+        a = getattr(old.obj, f.name)
+        b = getattr(new.obj, f.name)
+        if a != b:
+            changes[f.name] = (a, b)
+    return changes
+
+
+class MapChangeFeed:
+    def __init__(self, grace: float = 1.0):
+        self.grace = grace
+        self.tiles: dict[str, _Tile] = {}
+        # 生データ -> MapObject(iter_map_records で decode を飛ばす)
+        self.known: dict[str, MapObject] = {}
+        # (x // BLOCK, y // BLOCK) -> guid
+        self.blocks: dict[tuple[int, int], set[str]] = {}
+        # 消えたかもしれないタイル guid -> 範囲に入っていた時刻
+        self.suspects: dict[str, float] = {}
+        self.records = 0
+        self.unchanged = 0
+
+    def _remove(self, guid: str) -> _Tile:
+        self.suspects.pop(guid, None)
+        tile = self.tiles.pop(guid)
+        del self.known[tile.raw]
+        self.blocks[(tile.obj.x // BLOCK, tile.obj.y // BLOCK)].discard(guid)
+        return tile
+
+    def _put(self, guid: str, raw: str, obj: MapObject,
+             timestamp: float) -> None:
+        self.tiles[guid] = _Tile(raw, obj, timestamp)
+        self.known[raw] = obj
+        self.blocks.setdefault((obj.x // BLOCK, obj.y // BLOCK),
+                               set()).add(guid)
+
+    def feed(self, hexstr: str, timestamp: float) -> list[MapChange]:
+        '''ac08 のメッセージ1つ。ac08 以外(ac080c も)は何もしない'''
+        if hexstr[4:8] != "ac08" or hexstr[4:10] == "ac080c":
+            return []
+        changes: list[MapChange] = []
+        present = set()
+        xmin = ymin = 1 << 30
+        xmax = ymax = -1
+        for raw, obj in iter_map_records(hexstr, self.known):
+            if obj.object_type == "00":
+                continue
+            self.records += 1
+            guid = raw[:6]
+            present.add(guid)
+            x, y = obj.x, obj.y
+            xmin, xmax = min(xmin, x), max(xmax, x)
+            ymin, ymax = min(ymin, y), max(ymax, y)
+            tile = self.tiles.get(guid)
+            self.suspects.pop(guid, None)
+            if tile is not None and tile.raw == raw:
+                tile.seen = timestamp
+                self.unchanged += 1
+                continue
+            if tile is None:
+                changes.append(MapChange(APPEARED, timestamp, x, y, obj, {}))
+            elif tile.obj.object_type != obj.object_type:
+                changes.append(MapChange(DISAPPEARED, timestamp, x, y,
+                                         tile.obj, {}))
+                changes.append(MapChange(APPEARED, timestamp, x, y, obj, {}))
+            else:
+                diff = diff_objects(tile.obj, obj)
+                if diff:
+                    changes.append(MapChange(CHANGED, timestamp, x, y, obj,
+                                             diff))
+            if tile is not None:
+                self._remove(guid)
+            self._put(guid, raw, obj, timestamp)
+        if present:
+            self._suspect(present, xmin, xmax, ymin, ymax, timestamp)
+        return changes + self.flush(timestamp)
+
+    def _suspect(self, present: set[str], xmin: int, xmax: int, ymin: int,
+                 ymax: int, timestamp: float) -> None:
+        '''範囲の中で、今回なかったタイルを候補にする'''
+        for bx in range(xmin // BLOCK, xmax // BLOCK + 1):
+            for by in range(ymin // BLOCK, ymax // BLOCK + 1):
+                for guid in self.blocks.get((bx, by), ()):
+                    if guid in present or guid in self.suspects:
+                        continue
+                    tile = self.tiles[guid]
+                    x, y = tile.obj.x, tile.obj.y
+                    if (xmin <= x <= xmax and ymin <= y <= ymax
+                            and tile.seen < timestamp):
+                        self.suspects[guid] = timestamp
+
+    def flush(self, timestamp: float = float("inf")) -> list[MapChange]:
+        '''
+        候補になってから grace 秒たったタイルを disappeared にする。
+        最後に引数なしで呼ぶと残りの候補を全部出す
+        '''
+        gone = [guid for guid, covered in self.suspects.items()
+                if timestamp - covered > self.grace]
+        changes = []
+        for guid in gone:
+            covered = self.suspects[guid]
+            tile = self._remove(guid)
+            changes.append(MapChange(DISAPPEARED, covered, tile.obj.x,
+                                     tile.obj.y, tile.obj, {}))
+        return changes
+
+    def get(self, x: int, y: int) -> Optional[MapObject]:
+        '''今わかっている (x, y) の MapObject'''
+        tile = self.tiles.get(xy2guid(x, y))
+        return tile.obj if tile is not None else None
+
+
+def read_map_changes(pcapfile: str, feed: Optional[MapChangeFeed] = None,
+                     ipaddrs=[], backend: Optional[str] = None
+                     ) -> Iterator[MapChange]:
+    '''pcap の ac08 をキャプチャ時刻で feed に通す'''
+    if feed is None:
+        feed = MapChangeFeed()
+    framer = FlowFramer([])
+    for segment in read_segments(pcapfile, CaptureFilter(ipaddrs=ipaddrs),
+                                 backend):
+        for _, data in framer.feed(segment.flow, segment.payload.hex()):
+            yield from feed.feed(data, segment.timestamp)
+    yield from feed.flush()
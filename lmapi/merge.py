@@ -0,0 +1,148 @@
+'''
+何人かのキャプチャのギフト(370b00, 310b00)を、重複のない1つの台帳にまとめる
+
+    with GiftMerger("gifts.jsonl") as merger:   # 既にあれば key だけ読み込む
+        merger.merge(["alice.pcap", "bob/", "old/*.pcap"])
+    merger.sources                              # キャプチャごとの数
+
+    python -m lmapi.merge alice.pcap bob/ -o gifts.jsonl
+
+- 同じギフトは (sort_index, time, gift_id, player) が同じ。
+  time_gift_opened, captured_at はキャプチャごとに違うので見ない
+- key を blake2b で 8バイトの int にして set で持つ。
+  ギフト自体は持たないので、メモリはギフトの数 x 70バイトくらい
+- キャプチャを1つずつ読み、初めて見たギフトはその場で台帳に追記する
+'''
+import argparse
+import hashlib
+import logging
+import sys
+from typing import Iterable, Optional
+from .batch import expand_inputs
+from .lmdataclass import Gift
+from .lmpacket import STRICT, VALIDATION_LEVELS
+from .pcapReader import iter_pcapfile
+from .sinks import JSONLLedger
+
+logger = logging.getLogger(__name__)
+
+GIFT_CODES = ["370b00", "310b00"]
+
+
+def gift_key(sort_index: int, time: int, gift_id: str, player: str) -> int:
+    raw = f"{sort_index}\x00{time}\x00{gift_id}\x00{player}".encode()
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(),
+                          "little")
+
+
+class GiftMerger:
+    def __init__(self, path: Optional[str] = None):
+        '''path があれば今までの key を読み込み、新しいギフトはそこに追記する'''
+        self.keys: set[int] = set()
+        self.added = 0
+        self.duplicates = 0
+        # キャプチャ -> {"gifts": 読んだ数, "new": 新しかった数}
+        self.sources: dict[str, dict[str, int]] = {}
+        self.path = path
+        self._ledger: Optional[JSONLLedger] = None
+        if path is not None:
+            self._ledger = JSONLLedger(path)
+            for d in self._ledger.read("Gift"):
+                self.keys.add(gift_key(d["sort_index"], d["time"],
+                                       d["gift_id"], d["player"]))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, gift: Gift) -> bool:
+        '''初めて見たギフトなら台帳に書いて True'''
+        key = gift_key(gift.sort_index, gift.time, gift.gift_id, gift.player)
+        if key in self.keys:
+            self.duplicates += 1
+            return False
+        self.keys.add(key)
+        self.added += 1
+        if self._ledger is not None:
+            self._ledger.append(gift)
+        return True
+
+    def add_many(self, records: Iterable) -> int:
+        '''Gift 以外は無視する。新しかった数を返す'''
+        return sum(self.add(r) for r in records if isinstance(r, Gift))
+
+    def merge_file(self, pcapfile: str, ipaddrs=[],
+                   validation: str = STRICT,
+                   backend: Optional[str] = None) -> int:
+        '''
+        キャプチャ1つ。新しかったギフトの数を返す。
+        途中で失敗しても、sources にはそこまでの数が残る
+        '''
+        counts = self.sources[pcapfile] = {"gifts": 0, "new": 0}
+        try:
+            for _, result in iter_pcapfile(pcapfile, GIFT_CODES, [], ipaddrs,
+                                           0, validation, backend):
+                counts["gifts"] += len(result)
+                counts["new"] += self.add_many(result)
+        finally:
+            self.flush()
+        return counts["new"]
+
+    def merge(self, inputs: list[str], ipaddrs=[], validation: str = STRICT,
+              backend: Optional[str] = None) -> int:
+        '''ファイル, ディレクトリ, glob パターンを順に読む'''
+        new = 0
+        for path in expand_inputs(inputs):
+            try:
+                new += self.merge_file(path, ipaddrs, validation, backend)
+            except Exception as e:
+                # 壊れたキャプチャが1つあっても残りはまとめる
+                logger.warning(f"{path}: {type(e).__name__}: {e}")
+                # 失敗する前に足したギフトは台帳に入っている
+                new += self.sources[path]["new"]
+        return new
+
+    def flush(self) -> None:
+        if self._ledger is not None:
+            self._ledger.flush()
+
+    def close(self) -> None:
+        if self._ledger is not None:
+            self._ledger.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m lmapi.merge",
+        description="merge gifts from many captures into one ledger")
+    parser.add_argument("inputs", nargs="+",
+                        help="pcap files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True,
+                        help="ledger (.jsonl), appended to if it exists")
+    parser.add_argument("--ip", action="append", default=[],
+                        help="server ip address (repeatable)")
+    parser.add_argument("--validation", choices=VALIDATION_LEVELS,
+                        default=STRICT)
+    parser.add_argument("--backend", help="capture backend")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    with GiftMerger(args.output) as merger:
+        before = len(merger)
+        merger.merge(args.inputs, args.ip, args.validation, args.backend)
+    if not args.quiet:
+        for path, n in merger.sources.items():
+            print(f"{path}: {n['gifts']} gifts, {n['new']} new",
+                  file=sys.stderr)
+        print(f"{args.output}: {before} + {merger.added} gifts "
+              f"({merger.duplicates} duplicates)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+'''
+read_packet と Framer の計測
+
+code ごとに
+- メッセージ数, バイト数
+- decode にかかった時間のヒストグラム
+- 例外の数, codes で弾かれた数, 遅れていて捨てた数(shedding.py)
+Framer 全体で
+- 受け取ったバイト数, 切り出したメッセージ数
+- resync の回数, buffer の最大サイズ
+と、リアルタイムの遅れ(秒)。
+EventBus では code と段階ごとに、キャプチャ時刻(captured_at)からの時間
+- framed: framing が終わったとき
+- decoded: read_packet が終わったとき
+- delivered: 受け手(キューか sink)に渡したとき
+のヒストグラムも取る(latency())。キャプチャした機械と時計がずれていると
+その分ずれるが、段階の間の差はそのまま使える
+
+を数える。既定では止まっていて、そのときは
+read_packet / Framer.feed で enabled を1回見るだけになる。
+
+    from lmapi import metrics
+    metrics.enable()
+    metrics.serve(9108)          # http://127.0.0.1:9108/metrics (Prometheus)
+    ...
+    for code, s in metrics.metrics.top(5):
+        print(code, s["seconds"])
+    metrics.metrics.latency()    # {code: {stage: {count, p50, p99}}}
+'''
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 秒。1us から 100ms くらいまで
+DEFAULT_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1,
+)
+# 秒。1ms から 1分まで
+LATENCY_BUCKETS = (
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 1e-1, 2.5e-1, 5e-1,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+STAGES = ("framed", "decoded", "delivered")
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最後は +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        '''(上限, その値以下の件数) のリスト。Prometheus の le と同じ'''
+        result = []
+        total = 0
+        for le, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            result.append((le, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        '''バケットの上限で近似した分位点'''
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        for le, total in self.cumulative():
+            if total >= rank:
+                return le
+        return float("inf")
+
+
+class CodeStats:
+    __slots__ = ("messages", "bytes", "errors", "skipped", "shed",
+                 "seconds")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.shed = 0
+        self.seconds = Histogram(buckets)
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.codes: dict[str, CodeStats] = {}
+        self.framer_bytes = 0
+        self.framer_messages = 0
+        self.framer_resyncs = 0
+        self.framer_high_water = 0
+        self.lag = 0.0
+        # (code, 段階) -> キャプチャからの時間
+        self.stages: dict[tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, code: str) -> CodeStats:
+        stats = self.codes.get(code)
+        if stats is None:
+            stats = self.codes[code] = CodeStats(self.buckets)
+        return stats
+
+    def observe(self, code: str, nbytes: int, seconds: float) -> None:
+        '''decode 1回分'''
+        with self._lock:
+            stats = self._stats(code)
+            stats.messages += 1
+            stats.bytes += nbytes
+            stats.seconds.observe(seconds)
+
+    def error(self, code: str, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            stats = self._stats(code)
+            stats.messages += 1
+            stats.bytes += nbytes
+            stats.errors += 1
+            stats.seconds.observe(seconds)
+
+    def skip(self, code: str, nbytes: int) -> None:
+        '''codes / codestartswith に入っていなかったもの'''
+        with self._lock:
+            stats = self._stats(code)
+            stats.skipped += 1
+            stats.bytes += nbytes
+
+    def shed(self, code: str, nbytes: int) -> None:
+        '''遅れていて decode せずに捨てたもの'''
+        with self._lock:
+            stats = self._stats(code)
+            stats.shed += 1
+            stats.bytes += nbytes
+
+    def set_lag(self, seconds: float) -> None:
+        self.lag = seconds
+
+    def stage(self, code: str, stage: str, captured_at: float,
+              now: Optional[float] = None) -> None:
+        '''captured_at のメッセージが stage まで来た'''
+        if now is None:
+            now = time.time()
+        with self._lock:
+            h = self.stages.get((code, stage))
+            if h is None:
+                h = self.stages[(code, stage)] = Histogram(LATENCY_BUCKETS)
+            h.observe(max(now - captured_at, 0.0))
+
+    def latency(self) -> dict:
+        '''{code: {段階: {"count", "p50", "p99"}}}'''
+        result: dict[str, dict] = {}
+        with self._lock:
+            for (code, stage), h in sorted(self.stages.items()):
+                result.setdefault(code, {})[stage] = {
+                    "count": h.count,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                }
+        return result
+
+    def framing(self, nbytes: int, nmessages: int, resyncs: int,
+                buffered: int) -> None:
+        '''Framer.feed 1回分。buffered は feed 中の buffer の最大バイト数'''
+        with self._lock:
+            self.framer_bytes += nbytes
+            self.framer_messages += nmessages
+            self.framer_resyncs += resyncs
+            if buffered > self.framer_high_water:
+                self.framer_high_water = buffered
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            codes = {
+                code: {
+                    "messages": s.messages,
+                    "bytes": s.bytes,
+                    "errors": s.errors,
+                    "skipped": s.skipped,
+                    "shed": s.shed,
+                    "seconds": s.seconds.sum,
+                    "p50": s.seconds.quantile(0.5),
+                    "p99": s.seconds.quantile(0.99),
+                }
+                for code, s in self.codes.items()
+            }
+            return {
+                "codes": codes,
+                "framer": {
+                    "bytes": self.framer_bytes,
+                    "messages": self.framer_messages,
+                    "resyncs": self.framer_resyncs,
+                    "high_water": self.framer_high_water,
+                },
+                "lag": self.lag,
+            }
+
+    def top(self, n: int = 10) -> list[tuple[str, dict]]:
+        '''decode に使った時間の合計が大きい code から n 個'''
+        codes = self.snapshot()["codes"]
+        return sorted(codes.items(), key=lambda kv: -kv[1]["seconds"])[:n]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.codes.clear()
+            self.framer_bytes = 0
+            self.framer_messages = 0
+            self.framer_resyncs = 0
+            self.framer_high_water = 0
+            self.lag = 0.0
+            self.stages.clear()
+
+    def render(self) -> str:
+        '''Prometheus の text format'''
+        lines = []
+
+        def metric(name: str, kind: str, help: str) -> None:
+            lines.append(f"# HELP lmapi_{name} {help}")
+            lines.append(f"# TYPE lmapi_{name} {kind}")
+
+        with self._lock:
+            codes = sorted(self.codes.items())
+            for attr, help in (
+                    ("messages", "messages passed to a decoder"),
+                    ("bytes", "bytes of messages seen by read_packet"),
+                    ("errors", "decoder exceptions"),
+                    ("skipped", "messages filtered out by codes"),
+                    ("shed", "messages dropped while decoding lagged")):
+                metric(f"{attr}_total", "counter", help)
+                for code, s in codes:
+                    lines.append(
+                        f'lmapi_{attr}_total{{code="{code}"}} '
+                        f'{getattr(s, attr)}')
+            metric("decode_seconds", "histogram", "time spent in a decoder")
+            for code, s in codes:
+                h = s.seconds
+                for le, total in h.cumulative():
+                    le_s = "+Inf" if le == float("inf") else repr(le)
+                    lines.append(
+                        f'lmapi_decode_seconds_bucket{{code="{code}",'
+                        f'le="{le_s}"}} {total}')
+                lines.append(
+                    f'lmapi_decode_seconds_sum{{code="{code}"}} {h.sum!r}')
+                lines.append(
+                    f'lmapi_decode_seconds_count{{code="{code}"}} {h.count}')
+            metric("framer_bytes_total", "counter", "bytes fed to framers")
+            lines.append(f"lmapi_framer_bytes_total {self.framer_bytes}")
+            metric("framer_messages_total", "counter", "messages framed")
+            lines.append(f"lmapi_framer_messages_total {self.framer_messages}")
+            metric("framer_resyncs_total", "counter",
+                   "zero length headers found while framing")
+            lines.append(f"lmapi_framer_resyncs_total {self.framer_resyncs}")
+            metric("framer_buffer_high_water_bytes", "gauge",
+                   "largest framer buffer seen")
+            lines.append(
+                f"lmapi_framer_buffer_high_water_bytes "
+                f"{self.framer_high_water}")
+            metric("lag_seconds", "gauge",
+                   "capture time to decode time, live decoding only")
+            lines.append(f"lmapi_lag_seconds {self.lag!r}")
+            metric("latency_seconds", "histogram",
+                   "capture time to each pipeline stage")
+            for (code, stage), h in sorted(self.stages.items()):
+                labels = f'code="{code}",stage="{stage}"'
+                for le, total in h.cumulative():
+                    le_s = "+Inf" if le == float("inf") else repr(le)
+                    lines.append(
+                        f'lmapi_latency_seconds_bucket{{{labels},'
+                        f'le="{le_s}"}} {total}')
+                lines.append(
+                    f'lmapi_latency_seconds_sum{{{labels}}} {h.sum!r}')
+                lines.append(
+                    f'lmapi_latency_seconds_count{{{labels}}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def enable() -> None:
+    metrics.enabled = True
+
+
+def disable() -> None:
+    metrics.enabled = False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port: int = 9108, host: str = "127.0.0.1",
+          enable_metrics: bool = True) -> ThreadingHTTPServer:
+    '''
+    /metrics を別スレッドで返す。止めるときは戻り値の shutdown()。
+    既定ではローカルからしか見えない
+    '''
+    if enable_metrics:
+        enable()
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name="lmapi-metrics")
+    thread.start()
+    logger.info(f"metrics on http://{host}:{server.server_address[1]}"
+                "/metrics")
+    return server
@@ -0,0 +1,304 @@
+'''
+ギルドメンバーの might / kills の推移(060b00)を小さく持つ
+
+    series = MightSeries()
+    read_pcapfile_series("test.pcap", series)     # キャプチャ時刻で入れる
+    series.gained(iggid, t1, t2)                  # t1 -> t2 で増えた might
+    series.top_growers(t1, t2, 10)                # 増えた順
+    series.save("might.lms")                      # MightSeries.load で戻す
+
+- iggid ごとに (時刻, might, kills) を1つ前との差分にして、
+  zigzag + varint で bytearray に詰める
+- might も kills も変わっていないスナップショットは足さない
+- CHECKPOINT 点ごとにその時点の値と位置を覚えておき、
+  範囲の検索はそこから先だけ読む
+- 前の点より古い時刻のスナップショットは入れずに late に数える
+
+ファイル形式
+- MAGIC (8 bytes)
+- メタ情報(JSON)の長さ (4 bytes) + JSON (名前, lastseen など)
+- SERIES (iggid, 点の数, バイト数) + 差分のバイト列 が iggid の数だけ
+'''
+import bisect
+import itertools
+import json
+import os
+import struct
+import time
+from typing import Iterable, Iterator, Optional
+from .lmdataclass import Player
+from .lmpacket import STRICT
+from .pcapReader import iter_pcapfile
+from .sinks import Sink
+
+MAGIC = b"LMMSR\x00\x00\x01"
+# iggid, number of points, length of data
+SERIES = struct.Struct("<QII")
+# 何点ごとに checkpoint を置くか
+CHECKPOINT = 32
+FIELDS = ("might", "kills")
+
+
+def _put(buf: bytearray, value: int) -> None:
+    '''zigzag + varint'''
+    value = -2 * value - 1 if value < 0 else 2 * value
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _get(buf: bytes, i: int) -> tuple[int, int]:
+    '''(値, 次の位置)'''
+    value = shift = 0
+    while True:
+        b = buf[i]
+        i += 1
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), i
+
+
+class _Series:
+    '''1人分。最初の点は (0, 0, 0) からの差分'''
+    __slots__ = ("data", "n", "last", "checkpoints", "times")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.n = 0
+        self.last = (0, 0, 0)
+        # (時刻, might, kills, その点の次の位置)
+        self.checkpoints: list[tuple[int, int, int, int]] = []
+        self.times: list[int] = []
+
+    def append(self, t: int, might: int, kills: int) -> None:
+        lt, lm, lk = self.last
+        _put(self.data, t - lt)
+        _put(self.data, might - lm)
+        _put(self.data, kills - lk)
+        if self.n % CHECKPOINT == 0:
+            self.checkpoints.append((t, might, kills, len(self.data)))
+            self.times.append(t)
+        self.n += 1
+        self.last = (t, might, kills)
+
+    def iter_from(self, k: int) -> Iterator[tuple[int, int, int]]:
+        '''k 番目の checkpoint の点から先'''
+        t, m, kl, i = self.checkpoints[k]
+        yield t, m, kl
+        data = self.data
+        end = len(data)
+        while i < end:
+            dt, i = _get(data, i)
+            dm, i = _get(data, i)
+            dk, i = _get(data, i)
+            t += dt
+            m += dm
+            kl += dk
+            yield t, m, kl
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        if self.n:
+            yield from self.iter_from(0)
+
+    def at(self, t: float) -> Optional[tuple[int, int, int]]:
+        '''t の時点での (時刻, might, kills)。まだ点がなければ None'''
+        k = bisect.bisect_right(self.times, t) - 1
+        if k < 0:
+            return None
+        found = None
+        for point in self.iter_from(k):
+            if point[0] > t:
+                break
+            found = point
+        return found
+
+    def range(self, start: float, end: float
+              ) -> Iterator[tuple[int, int, int]]:
+        k = max(bisect.bisect_right(self.times, start) - 1, 0)
+        for point in self.iter_from(k):
+            if point[0] > end:
+                return
+            if point[0] >= start:
+                yield point
+
+    @classmethod
+    def from_bytes(cls, data: bytes, n: int) -> "_Series":
+        '''checkpoint と last は読みなおして作る'''
+        s = cls()
+        s.data = bytearray(data)
+        s.n = n
+        t = m = kl = 0
+        i = 0
+        for j in range(n):
+            dt, i = _get(data, i)
+            dm, i = _get(data, i)
+            dk, i = _get(data, i)
+            t += dt
+            m += dm
+            kl += dk
+            if j % CHECKPOINT == 0:
+                s.checkpoints.append((t, m, kl, i))
+                s.times.append(t)
+        s.last = (t, m, kl)
+        return s
+
+
+class MightSeries:
+    def __init__(self):
+        self.series: dict[int, _Series] = {}
+        self.names: dict[int, str] = {}
+        self.lastseen: dict[int, int] = {}
+        self.snapshots = 0
+        self.duplicates = 0
+        self.late = 0
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+    def add(self, player: Player, timestamp: float) -> bool:
+        '''足したら True。前と同じ値か、前より古い時刻なら False'''
+        t = int(timestamp)
+        self.names[player.iggid] = player.name
+        self.lastseen[player.iggid] = player.lastseen
+        s = self.series.get(player.iggid)
+        if s is None:
+            s = self.series[player.iggid] = _Series()
+        elif t < s.last[0]:
+            self.late += 1
+            return False
+        elif s.last[1:] == (player.might, player.kills):
+            self.duplicates += 1
+            return False
+        s.append(t, player.might, player.kills)
+        return True
+
+    def add_snapshot(self, players: Iterable, timestamp: float) -> int:
+        '''060b00 1つ分。Player 以外は無視する。足した数を返す'''
+        self.snapshots += 1
+        return sum(self.add(p, timestamp) for p in players
+                   if isinstance(p, Player))
+
+    def value_at(self, iggid: int, timestamp: float,
+                 field: str = "might") -> Optional[int]:
+        s = self.series.get(iggid)
+        point = s.at(timestamp) if s is not None else None
+        if point is None:
+            return None
+        return point[1 + FIELDS.index(field)]
+
+    def series_of(self, iggid: int, start: float = 0,
+                  end: float = float("inf")) -> list[tuple[int, int, int]]:
+        '''start <= 時刻 <= end の (時刻, might, kills)。変わった点だけ'''
+        s = self.series.get(iggid)
+        if s is None:
+            return []
+        return list(s.range(start, end))
+
+    def gained(self, iggid: int, t1: float, t2: float,
+               field: str = "might") -> Optional[int]:
+        '''
+        t1 の時点から t2 の時点までの増加分。
+        t1 にはまだいなかった人は、t2 までの最初の値から数える
+        '''
+        s = self.series.get(iggid)
+        if s is None:
+            return None
+        end = s.at(t2)
+        if end is None:
+            return None
+        begin = s.at(t1)
+        if begin is None:
+            begin = next(s.range(t1, t2))
+        i = 1 + FIELDS.index(field)
+        return end[i] - begin[i]
+
+    def top_growers(self, t1: float, t2: float, n: int = 10,
+                    field: str = "might") -> list[tuple[int, str, int]]:
+        '''(iggid, 名前, 増加分) を増えた順に n 人'''
+        gains = []
+        for iggid in self.series:
+            g = self.gained(iggid, t1, t2, field)
+            if g is not None:
+                gains.append((iggid, self.names.get(iggid, ""), g))
+        gains.sort(key=lambda x: -x[2])
+        return gains[:n]
+
+    def nbytes(self) -> int:
+        '''差分のバイト列の合計'''
+        return sum(len(s.data) for s in self.series.values())
+
+    def save(self, path: str) -> None:
+        meta = json.dumps({
+            "saved_at": time.time(),
+            "names": self.names,
+            "lastseen": self.lastseen,
+            "snapshots": self.snapshots,
+            "duplicates": self.duplicates,
+            "late": self.late,
+        }).encode()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(meta)))
+            f.write(meta)
+            for iggid, s in self.series.items():
+                f.write(SERIES.pack(iggid, s.n, len(s.data)))
+                f.write(s.data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MightSeries":
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw[:8] != MAGIC:
+            raise ValueError(f"not a might series file: {path}")
+        meta_len = struct.unpack("<I", raw[8:12])[0]
+        meta = json.loads(raw[12:12+meta_len])
+        store = cls()
+        # JSON のキーは文字列になっている
+        store.names = {int(k): v for k, v in meta["names"].items()}
+        store.lastseen = {int(k): v for k, v in meta["lastseen"].items()}
+        store.snapshots = meta["snapshots"]
+        store.duplicates = meta["duplicates"]
+        store.late = meta["late"]
+        i = 12 + meta_len
+        while i < len(raw):
+            iggid, n, length = SERIES.unpack_from(raw, i)
+            i += SERIES.size
+            store.series[iggid] = _Series.from_bytes(raw[i:i+length], n)
+            i += length
+        return store
+
+
+class MightSeriesSink(Sink):
+    '''
+    read_pcapfile(sink=...) などから入れる。
+    キャプチャ時刻(captured_at)が同じ Player を1つの 060b00 として入れる。
+    captured_at がない(0の)ものは書いた時の時刻で入れる
+    '''
+
+    def __init__(self, store: MightSeries, **kwargs):
+        self.store = store
+        super().__init__(**kwargs)
+
+    def _write_batch(self, records: list) -> None:
+        players = [r for r in records if isinstance(r, Player)]
+        for captured_at, snapshot in itertools.groupby(
+                players, key=lambda p: p.captured_at):
+            self.store.add_snapshot(snapshot, captured_at or time.time())
+
+
+def read_pcapfile_series(pcapfile: str,
+                         store: Optional[MightSeries] = None,
+                         ipaddrs=[], validation: str = STRICT,
+                         backend: Optional[str] = None) -> MightSeries:
+    '''pcap の 060b00 をキャプチャ時刻つきで store に入れる'''
+    if store is None:
+        store = MightSeries()
+    for timestamp, players in iter_pcapfile(
+            pcapfile, ["060b00"], [], ipaddrs, 0, validation, backend):
+        store.add_snapshot(players, timestamp)
+    return store
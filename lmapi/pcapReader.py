@@ -1,10 +1,9 @@
 from dataclasses import asdict
-from typing import Union
+from typing import Iterable, Iterator, Optional, Union
+import functools
 import logging
-import binascii
 import time
 import os
-from scapy.all import PcapReader
 try:
     from rich.logging import RichHandler
     logging.basicConfig(
@@ -19,68 +18,47 @@ except ModuleNotFoundError:
         format="%(message)s",
         datefmt="[%X]",
     )
-from .lmpacket import read_packet
+from .lmpacket import STRICT, read_packet
 from .lmdataclass import Gift, GiftPopup, Player
-from .hex_funcs import hexstr2int
+from .bpf import SERVER_PORT, CaptureFilter
+from .capture import PysharkBackend, ScapyBackend, Segment, read_segments
+from .framer import FlowFramer
+from . import diagnostics
+from .sinks import ConsoleSink, Sink
+from .spill import SpillList
 
 logger = logging.getLogger(__name__)
 
+__scapy = ScapyBackend()
+__pyshark = PysharkBackend()
 
-def get_extracted_packet(
-        packet, scapy=True, ipaddrs=[]) -> Union[None, tuple[str, int]]:
-    if scapy:
-        return __get_extracted_packet_scapy(packet, ipaddrs)
-    else:
-        return __get_extracted_packet_pyshark(packet, ipaddrs)
+
+@functools.lru_cache(maxsize=16)
+def _capture_filter(ipaddrs: tuple[str, ...]) -> CaptureFilter:
+    return CaptureFilter(ipaddrs=list(ipaddrs))
 
 
-def __get_extracted_packet_scapy(
-        packet, ipaddrs: list[str]) -> Union[None, tuple[str, int]]:
+def get_extracted_packet(
+        packet, scapy=True, ipaddrs=[],
+        capture_filter: Optional[CaptureFilter] = None
+        ) -> Union[None, tuple[str, float]]:
     '''
-    scapy専用
-    --------------------------------
     ローモバの受信パケットだけを抽出したい。
     - TCPであることは確か
     - 送信IPは時々変わる
     - 送信ポートはTCP標準の5991で固定っぽい
     - 受信ポートは変わるっぽい
+    packet は scapy=True なら scapy の、False なら pyshark のパケット。
+    capture_filter を渡すと ipaddrs の代わりに使う
     '''
-    if "IP" not in packet or 'TCP' not in packet:
+    segment = (__scapy if scapy else __pyshark).segment(packet)
+    if segment is None:
         return None
-    if ipaddrs:
-        for iggip in ipaddrs:
-            if packet['IP'].src == iggip:
-                break
-        else:
-            return None
-    if not packet['TCP'].payload:
+    if capture_filter is None:
+        capture_filter = _capture_filter(tuple(ipaddrs))
+    if not capture_filter.accepts(segment):
         return None
-    if packet['TCP'].sport != 5991:
-        return None
-
-    # if packet['TCP'].dport != 52804:
-    #     return
-    # print(packet.time, int(packet.time), type(packet.time))
-    return packet['TCP'].payload.load.hex(), int(packet.time)
-
-
-def __get_extracted_packet_pyshark(
-        packet, ipaddrs: list[str]) -> Union[None, tuple[str, int]]:
-    # packet: pyshark.packet.packet.Packet
-    if not hasattr(packet, "tcp") or not hasattr(packet, "data"):
-        return None
-    if ipaddrs:
-        for iggip in ipaddrs:
-            if packet.ip.src == iggip:
-                break
-        else:
-            return None
-    if packet.tcp.srcport != "5991":
-        return None
-    return (
-        binascii.unhexlify(packet.data.data).hex(),
-        int(float(packet.sniff_timestamp))
-    )
+    return segment.payload.hex(), segment.timestamp
 
 
 def read_pcapfile_mh(pcapfile: str, codes=None, codestartwith=[]):
@@ -97,43 +75,9 @@ def read_pcapfile_mh(pcapfile: str, codes=None, codestartwith=[]):
     popups: list[GiftPopup] = []
     players: list[Player] = []
 
-    cap = PcapReader(pcapfile).read_all()
-    d = ""
-    for i, packet in enumerate(cap):
-        _dd = get_extracted_packet(packet)
-        if not _dd:
-            continue
-        dd, timestamp = _dd
-        d += dd
-        while True:
-            if len(d) < 10:
-                # データ長さとcodeが読み取れないほど短かったら抜ける
-                break
-            __length = hexstr2int(d[:4])*2  # データ長さ
-            if __length == 0:
-                # データ長さが0だとどうしようもなくなる。
-                # codesが見つかるか試す
-                for code in codes:
-                    if code in d:
-                        pos = d.find(code)
-                        d = d[pos-4:]  # 上書き
-                        __length = hexstr2int(d[:4])*2  # データ長さ上書き
-                        assert d[4:10] == code
-                        break
-                else:
-                    # codesが見つからなかったら関係ないし、丸ごとスキップする
-                    logger.warning(f"i= {i+1}, {d[:10]}")
-                    logger.warning(f"len(d) = {len(d)}")
-                    d = ""
-                    break
-
-            if len(d) >= __length:
-                data = d[:__length]
-                d = d[__length:]
-            else:
-                # データ長さが足りなかったら次のパケットをもらうために抜ける
-                break
-
+    framer = FlowFramer(codes)
+    for segment in read_segments(pcapfile, CaptureFilter()):
+        for _, data in framer.feed(segment.flow, segment.payload.hex()):
             result = read_packet(data, codes, codestartwith)
             if result is None:
                 continue
@@ -151,6 +95,8 @@ def read_pcapfile_mh(pcapfile: str, codes=None, codestartwith=[]):
                 # raise Exception
                 pass
 
+    diagnostics.diagnostics.report()
+
     # プレーヤーだけiggidでuniqueにする。
     __iggids = []
     __players = []
@@ -169,94 +115,106 @@ def read_pcapfile_mh(pcapfile: str, codes=None, codestartwith=[]):
 
 
 def get_iggip(cap, scapy=True):
+    '''cap は scapy / pyshark のパケットのリスト'''
     started = time.time()
+    backend = __scapy if scapy else __pyshark
+    ipaddrs = server_ips(backend.segment(packet) for packet in cap)
+    logger.info(
+        f"time to get ip.src: {time.time()-started:4.2f}sec, ip:{ipaddrs}")
+    return ipaddrs
+
+
+def server_ips(segments: Iterable[Optional[Segment]],
+               port: int = SERVER_PORT) -> list[str]:
+    '''ローモバのサーバー(送信ポート5991)のIPを出てきた順に'''
     ipaddrs: list[str] = []
-    for packet in cap:
-        if scapy:
-            if "IP" not in packet or 'TCP' not in packet:
-                continue
-            if not packet['TCP'].payload:
-                continue
-            if packet['TCP'].sport != 5991:
-                continue
-            ipaddr = packet['IP'].src
-            if ipaddr not in ipaddrs:
-                ipaddrs.append(ipaddr)
-        else:
-            if not hasattr(packet, "tcp") or not hasattr(packet, "data"):
-                continue
-            if packet.tcp.srcport != "5991":
-                continue
-            ipaddr = packet.ip.src
-            if ipaddr not in ipaddrs:
-                ipaddrs.append(ipaddr)
+    for segment in segments:
+        if segment is None or segment.flow.sport != port:
+            continue
+        if segment.flow.src not in ipaddrs:
+            ipaddrs.append(segment.flow.src)
     if len(ipaddrs) != 1:
         logger.warning(f"multiple ip.src found: {ipaddrs}")
-    logger.info(
-        f"time to get ip.src: {time.time()-started:4.2f}sec, ip:{ipaddrs}")
     return ipaddrs
 
 
+def iter_pcapfile(pcapfile: str, codes, codestartwith, ipaddrs=[],
+                  delim=80, validation: str = STRICT,
+                  backend: Optional[str] = None,
+                  server_ips: Optional[list[str]] = None
+                  ) -> Iterator[tuple[float, list]]:
+    '''
+    read_pcapfile の中身。メッセージごとに (timestamp, decode結果) を返す。
+    server_ips にリストを渡すと、見つかったサーバーのIPを足していく
+    '''
+    selected = set(ipaddrs)
+    # 接続ごとに framing する
+    framer = FlowFramer(codes)
+    for segment in read_segments(pcapfile, CaptureFilter(), backend):
+        if server_ips is not None and segment.flow.src not in server_ips:
+            server_ips.append(segment.flow.src)
+        if selected and segment.flow.src not in selected:
+            continue
+        timestamp = segment.timestamp
+        for _, data in framer.feed(segment.flow, segment.payload.hex()):
+            if len(data) < delim:  # CAUTION
+                continue
+            result = read_packet(data, codes, codestartwith,
+                                 timestamp=timestamp, validation=validation)
+            if result:
+                yield timestamp, result
+
+
+def _server_seen(pcapfile: str, ipaddrs, backend: Optional[str]) -> bool:
+    '''decode する前に、ipaddrs からのパケットがあるか確かめる'''
+    segments = read_segments(pcapfile, CaptureFilter(ipaddrs=ipaddrs),
+                             backend)
+    try:
+        return next(segments, None) is not None
+    finally:
+        segments.close()
+
+
 def read_pcapfile(pcapfile: str, codes, codestartwith,
-                  p=True, ipaddrs=[], delim=80) -> list:
-    results = []
+                  p=True, ipaddrs=[], delim=80,
+                  sink: Optional[Sink] = None, validation: str = STRICT,
+                  backend: Optional[str] = None,
+                  memory_budget: Optional[int] = None
+                  ) -> Union[list, SpillList]:
+    '''
+    p=True なら結果を ConsoleSink 経由で表示する。表示が追いつかなくても
+    decode は止めない(追いつかない分は表示せずに捨てる)。
+    sink を渡すとそちらに書く(closeは呼び出し側で)。
+    validation は read_packet と同じ。
+    backend は capture.py のもの(既定は使える中で一番速いもの)。
+    memory_budget (バイト) を渡すと、結果がそれを超えた分は一時ファイルに
+    書き出して SpillList で返す(for で順に読める。添字は使えない)。
+    pcap は1パケットずつ読むので、入力の大きさではメモリは増えない。
+    '''
+    if ipaddrs and not _server_seen(pcapfile, ipaddrs, backend):
+        raise ValueError(f"ip selected not found: {ipaddrs}")
+    results: Union[list, SpillList] = (
+        [] if memory_budget is None else SpillList(memory_budget))
+    console = ConsoleSink(on_full="drop") if sink is None and p else None
+    if console is not None:
+        sink = console
     __size = os.path.getsize(pcapfile)/1024/1024
     __started = time.time()
-    cap = PcapReader(pcapfile).read_all()
+    iggips: list[str] = []
+    try:
+        for _, result in iter_pcapfile(pcapfile, codes, codestartwith,
+                                       ipaddrs, delim, validation, backend,
+                                       iggips):
+            results.extend(result)
+            if sink is not None:
+                sink.write_many(result)
+    finally:
+        if console is not None:
+            console.close()
     logger.info(
-        f"time to load pcap: {time.time()-__started:5.2f}sec/{__size:.2f}MB")
-    iggips = get_iggip(cap)
-    if ipaddrs:
-        for addr in ipaddrs:
-            if addr in iggips:
-                break
-        else:
-            assert False, f"ip selected not found: {ipaddrs}"
-
-    d = ""
-    for i, packet in enumerate(cap):
-        _dd = get_extracted_packet(packet, ipaddrs=ipaddrs)
-        if not _dd:
-            continue
-        dd, timestamp = _dd
-        d += dd
-        while True:
-            # 1690 15002320001d004700d0
-            if len(d) < 10:
-                # データ長さとcodeが読み取れないほど短かったら抜ける
-                break
-            __length = hexstr2int(d[:4])*2  # データ長さ
-            if __length == 0:
-                # データ長さが0だとどうしようもなくなる。
-                # codesが見つかるか試す
-                for code in codes:
-                    if code in d:
-                        pos = d.find(code)
-                        d = d[pos-4:]  # 上書き
-                        __length = hexstr2int(d[:4])*2  # データ長さ上書き
-                        assert d[4:10] == code
-                        break
-                else:
-                    # codesが見つからなかったら関係ないし、丸ごとスキップする
-                    logger.warning(f"i= {i+1}, {d[:10]}")
-                    logger.warning(f"len(d) = {len(d)}")
-                    d = ""
-                    break
-
-            if len(d) >= __length:
-                data = d[:__length]
-                d = d[__length:]
-            else:
-                # データ長さが足りなかったら次のパケットをもらうために抜ける
-                break
-            if __length < delim:  # CAUTION
-                continue
-            result = read_packet(data, codes, codestartwith,
-                                 timestamp=timestamp)
-            if result is None or len(result) == 0:
-                continue
-            results += result
-            if p:
-                for r in result:
-                    print(r)
+        f"time to read pcap: {time.time()-__started:5.2f}sec/{__size:.2f}MB,"
+        f" ip:{iggips}")
+    if len(iggips) != 1:
+        logger.warning(f"multiple ip.src found: {iggips}")
+    diagnostics.diagnostics.report()
     return results
@@ -0,0 +1,69 @@
+'''
+libpcap形式(.pcap)をscapyを通さずにレコード単位で読む
+
+ファイル上のオフセットがわかるので、途中から読み直したり、
+書き込み途中のファイルを追いかけたりできる。pcapngは未対応。
+'''
+import struct
+from typing import BinaryIO, Iterator, NamedTuple
+
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+# magic -> (endian, 秒あたりの単位)
+MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+
+
+class PcapHeader(NamedTuple):
+    endian: str
+    resolution: float
+    snaplen: int
+    linktype: int
+
+
+class PcapRecord(NamedTuple):
+    offset: int       # レコードヘッダの位置
+    next_offset: int  # 次のレコードの位置
+    timestamp: float
+    data: bytes
+
+
+def read_header(f: BinaryIO) -> PcapHeader:
+    '''ヘッダが揃っていなければ EOFError'''
+    f.seek(0)
+    raw = f.read(GLOBAL_HEADER_LEN)
+    if len(raw) < GLOBAL_HEADER_LEN:
+        raise EOFError("pcap global header is not complete")
+    if raw[:4] not in MAGICS:
+        raise ValueError(f"not a pcap file (magic={raw[:4].hex()})")
+    endian, resolution = MAGICS[raw[:4]]
+    snaplen, linktype = struct.unpack(endian + "II", raw[16:24])
+    return PcapHeader(endian, resolution, snaplen, linktype & 0x0fffffff)
+
+
+def iter_records(f: BinaryIO, header: PcapHeader,
+                 offset: int = GLOBAL_HEADER_LEN) -> Iterator[PcapRecord]:
+    '''
+    offset から順にレコードを返す。
+    末尾のレコードが書き込み途中なら、そこで止まる
+    (最後に返した next_offset から読み直せばよい)。
+    '''
+    unpack = struct.Struct(header.endian + "IIII").unpack
+    resolution = header.resolution
+    f.seek(offset)
+    while True:
+        raw = f.read(RECORD_HEADER_LEN)
+        if len(raw) < RECORD_HEADER_LEN:
+            return
+        sec, frac, caplen, _ = unpack(raw)
+        data = f.read(caplen)
+        if len(data) < caplen:
+            return
+        next_offset = offset + RECORD_HEADER_LEN + caplen
+        yield PcapRecord(offset, next_offset, sec + frac*resolution, data)
+        offset = next_offset
@@ -0,0 +1,242 @@
+'''
+王国のマップ(512x1024)をタイルごとの整数の配列で持つ
+
+    raster = KingdomRaster(kingdom=100)
+    read_raster_pcapfile("test.pcap", raster)   # ac08 をキャプチャ時刻で入れる
+    raster.density("monster", cell=16)          # 16x16 マスごとの数
+    raster.save_png("monster.png", "monster", cell=8)
+    raster.save("k100.npz")                     # KingdomRaster.load で戻す
+
+MapObject を持つ代わりに、1タイル = uint32 1つに詰める
+- bit 0-3:   種類 (object_type をそのまま。ダークネストは 0c)。0 はまだ見ていない
+- bit 4-8:   レベル
+- bit 9:     プレイヤーがいる(城, 採集中の資源地)
+- bit 10-31: 最後に見た時刻 (base からの分)
+512x1024x4 bytes = 2MB。ac08 を受け取るたびにその場で書き換える。
+ac08 にはそこにある物しか来ないので、消えた物は次に何か見えるまで残る。
+
+numpy が必要
+'''
+import itertools
+import os
+import struct
+import time
+import zlib
+from typing import Iterable, Optional
+import numpy as np
+from .lmdataclass import MapObject, MapObjectCastle, MapObjectResourceTile
+from .lmpacket import STRICT
+from .pcapReader import iter_pcapfile
+from .sinks import Sink
+
+WIDTH = 512
+HEIGHT = 1024
+
+TYPE_BITS = 0x0f
+LEVEL_SHIFT = 4
+LEVEL_BITS = 0x1f
+OCCUPIED = 1 << 9
+SEEN_SHIFT = 10
+SEEN_MAX = (1 << 22) - 1
+
+DARKNEST = 0x0c
+DARKNEST_SKIN = "0102"
+
+# heatmap の名前 -> 種類
+KINDS = {
+    "resource": (0x01, 0x02, 0x03, 0x04, 0x05, 0x06),
+    "food": (0x01,),
+    "stone": (0x02,),
+    "ore": (0x03,),
+    "timber": (0x04,),
+    "gold": (0x05,),
+    "gem": (0x06,),
+    "castle": (0x08,),
+    "darknest": (DARKNEST,),
+    "camp": (0x09,),
+    "monster": (0x0a,),
+    "fort": (0x0b,),
+}
+
+
+def _pack(obj: MapObject, minutes: int) -> Optional[int]:
+    '''タイル1つ分の値。移動中の部隊など、タイルでないものは None'''
+    kind = int(obj.object_type, 16)
+    if kind == 0:
+        return None
+    o = obj.obj
+    level = getattr(o, "lv", 0)
+    occupied = False
+    if isinstance(o, MapObjectCastle):
+        if o.castle_skin_id == DARKNEST_SKIN:
+            kind = DARKNEST
+        else:
+            occupied = True
+    elif isinstance(o, MapObjectResourceTile):
+        occupied = bool(o.player)
+    value = (kind & TYPE_BITS) | (min(level, LEVEL_BITS) << LEVEL_SHIFT)
+    if occupied:
+        value |= OCCUPIED
+    return value | (minutes << SEEN_SHIFT)
+
+
+def write_png(path: str, image: np.ndarray) -> None:
+    '''uint8 の (高さ, 幅) か (高さ, 幅, 3) を PNG にする(標準ライブラリだけで)'''
+    height, width = image.shape[:2]
+    color = 2 if image.ndim == 3 else 0
+    rows = np.ascontiguousarray(image, dtype=np.uint8).reshape(height, -1)
+    # 各行の先頭にフィルタ 0 を置く
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows])
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8,
+                                           color, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+    os.replace(tmp, path)
+
+
+def heat_colors(values: np.ndarray) -> np.ndarray:
+    '''0-1 を 黒->赤->黄->白 の RGB にする'''
+    v = np.clip(values, 0, 1)[..., None]
+    rgb = np.clip(v * 3 - np.array([0, 1, 2]), 0, 1)
+    return (rgb * 255).astype(np.uint8)
+
+
+class KingdomRaster:
+    def __init__(self, kingdom: int = 0, base: Optional[int] = None):
+        '''base: 最後に見た時刻を数え始める時刻。省略したら最初の update の時刻'''
+        self.kingdom = kingdom
+        self.base = base
+        self.tiles = np.zeros((HEIGHT, WIDTH), dtype=np.uint32)
+        self.updates = 0
+
+    def _minutes(self, timestamp: float) -> int:
+        if self.base is None:
+            self.base = int(timestamp)
+        return min(max(int(timestamp - self.base) // 60, 0), SEEN_MAX)
+
+    def update(self, objs: Iterable, timestamp: Optional[float] = None
+               ) -> int:
+        '''ac08 1つ分の MapObject を書き込む。MapObject 以外は無視する'''
+        minutes = self._minutes(time.time() if timestamp is None
+                                else timestamp)
+        xs, ys, values = [], [], []
+        for obj in objs:
+            if not isinstance(obj, MapObject):
+                continue
+            if not (0 <= obj.x < WIDTH and 0 <= obj.y < HEIGHT):
+                continue
+            value = _pack(obj, minutes)
+            if value is None:
+                continue
+            xs.append(obj.x)
+            ys.append(obj.y)
+            values.append(value)
+        if values:
+            self.tiles[ys, xs] = values
+            self.updates += 1
+        return len(values)
+
+    # どれも (HEIGHT, WIDTH) の配列
+    def kinds(self) -> np.ndarray:
+        return self.tiles & TYPE_BITS
+
+    def levels(self) -> np.ndarray:
+        return (self.tiles >> LEVEL_SHIFT) & LEVEL_BITS
+
+    def occupied(self) -> np.ndarray:
+        return (self.tiles & OCCUPIED) != 0
+
+    def last_seen(self) -> np.ndarray:
+        '''unixtime(見ていないタイルは 0)'''
+        minutes = (self.tiles >> SEEN_SHIFT).astype(np.int64)
+        seen = minutes * 60 + (self.base or 0)
+        return np.where(self.kinds() != 0, seen, 0)
+
+    def mask(self, kind: str, min_level: int = 0,
+             occupied: Optional[bool] = None) -> np.ndarray:
+        '''KINDS の名前に当たるタイル'''
+        mask = np.isin(self.kinds(), KINDS[kind])
+        if min_level:
+            mask &= self.levels() >= min_level
+        if occupied is not None:
+            mask &= self.occupied() == occupied
+        return mask
+
+    def density(self, kind: str, cell: int = 8, **kwargs) -> np.ndarray:
+        '''cell x cell マスごとの数。形は (HEIGHT // cell, WIDTH // cell)'''
+        if HEIGHT % cell or WIDTH % cell:
+            raise ValueError(f"cell must divide {WIDTH}: {cell}")
+        mask = self.mask(kind, **kwargs)
+        return mask.reshape(HEIGHT // cell, cell, WIDTH // cell,
+                            cell).sum(axis=(1, 3))
+
+    def save_npy(self, path: str, kind: str, cell: int = 8,
+                 **kwargs) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, self.density(kind, cell, **kwargs))
+        os.replace(tmp, path)
+
+    def save_png(self, path: str, kind: str, cell: int = 8,
+                 scale: int = 1, **kwargs) -> None:
+        '''一番多いマスを白にした heatmap。scale 倍に引き伸ばす'''
+        counts = self.density(kind, cell, **kwargs)
+        peak = counts.max()
+        image = heat_colors(counts / peak if peak else counts * 0.0)
+        if scale > 1:
+            image = image.repeat(scale, axis=0).repeat(scale, axis=1)
+        write_png(path, image)
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, tiles=self.tiles, meta=np.array(
+                [self.kingdom, self.base or 0, self.updates], dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "KingdomRaster":
+        with np.load(path) as data:
+            kingdom, base, updates = (int(v) for v in data["meta"])
+            raster = cls(kingdom, base or None)
+            raster.tiles = data["tiles"].astype(np.uint32)
+            raster.updates = updates
+        return raster
+
+
+class RasterSink(Sink):
+    '''
+    read_pcapfile(sink=...) などから入れる。時刻はキャプチャ時刻。
+    captured_at がない(0の)ものは書いた時の時刻
+    '''
+
+    def __init__(self, raster: KingdomRaster, **kwargs):
+        self.raster = raster
+        super().__init__(**kwargs)
+
+    def _write_batch(self, records: list) -> None:
+        objs = [r for r in records if isinstance(r, MapObject)]
+        for captured_at, group in itertools.groupby(
+                objs, key=lambda o: o.captured_at):
+            self.raster.update(group, captured_at or None)
+
+
+def read_raster_pcapfile(pcapfile: str,
+                         raster: Optional[KingdomRaster] = None,
+                         ipaddrs=[], validation: str = STRICT,
+                         backend: Optional[str] = None) -> KingdomRaster:
+    '''pcap の ac08 をキャプチャ時刻で raster に入れる'''
+    if raster is None:
+        raster = KingdomRaster()
+    for timestamp, objs in iter_pcapfile(pcapfile, [], ["ac08"], ipaddrs, 0,
+                                         validation, backend):
+        raster.update(objs, timestamp)
+    return raster
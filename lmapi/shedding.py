@@ -0,0 +1,147 @@
+'''
+リアルタイムの decode が遅れたときに、優先度の低い code を捨てる
+
+    shedder = LoadShedder()                  # DEFAULT_PRIORITIES
+    bus = EventBus(shedder=shedder)          # framing の後、decode の前で判定
+    ...
+    shedder.report()                         # 捨てた数
+
+- 遅れ = 今の時刻 - パケットのキャプチャ時刻。
+  キャプチャした機械と時計がずれていることがあるので、
+  今までで一番小さかった値を 0 とみなす(追いついていた時の値)
+- 遅れが thresholds[優先度] 秒を超えたら、その優先度のメッセージを捨てる。
+  CRITICAL は捨てない
+- 優先度は PRIORITIES の上から順に、code の先頭と
+  メッセージの大きさ(min_bytes 以上)が合った最初のもの
+'''
+import logging
+import threading
+import time
+from typing import Callable, Optional
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CRITICAL = 0
+HIGH = 1
+NORMAL = 2
+LOW = 3
+PRIORITY_NAMES = {CRITICAL: "critical", HIGH: "high", NORMAL: "normal",
+                  LOW: "low"}
+
+# (code か code の先頭, 優先度[, min_bytes])
+DEFAULT_PRIORITIES: list[tuple] = [
+    # ギフト
+    ("370b00", CRITICAL),
+    ("310b00", CRITICAL),
+    ("2b0b12", CRITICAL),
+    ("2b0b13", HIGH),
+    ("2b0b14", HIGH),
+    ("ac080c", HIGH),
+    # 広い範囲のマップはまとめて大きく届く
+    ("ac08", LOW, 8192),
+    # 部隊の移動(集結)などの小さい更新
+    ("ac08", HIGH),
+    ("ba08", LOW),
+    ("bb0b00", NORMAL),
+    ("5e0d", NORMAL),
+    ("7f0500", NORMAL),
+    ("060b00", LOW),
+    ("f20a", LOW),
+    ("2a0b00", LOW),
+]
+# 優先度 -> 遅れ(秒)がこれを超えたら捨てる
+DEFAULT_THRESHOLDS = {HIGH: 30.0, NORMAL: 10.0, LOW: 2.0}
+
+
+class LoadShedder:
+    def __init__(self, priorities: list[tuple] = DEFAULT_PRIORITIES,
+                 thresholds: dict[int, float] = DEFAULT_THRESHOLDS,
+                 default: int = NORMAL,
+                 clock: Callable[[], float] = time.time):
+        self.priorities = [(r[0], r[1], r[2] if len(r) > 2 else 0)
+                           for r in priorities]
+        self.thresholds = dict(thresholds)
+        self.default = default
+        self.clock = clock
+        self.offset: Optional[float] = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        # この優先度以上(数字が大きいもの)を捨てる。None なら捨てない
+        self.shed_from: Optional[int] = None
+        # code -> [捨てた数, バイト数]
+        self.shed: dict[str, list[int]] = {}
+        self.admitted = 0
+        self._rules: dict[str, list[tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timestamp: float) -> float:
+        '''キャプチャ時刻を1つ受け取って、今の遅れを返す'''
+        raw = self.clock() - timestamp
+        if self.offset is None or raw < self.offset:
+            self.offset = raw
+        lag = raw - self.offset
+        self.lag = lag
+        if metrics.enabled:
+            metrics.set_lag(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        shed_from = None
+        for priority in sorted(self.thresholds):
+            if lag > self.thresholds[priority]:
+                shed_from = priority
+                break
+        if shed_from != self.shed_from:
+            if shed_from is None:
+                logger.info(f"caught up (lag {lag:.1f}s), stop shedding")
+            else:
+                logger.warning(
+                    f"lag {lag:.1f}s, shedding "
+                    f"{PRIORITY_NAMES.get(shed_from, shed_from)} "
+                    f"and lower priority messages")
+            self.shed_from = shed_from
+        return lag
+
+    def priority(self, code: str, nbytes: int) -> int:
+        rules = self._rules.get(code)
+        if rules is None:
+            rules = self._rules[code] = [
+                (priority, min_bytes)
+                for prefix, priority, min_bytes in self.priorities
+                if code.startswith(prefix)]
+        for priority, min_bytes in rules:
+            if nbytes >= min_bytes:
+                return priority
+        return self.default
+
+    def admit(self, code: str, nbytes: int) -> bool:
+        '''decode してよければ True。捨てるものは数えておく'''
+        shed_from = self.shed_from
+        if shed_from is None:
+            self.admitted += 1
+            return True
+        priority = self.priority(code, nbytes)
+        if priority == CRITICAL or priority < shed_from:
+            self.admitted += 1
+            return True
+        with self._lock:
+            counts = self.shed.get(code)
+            if counts is None:
+                counts = self.shed[code] = [0, 0]
+            counts[0] += 1
+            counts[1] += nbytes
+        if metrics.enabled:
+            metrics.shed(code, nbytes)
+        return False
+
+    def report(self) -> dict:
+        with self._lock:
+            shed = {code: {"messages": n, "bytes": b}
+                    for code, (n, b) in sorted(self.shed.items())}
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "shedding": PRIORITY_NAMES.get(self.shed_from),
+            "admitted": self.admitted,
+            "shed": shed,
+        }
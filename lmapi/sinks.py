@@ -0,0 +1,247 @@
+'''
+decode結果の出力先
+
+print() で1件ずつ書き出すと、端末やパイプが遅いときに decode まで止まる。
+Sink.write() はキューに積むだけで、実際の書き込みは
+バックグラウンドのスレッドがまとめて行う。
+
+- on_full="block": キューが一杯なら空くまで待つ(取りこぼさない)
+- on_full="drop":  キューが一杯なら捨てて dropped を数える(decodeを止めない)
+'''
+import csv
+import json
+import logging
+import queue
+import sys
+import threading
+from typing import IO, Iterable, Iterator, Optional, TextIO
+from .lmdataclass import to_dict
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Sink:
+    '''
+    サブクラスは _write_batch() を実装する。
+    _open(), _write_batch(), _flush(), _close() は全て書き込みスレッドから呼ばれる。
+    '''
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 0.5, on_full: str = "block"):
+        if on_full not in ("block", "drop"):
+            raise ValueError(f"on_full must be 'block' or 'drop': {on_full}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self.written = 0
+        self.dropped = 0
+        self.error: Optional[BaseException] = None
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def write(self, record) -> None:
+        if self._closed:
+            raise ValueError("write to closed sink")
+        if self.on_full == "block":
+            self._queue.put(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_many(self, records: Iterable) -> None:
+        for r in records:
+            self.write(r)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.dropped:
+            logger.warning(f"{type(self).__name__}: dropped {self.dropped}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self) -> None:
+        try:
+            self._open()
+        except BaseException as e:
+            self.error = e
+            logger.exception(f"{type(self).__name__}: failed to open")
+        stop = False
+        while not stop:
+            try:
+                r = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if r is _STOP:
+                    stop = True
+                    break
+                batch.append(r)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    r = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch and self.error is None:
+                try:
+                    self._write_batch(batch)
+                    self._flush()
+                    self.written += len(batch)
+                except BaseException as e:
+                    # 書き込みに失敗しても decode 側は止めない。残りは読み捨てる
+                    self.error = e
+                    logger.exception(f"{type(self).__name__}: write failed")
+        if self.error is None:
+            try:
+                self._close()
+            except BaseException as e:
+                self.error = e
+                logger.exception(f"{type(self).__name__}: failed to close")
+
+    def _open(self) -> None:
+        pass
+
+    def _write_batch(self, records: list) -> None:
+        raise NotImplementedError
+
+    def _flush(self) -> None:
+        pass
+
+    def _close(self) -> None:
+        pass
+
+
+class ConsoleSink(Sink):
+    '''今までの print(r) と同じ出力'''
+
+    def __init__(self, stream: Optional[TextIO] = None, **kwargs):
+        self.stream = stream
+        super().__init__(**kwargs)
+
+    def _write_batch(self, records: list) -> None:
+        stream = self.stream or sys.stdout
+        stream.write("".join(f"{r!r}\n" for r in records))
+
+    def _flush(self) -> None:
+        (self.stream or sys.stdout).flush()
+
+
+def _jsonl_line(record) -> str:
+    return json.dumps(to_dict(record), ensure_ascii=False, default=str) + "\n"
+
+
+class JSONLSink(Sink):
+    '''1行1レコード。"type" にdataclassの名前が入る'''
+
+    def __init__(self, path: str, mode: str = "w", **kwargs):
+        self.path = path
+        self.mode = mode
+        self._f: Optional[IO[str]] = None
+        super().__init__(**kwargs)
+
+    def _open(self) -> None:
+        self._f = open(self.path, self.mode, encoding="utf-8")
+
+    def _write_batch(self, records: list) -> None:
+        # _open() に失敗したら _write_batch() は呼ばれない
+        assert self._f is not None
+        self._f.write("".join(_jsonl_line(r) for r in records))
+
+    def _flush(self) -> None:
+        assert self._f is not None
+        self._f.flush()
+
+    def _close(self) -> None:
+        assert self._f is not None
+        self._f.close()
+
+
+class JSONLLedger:
+    '''
+    追記していく .jsonl の台帳(GiftMerger, ChatArchive で使う)。
+    JSONLSink と同じ形式で、こちらは呼んだスレッドでその場で書く
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f: Optional[TextIO] = open(path, "a", encoding="utf-8")
+
+    def read(self, type_name: str) -> Iterator[dict]:
+        '''今までに書いた type_name の行を dict で。"type" がない行も含む'''
+        self.flush()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                d = json.loads(line)
+                if d.pop("type", type_name) == type_name:
+                    yield d
+
+    def append(self, record) -> None:
+        if self._f is None:
+            raise ValueError(f"append to closed ledger: {self.path}")
+        self._f.write(_jsonl_line(record))
+
+    def flush(self) -> None:
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class CSVSink(Sink):
+    '''
+    dataclassの型ごとに {prefix}_{型名}.csv へ書く。
+    list や入れ子のdataclassはJSON文字列にする。
+    '''
+
+    def __init__(self, prefix: str, **kwargs):
+        self.prefix = prefix
+        self._files: dict[str, tuple[TextIO, csv.DictWriter]] = {}
+        super().__init__(**kwargs)
+
+    def _writer(self, name: str, fieldnames: list[str]) -> csv.DictWriter:
+        if name not in self._files:
+            f = open(f"{self.prefix}_{name}.csv", "w",
+                     encoding="utf-8", newline="")
+            writer = csv.DictWriter(f, fieldnames=fieldnames,
+                                    extrasaction="ignore")
+            writer.writeheader()
+            self._files[name] = (f, writer)
+        return self._files[name][1]
+
+    def _write_batch(self, records: list) -> None:
+        for r in records:
+            row = to_dict(r)
+            name = row.pop("type")
+            for k, v in row.items():
+                if isinstance(v, (list, dict)):
+                    row[k] = json.dumps(v, ensure_ascii=False, default=str)
+            self._writer(name, list(row)).writerow(row)
+
+    def _flush(self) -> None:
+        for f, _ in self._files.values():
+            f.flush()
+
+    def _close(self) -> None:
+        for f, _ in self._files.values():
+            f.close()
@@ -0,0 +1,155 @@
+'''
+メモリに入りきらない decode 結果を一時ファイルに逃がすリスト
+
+    results = SpillList(memory_budget=512 * 1024**2)
+    results.extend(records)      # 512MB を超えたら一時ファイルに書き出す
+    for r in results:            # 書き出したものも順番どおりに読み戻す
+        ...
+    results.close()              # 一時ファイルを消す(捨てられたときも消える)
+
+read_pcapfile(memory_budget=...) と python -m lmapi --memory-budget で使う。
+
+- 大きさは数十件に1件だけ中身までたどって測り、型ごとの平均で見積もる
+- 書き出すのは pickle (入れ子の dataclass もそのまま戻せる)
+- key を渡すと、書き出す前に key で並べておき、読むときに heapq.merge する
+  (外部ソート)。渡さなければ append した順
+'''
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import weakref
+from typing import Callable, Iterable, Iterator, Optional
+
+# この件数ずつまとめて pickle する
+CHUNK = 1000
+# 型ごとに、この件数に1件だけ測る
+SAMPLE = 64
+
+_ATOMS = (str, bytes, int, float, bool, type(None))
+
+
+def deep_sizeof(obj) -> int:
+    '''中身までたどった大きさ(バイト)のだいたいの値'''
+    size = sys.getsizeof(obj)
+    if isinstance(obj, _ATOMS):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_sizeof(v) for v in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_sizeof(v) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return size + deep_sizeof(vars(obj))
+    return size
+
+
+class _SizeEstimate:
+    def __init__(self):
+        # 型 -> [見た数, 測った数, 測った大きさの合計]
+        self.types: dict[type, list[int]] = {}
+
+    def __call__(self, obj) -> int:
+        t = self.types.get(type(obj))
+        if t is None:
+            t = self.types[type(obj)] = [0, 0, 0]
+        if t[0] % SAMPLE == 0:
+            t[1] += 1
+            t[2] += deep_sizeof(obj)
+        t[0] += 1
+        return t[2] // t[1]
+
+
+def _load(path: str) -> Iterator:
+    with open(path, "rb") as f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            yield from chunk
+
+
+class SpillList:
+    def __init__(self, memory_budget: int,
+                 key: Optional[Callable] = None,
+                 directory: Optional[str] = None):
+        '''
+        memory_budget: メモリに持つ分の上限(バイト)。
+        directory: 一時ファイルを置く場所(既定は tempfile の場所)
+        '''
+        self.memory_budget = memory_budget
+        self.key = key
+        self.directory = directory
+        self.items: list = []
+        self.nbytes = 0
+        self.runs: list[str] = []
+        self.spilled = 0
+        self._estimate = _SizeEstimate()
+        self._tmpdir: Optional[str] = None
+        self._finalizer: Optional[weakref.finalize] = None
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.items)
+
+    def append(self, item) -> None:
+        self.items.append(item)
+        self.nbytes += self._estimate(item)
+        if self.nbytes > self.memory_budget:
+            self.spill()
+
+    def extend(self, items: Iterable) -> None:
+        for item in items:
+            self.append(item)
+
+    def __iadd__(self, items: Iterable) -> "SpillList":
+        self.extend(items)
+        return self
+
+    def spill(self) -> None:
+        '''メモリにあるものを一時ファイル1つに書き出す'''
+        if not self.items:
+            return
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="lmapi-spill-",
+                                            dir=self.directory)
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._tmpdir, True)
+        if self.key is not None:
+            self.items.sort(key=self.key)
+        path = os.path.join(self._tmpdir, f"{len(self.runs)}.pickle")
+        with open(path, "wb") as f:
+            for i in range(0, len(self.items), CHUNK):
+                pickle.dump(self.items[i:i+CHUNK], f,
+                            pickle.HIGHEST_PROTOCOL)
+        self.runs.append(path)
+        self.spilled += len(self.items)
+        self.items = []
+        self.nbytes = 0
+
+    def __iter__(self) -> Iterator:
+        if self.key is None:
+            for path in self.runs:
+                yield from _load(path)
+            yield from list(self.items)
+            return
+        self.items.sort(key=self.key)
+        yield from heapq.merge(*[_load(path) for path in self.runs],
+                               list(self.items), key=self.key)
+
+    def close(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+        self._tmpdir = None
+        self._finalizer = None
+        self.runs = []
+        self.items = []
+        self.spilled = 0
+        self.nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
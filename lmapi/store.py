@@ -0,0 +1,197 @@
+'''
+decode結果をSQLiteに貯める
+
+SQLiteSink は Sink なので read_pcapfile(sink=...) やリアルタイム監視に
+そのまま渡せる。書き込みスレッドがバッチごとに executemany で1トランザクション。
+
+    with SQLiteSink("lm.sqlite3") as store:
+        read_pcapfile("test.pcap", ["370b00"], [], sink=store)
+
+    rows = query("lm.sqlite3",
+                 "SELECT player, count(*) FROM gifts GROUP BY player")
+'''
+import json
+import sqlite3
+import time
+from dataclasses import asdict
+from typing import Callable
+from .lmdataclass import (
+    Comment, Gift, GiftPopup, HuntReport, MapObject, Player,
+    ResultOpenChests,
+)
+from .sinks import Sink
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS gifts (
+    sort_index INTEGER, time INTEGER, gift_id TEXT, item_id TEXT,
+    number_of_item INTEGER, material_quality INTEGER, player TEXT,
+    gift_name TEXT, gift_rank INTEGER, gift_source INTEGER, monster TEXT,
+    item_name TEXT, item_category TEXT, time_gift_opened INTEGER
+);
+CREATE INDEX IF NOT EXISTS gifts_time ON gifts (time);
+CREATE INDEX IF NOT EXISTS gifts_player ON gifts (player);
+
+CREATE TABLE IF NOT EXISTS gift_popups (
+    counter INTEGER, gift_id TEXT, player TEXT, unixtime INTEGER,
+    counter2 INTEGER, gift_name TEXT, gift_rank INTEGER, monster TEXT
+);
+CREATE INDEX IF NOT EXISTS gift_popups_time ON gift_popups (unixtime);
+CREATE INDEX IF NOT EXISTS gift_popups_player ON gift_popups (player);
+
+CREATE TABLE IF NOT EXISTS players (
+    iggid INTEGER, avatar_id INTEGER, name TEXT, guild_rank INTEGER,
+    might INTEGER, kills INTEGER, lastseen INTEGER, time INTEGER
+);
+CREATE INDEX IF NOT EXISTS players_time ON players (time);
+CREATE INDEX IF NOT EXISTS players_iggid ON players (iggid);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+
+CREATE TABLE IF NOT EXISTS comments (
+    chat_place TEXT, time INTEGER, iggid INTEGER, comment_count INTEGER,
+    chat_type TEXT, player TEXT, unk1 TEXT, guild_tag TEXT, color TEXT,
+    title TEXT, unk2 TEXT, comment TEXT
+);
+CREATE INDEX IF NOT EXISTS comments_time ON comments (time);
+CREATE INDEX IF NOT EXISTS comments_player ON comments (player);
+CREATE INDEX IF NOT EXISTS comments_iggid ON comments (iggid);
+CREATE INDEX IF NOT EXISTS comments_guild_tag ON comments (guild_tag);
+
+CREATE TABLE IF NOT EXISTS hunt_reports (
+    time_stamp INTEGER, kingdom INTEGER, x INTEGER, y INTEGER,
+    killed INTEGER, monster_id TEXT, monster_lv INTEGER,
+    hp_start INTEGER, hp_remain INTEGER, hp_maximum INTEGER,
+    player_exp INTEGER, hero_ids TEXT, hero_infos TEXT,
+    hunt_in_a_row INTEGER, energy_used INTEGER, energy_dealt INTEGER,
+    num_kinds INTEGER, rewards TEXT
+);
+CREATE INDEX IF NOT EXISTS hunt_reports_time ON hunt_reports (time_stamp);
+CREATE INDEX IF NOT EXISTS hunt_reports_kxy ON hunt_reports (kingdom, x, y);
+
+CREATE TABLE IF NOT EXISTS open_chests (
+    time INTEGER, chest_id TEXT, chest_name TEXT, items TEXT
+);
+CREATE INDEX IF NOT EXISTS open_chests_time ON open_chests (time);
+
+CREATE TABLE IF NOT EXISTS map_objects (
+    time INTEGER, kingdom INTEGER, x INTEGER, y INTEGER,
+    object_type TEXT, player TEXT, guild_tag TEXT, lv INTEGER, obj TEXT
+);
+CREATE INDEX IF NOT EXISTS map_objects_time ON map_objects (time);
+CREATE INDEX IF NOT EXISTS map_objects_player ON map_objects (player);
+CREATE INDEX IF NOT EXISTS map_objects_guild_tag ON map_objects (guild_tag);
+CREATE INDEX IF NOT EXISTS map_objects_kxy ON map_objects (kingdom, x, y);
+'''
+
+
+def _json(v) -> str:
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+
+def _gift_row(g: Gift, now: int) -> tuple:
+    return (g.sort_index, g.time, g.gift_id, g.item_id, g.number_of_item,
+            g.material_quality, g.player, g.gift_name, g.gift_rank,
+            g.gift_source, g.monster, g.item_name, g.item_category,
+            g.time_gift_opened)
+
+
+def _popup_row(p: GiftPopup, now: int) -> tuple:
+    return (p.counter, p.gift_id, p.player, p.unixtime, p.counter2,
+            p.gift_name, p.gift_rank, p.monster)
+
+
+def _player_row(p: Player, now: int) -> tuple:
+    return (p.iggid, p.avatar_id, p.name, p.guild_rank, p.might, p.kills,
+            p.lastseen, now)
+
+
+def _comment_row(c: Comment, now: int) -> tuple:
+    return (c.chat_place, c.time, c.iggid, c.comment_count, c.chat_type,
+            c.player, c.unk1, c.guild_tag, c.color, c.title, c.unk2,
+            c.comment)
+
+
+def _hunt_row(h: HuntReport, now: int) -> tuple:
+    return (h.time_stamp, h.kingdom, h.x, h.y, int(h.killed), h.monster_id,
+            h.monster_lv, h.hp_start, h.hp_remain, h.hp_maximum,
+            h.player_exp, _json(h.hero_ids), _json(h.hero_infos),
+            h.hunt_in_a_row, h.energy_used, h.energy_dealt, h.num_kinds,
+            _json([asdict(i) for i in h.rewards]))
+
+
+def _chests_row(r: ResultOpenChests, now: int) -> tuple:
+    return (now, r.chest_id, r.chest_name,
+            _json([asdict(i) for i in r.items]))
+
+
+def _map_object_row(m: MapObject, now: int) -> tuple:
+    o = m.obj
+    player = getattr(o, "player", getattr(o, "player_name", ""))
+    kingdom = getattr(o, "kingdom_player", getattr(o, "kingdom", None))
+    if kingdom == "":
+        # 誰もいない資源地
+        kingdom = None
+    return (now, kingdom, m.x, m.y, m.object_type, player,
+            getattr(o, "guild_tag", ""), getattr(o, "lv", None),
+            _json(asdict(o)))
+
+
+# 型 -> (テーブル, 列数, 行を作る関数)
+TABLES: dict[type, tuple[str, int, Callable]] = {
+    Gift: ("gifts", 14, _gift_row),
+    GiftPopup: ("gift_popups", 8, _popup_row),
+    Player: ("players", 8, _player_row),
+    Comment: ("comments", 12, _comment_row),
+    HuntReport: ("hunt_reports", 18, _hunt_row),
+    ResultOpenChests: ("open_chests", 4, _chests_row),
+    MapObject: ("map_objects", 9, _map_object_row),
+}
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def query(path: str, sql: str, params=()) -> list[tuple]:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+class SQLiteSink(Sink):
+    '''TABLES にない型(Castle, InnerGuildBoard, ...)は数えて捨てる'''
+
+    def __init__(self, path: str, batch_size: int = 5000, **kwargs):
+        self.path = path
+        self.skipped = 0
+        self._conn = None
+        super().__init__(batch_size=batch_size, **kwargs)
+
+    def _open(self) -> None:
+        self._conn = connect(self.path)
+
+    def _write_batch(self, records: list) -> None:
+        now = int(time.time())
+        rows: dict[type, list[tuple]] = {}
+        for r in records:
+            t = type(r)
+            if t not in TABLES:
+                self.skipped += 1
+                continue
+            # time 列はキャプチャ時刻。わからないものだけ書き込んだ時刻
+            at = int(r.captured_at) or now
+            rows.setdefault(t, []).append(TABLES[t][2](r, at))
+        with self._conn:
+            for t, values in rows.items():
+                table, ncols, _ = TABLES[t]
+                marks = ", ".join("?"*ncols)
+                self._conn.executemany(
+                    f"INSERT INTO {table} VALUES ({marks})", values)
+
+    def _close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,408 @@
+'''
+負荷試験用の、それっぽい.pcapを作る
+
+    python -m lmapi.synth out.pcap --size 10G
+    python -m lmapi.synth out.pcap --count 100000 --mix ac0817=40,370b00=5
+
+- メッセージは encoders.py で作るので、全部 read_packet で読める
+- 実際のプレーヤーのデータは使わない(名前などは乱数)
+- TCPのストリームを適当なサイズのセグメントに分けて
+  Ethernet/IPv4/TCP(sport=5991)で包む。関係ないパケットも混ぜられる
+'''
+import argparse
+import random
+import struct
+import sys
+import time
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+from .constants import CASTLE_SKINS, FORT_IDS, MONSTER_IDS, OBJECT_TYPES
+from .encoders import encode, verify_records, verify_roundtrip
+from .lmdataclass import (
+    Castle, ChestResult, Comment, Gift, GiftPopup, HuntReport,
+    InnerGuildBoard, LMItem, MapObject, MapObjectCamp, MapObjectCastle,
+    MapObjectFort, MapObjectMonster, MapObjectMoving, MapObjectResourceTile,
+    OuterGuildBoard, Player, ResultOpenChests, SkillActivated,
+)
+
+SERVER_PORT = 5991
+SYLLABLES = ["ka", "ri", "no", "ta", "ma", "su", "ke", "ro", "mi", "ya",
+             "ne", "zu", "ho", "ku", "sa", "to"]
+ITEM_IDS = ["f103", "f203", "f303", "1004", "1104", "0100", "e903", "1b04"]
+
+# code -> 割合
+DEFAULT_MIX: dict[str, float] = {
+    "ac0817": 40,
+    "bb0b00": 20,
+    "5e0d01": 10,
+    "370b00": 5,
+    "310b00": 5,
+    "2b0b12": 5,
+    "7f0500": 5,
+    "ac080c": 3,
+    "2b0b13": 2,
+    "232000": 2,
+    "060b00": 1,
+    "2a0b00": 1,
+    "f20af0": 1,
+}
+
+
+def _f32(x: float) -> float:
+    '''メッセージには float32 で入るので、decode して戻る値にしておく'''
+    return struct.unpack("<f", struct.pack("<f", x))[0]
+
+
+class RecordFactory:
+    '''ランダムな dataclass を作る。同じ seed なら同じものができる'''
+
+    def __init__(self, seed=0, kingdom=690):
+        self.rnd = random.Random(seed)
+        self.kingdom = kingdom
+        self.now = 1650000000
+        self.players = [self.name() for _ in range(200)]
+        self.tags = ["".join(self.rnd.choice("ABCDEFGHJKLMNPRSTUVWXYZ")
+                             for _ in range(3)) for _ in range(20)]
+        self.comment_count = 0
+
+    def name(self) -> str:
+        n = "".join(self.rnd.choice(SYLLABLES)
+                    for _ in range(self.rnd.randint(2, 6)))
+        return n.capitalize()
+
+    def player(self) -> str:
+        return self.rnd.choice(self.players)
+
+    def tag(self) -> str:
+        return self.rnd.choice(self.tags)
+
+    def xy(self) -> tuple[int, int]:
+        y = self.rnd.randint(0, 1023)
+        return self.rnd.randrange(y & 1, 512, 2), y
+
+    def tick(self) -> int:
+        self.now += self.rnd.randint(0, 3)
+        return self.now
+
+    def gift(self) -> Gift:
+        return Gift(
+            sort_index=self.rnd.randint(1, 2**31), time=self.tick(),
+            gift_id=self.rnd.choice(ITEM_IDS),
+            item_id=self.rnd.choice(ITEM_IDS),
+            number_of_item=self.rnd.randint(1, 9), material_quality=0,
+            player=self.player())
+
+    def gift_popup(self) -> GiftPopup:
+        return GiftPopup(
+            counter=self.rnd.randint(0, 65535),
+            gift_id=self.rnd.choice(ITEM_IDS), player=self.player(),
+            unixtime=self.tick(), counter2=self.rnd.randint(0, 1000))
+
+    def players_(self, n: int) -> list[Player]:
+        return [Player(
+            iggid=self.rnd.randint(10**6, 2**31), avatar_id=3,
+            name=p, guild_rank=self.rnd.randint(1, 5),
+            might=self.rnd.randint(10**5, 10**9),
+            kills=self.rnd.randint(0, 10**7), lastseen=self.tick(),
+        ) for p in self.rnd.sample(self.players, n)]
+
+    def map_object(self) -> MapObject:
+        x, y = self.xy()
+        kind = self.rnd.random()
+        if kind < 0.35:
+            t = self.rnd.choice(list(OBJECT_TYPES)[:5])
+            occupied = self.rnd.random() < 0.3
+            return MapObject(x, y, t, MapObjectResourceTile(
+                resource=OBJECT_TYPES[t], lv=self.rnd.randint(1, 5),
+                player=self.player() if occupied else "",
+                guild_tag=self.tag() if occupied else "",
+                kingdom_player=self.kingdom if occupied else "",
+                maximum_resource=self.rnd.randint(10**4, 10**6),
+                remaining_percentage=_f32(self.rnd.random()*100),
+                timestamp=self.tick()))
+        elif kind < 0.6:
+            return MapObject(x, y, "0a", MapObjectMonster(
+                lv=self.rnd.randint(1, 5),
+                monster_id=self.rnd.choice(list(MONSTER_IDS)),
+                time_remain=self.rnd.randint(0, 86400),
+                hp_percentage=_f32(self.rnd.random())))
+        elif kind < 0.85:
+            return MapObject(x, y, "08", MapObjectCastle(
+                player=self.player(), guild_tag=self.tag(),
+                kingdom_player=self.kingdom, lv=self.rnd.randint(1, 25),
+                status_flag=0, title=0, kingdom_guild=self.kingdom,
+                castle_skin_id=self.rnd.choice(list(CASTLE_SKINS)),
+                castle_skin_lv=1))
+        elif kind < 0.9:
+            return MapObject(x, y, "09", MapObjectCamp(
+                player=self.player(), guild_tag=self.tag(),
+                kingdom_player=self.kingdom, lv=self.rnd.randint(1, 25),
+                status_flag=0, title=0, kingdom_guild=self.kingdom))
+        elif kind < 0.92:
+            return MapObject(x, y, "0b", MapObjectFort(
+                fort_id=self.rnd.choice(list(FORT_IDS)),
+                player_name=self.player(), guild_tag=self.tag(),
+                kingdom_player=self.kingdom, kingdom_guild=self.kingdom,
+                kingdom_fort=self.kingdom))
+        (xf, yf), (xt, yt) = self.xy(), self.xy()
+        return MapObject(0, 0, "00", MapObjectMoving(
+            player=self.player(), guild_tag=self.tag(),
+            kingdom=self.kingdom, xfrom=xf, yfrom=yf, xto=xt, yto=yt,
+            time_stamp=self.tick(), total_sec=self.rnd.randint(10, 3600),
+            mode=self.rnd.choice(["01", "04", "05", "06"])))
+
+    def hunt_report(self) -> HuntReport:
+        x, y = self.xy()
+        hp_max = self.rnd.randint(10**5, 10**8)
+        hp_start = self.rnd.randint(hp_max//10, hp_max)
+        rewards = [LMItem(self.rnd.choice(ITEM_IDS), self.rnd.randint(1, 9),
+                          self.rnd.randint(0, 4))
+                   for _ in range(self.rnd.randint(1, 6))]
+        return HuntReport(
+            time_stamp=self.tick(), kingdom=self.kingdom, x=x, y=y,
+            killed=self.rnd.random() < 0.3,
+            monster_id=self.rnd.choice(list(MONSTER_IDS)),
+            monster_lv=self.rnd.randint(1, 5), hp_start=hp_start,
+            hp_remain=self.rnd.randint(0, hp_start), hp_maximum=hp_max,
+            player_exp=self.rnd.randint(0, 10**5),
+            hero_ids=[f"{self.rnd.randint(1, 90):02x}00" for _ in range(5)],
+            hero_infos=["%016x" % self.rnd.getrandbits(64)
+                        for _ in range(5)],
+            hunt_in_a_row=self.rnd.randint(0, 20),
+            energy_used=self.rnd.randint(1, 40),
+            energy_dealt=self.rnd.randint(1, 40),
+            num_kinds=len(rewards), rewards=rewards)
+
+    def comment(self) -> Comment:
+        self.comment_count += 1
+        text = " ".join(self.name().lower()
+                        for _ in range(self.rnd.randint(1, 12)))
+        return Comment(
+            chat_place=self.rnd.choice(["000100", "ff0100"]),
+            time=self.tick(), iggid=self.rnd.randint(0, 2**31),
+            comment_count=self.comment_count, chat_type="00",
+            player=self.player(), unk1="01", guild_tag=self.tag(),
+            color="00", title="00", unk2="00", comment=text)
+
+    def open_chests(self) -> ResultOpenChests:
+        return ResultOpenChests(
+            chest_id=self.rnd.choice(ITEM_IDS),
+            items=[ChestResult(self.rnd.choice(ITEM_IDS),
+                               self.rnd.randint(1, 99),
+                               self.rnd.randint(0, 4))
+                   for _ in range(self.rnd.randint(1, 8))])
+
+    def castle(self) -> Castle:
+        return Castle(
+            tile_id=self.rnd.getrandbits(63), unk_2f=0x2f,
+            guid="%08x" % self.rnd.getrandbits(32),
+            long_guild_name=self.name(), vip_level=self.rnd.randint(0, 15),
+            guild_rank=self.rnd.randint(1, 5), unk4=0,
+            might=self.rnd.randint(10**5, 10**9),
+            troops_killed=self.rnd.randint(0, 10**7))
+
+    def outer_guild_board(self) -> OuterGuildBoard:
+        return OuterGuildBoard(
+            guild_id="%010x" % self.rnd.getrandbits(40),
+            guild_leader=self.player(), guild_tag=self.tag(),
+            long_guild_name=self.name(), board="0"*2600,
+            guild_slogan=self.name(), unknown1="0"*20,
+            gift_level=self.rnd.randint(1, 25), kingdom=self.kingdom,
+            unknown2="00", guild_fest_rank=self.rnd.randint(0, 4),
+            guild_showdown_rank=self.rnd.randint(1, 5),
+            da_cups=self.rnd.randint(0, 99),
+            guild_bash_rank=self.rnd.randint(1, 5))
+
+    def inner_guild_board(self) -> InnerGuildBoard:
+        return InnerGuildBoard(
+            guild_id="%08x" % self.rnd.getrandbits(32),
+            guild_leader=self.player(), unknown1="0"*8, unknown2="00",
+            guild_tag=self.tag(), long_guild_name=self.name(),
+            guild_slogan=self.name(), board="0"*1800, unknown3="0"*10,
+            unknown4="e40700000000", unknown5="0"*12,
+            kingdom=self.kingdom, unknown6="0"*8, unknown7="0"*4,
+            unknown8="0"*4, unknown9="0"*6,
+            guild_fest_rank=self.rnd.randint(0, 4),
+            guild_showdown_rank=self.rnd.randint(1, 5),
+            da_cups=self.rnd.randint(0, 99),
+            guild_bash_rank=self.rnd.randint(1, 5), unknowna="01")
+
+    def skill(self) -> SkillActivated:
+        return SkillActivated(
+            time_activated_lasttime=self.tick(),
+            skill_code=self.rnd.choice(["1d004700", "3a005600", "34004400"]))
+
+    def records_for(self, code: str) -> list:
+        '''code のメッセージ1つ分'''
+        rnd = self.rnd
+        if code == "370b00":
+            return [self.gift() for _ in range(rnd.randint(1, 60))]
+        elif code == "060b00":
+            return self.players_(rnd.randint(10, 100))
+        elif code == "ac080c":
+            return [self.castle()]
+        elif code.startswith("ac08") or code.startswith("ba08"):
+            return [self.map_object() for _ in range(rnd.randint(1, 40))]
+        elif code.startswith("5e0d"):
+            return [self.hunt_report()]
+        elif code.startswith("f20a"):
+            return [self.inner_guild_board()]
+        makers: dict[str, Callable] = {
+            "310b00": self.gift,
+            "2b0b12": self.gift_popup,
+            "2b0b13": self.gift_popup,
+            "bb0b00": self.comment,
+            "7f0500": self.open_chests,
+            "2a0b00": self.outer_guild_board,
+            "232000": self.skill,
+        }
+        if code not in makers:
+            raise NotImplementedError(f"no generator for {code}")
+        return [makers[code]()]
+
+
+def iter_messages(mix: Optional[dict[str, float]] = None,
+                  seed=0) -> Iterator[str]:
+    '''mix の割合で code を選んで、メッセージを延々と返す'''
+    mix = mix or DEFAULT_MIX
+    factory = RecordFactory(seed)
+    codes = list(mix)
+    weights = [mix[c] for c in codes]
+    while True:
+        code = factory.rnd.choices(codes, weights)[0]
+        yield encode(code, factory.records_for(code))
+
+
+def write_pcap_header(f: BinaryIO) -> None:
+    f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+
+
+def write_tcp_record(f: BinaryIO, timestamp: float, src: bytes, dst: bytes,
+                     sport: int, dport: int, seq: int,
+                     payload: bytes) -> int:
+    '''Ethernet/IPv4/TCP のフレームを1つ書いて、書いたバイト数を返す'''
+    tcp = struct.pack(">HHIIBBHHH", sport, dport, seq & 0xffffffff, 0,
+                      0x50, 0x18, 65535, 0, 0) + payload
+    ip = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20+len(tcp), 0, 0x4000,
+                     64, 6, 0, src, dst) + tcp
+    frame = b"\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb\x08\x00" + ip
+    sec = int(timestamp)
+    f.write(struct.pack("<IIII", sec, int((timestamp-sec)*1e6),
+                        len(frame), len(frame)))
+    f.write(frame)
+    return 16 + len(frame)
+
+
+def write_pcap(path: str, messages: Iterable[str],
+               size: Optional[int] = None, count: Optional[int] = None,
+               seed=0, flows=1, noise=0.2, mss=1460,
+               start_time=1650000000.0, rate=200.0) -> dict:
+    '''
+    messages を TCP のセグメントに分けて path に書く。
+    size (バイト) か count (メッセージ数) に達したら終わる。
+
+    - flows: サーバー(sport=5991)からの接続の数。メッセージは接続ごとに
+             ばらばらに流れる(1つなら read_pcapfile でそのまま読める)
+    - noise: ゲームと関係ないパケットの割合
+    - rate:  1秒あたりのメッセージ数
+    '''
+    rnd = random.Random(seed)
+    server = bytes([47, 74, 0, 1])
+    client = bytes([10, 0, 0, 2])
+    ports = [rnd.randint(40000, 60000) for _ in range(flows)]
+    seqs = [rnd.getrandbits(32) for _ in range(flows)]
+    buffers = [bytearray() for _ in range(flows)]
+    written = 24
+    n_messages = 0
+    n_packets = 0
+    t = start_time
+
+    def flush(k: int, force: bool) -> None:
+        nonlocal written, n_packets
+        buf = buffers[k]
+        # 短いメッセージはまとめて送られることが多い
+        while len(buf) >= mss or (force and buf):
+            n = min(len(buf), rnd.randint(mss//4, mss))
+            written += write_tcp_record(
+                f, t, server, client, SERVER_PORT, ports[k], seqs[k],
+                bytes(buf[:n]))
+            seqs[k] += n
+            del buf[:n]
+            n_packets += 1
+        if noise and rnd.random() < noise:
+            written += write_tcp_record(
+                f, t, bytes([142, 250, 0, 1]), client, 443, 50000,
+                rnd.getrandbits(32), rnd.randbytes(rnd.randint(1, 1400)))
+            n_packets += 1
+
+    with open(path, "wb") as f:
+        write_pcap_header(f)
+        for message in messages:
+            if size is not None and written >= size:
+                break
+            if count is not None and n_messages >= count:
+                break
+            k = rnd.randrange(flows)
+            buffers[k] += bytes.fromhex(message)
+            n_messages += 1
+            t += rnd.expovariate(rate)
+            flush(k, rnd.random() < 0.5)
+        for k in range(flows):
+            flush(k, True)
+    return {"messages": n_messages, "packets": n_packets, "bytes": written}
+
+
+def parse_size(s: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if s[-1].upper() in units:
+        return int(float(s[:-1]) * units[s[-1].upper()])
+    return int(s)
+
+
+def parse_mix(s: str) -> dict[str, float]:
+    mix = {}
+    for item in s.split(","):
+        code, _, weight = item.partition("=")
+        mix[code] = float(weight or 1)
+    return mix
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="write a synthetic pcap")
+    parser.add_argument("output")
+    parser.add_argument("--size", type=parse_size,
+                        help="stop at this file size (e.g. 500M, 10G)")
+    parser.add_argument("--count", type=int,
+                        help="stop after this many messages")
+    parser.add_argument("--mix", type=parse_mix,
+                        help="code=weight,... (default: DEFAULT_MIX)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flows", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=0.2)
+    parser.add_argument("--rate", type=float, default=200.0)
+    parser.add_argument("--verify", action="store_true",
+                        help="round-trip 100 messages per code first")
+    args = parser.parse_args(argv)
+    if args.size is None and args.count is None:
+        parser.error("--size or --count is required")
+
+    if args.verify:
+        factory = RecordFactory(args.seed)
+        for code in (args.mix or DEFAULT_MIX):
+            messages = iter_messages({code: 1}, args.seed)
+            for _ in range(100):
+                verify_roundtrip(next(messages))
+                verify_records(code, factory.records_for(code))
+            print(f"{code}: round trip ok")
+
+    started = time.time()
+    stats = write_pcap(args.output, iter_messages(args.mix, args.seed),
+                       size=args.size, count=args.count, seed=args.seed,
+                       flows=args.flows, noise=args.noise, rate=args.rate)
+    print(f"{args.output}: {stats['messages']} messages, "
+          f"{stats['packets']} packets, {stats['bytes']/1024/1024:.1f}MB "
+          f"in {time.time()-started:.1f}sec")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())